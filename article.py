@@ -22,26 +22,85 @@
 Note:
     Class for saving wikipedia articles. An article can
     have multiple entries of multiple authors.
+
+    With a memory budget (see budget module) the entries are
+    moved to a spill file when the budget is exceeded.
 -----------------------------------------------------------
 """
 from __future__ import division
+import cPickle
+import os
+
+# minimum size of the entries of an article which get spilled
+SPILL_MIN_BYTES = 1024 * 1024
 
 class article(object):
-    def __init__(self, article_id, article_title):
+    def __init__(self, article_id, article_title, budget=None):
         self.article_id = article_id
         self.article_title = article_title
         self.authors = 0
         self.entries = []
         self.lines = 0
+        self.end = 0
+        self.author_ids = set()
+        self.budget = budget
+        self.entry_bytes = 0
+        self.spill_path = None
+
+    def __getstate__(self):
+        # the budget belongs to the process which built the article
+        state = self.__dict__.copy()
+        state['budget'] = None
+        return state
 
     def append(self, entry):
         """Append new entry to article."""
         self.entries.append(entry)
-        self.authors = len(set(map(lambda entry: entry.author_id, self.entries)))
+        self.author_ids.add(entry.author_id)
+        self.authors = len(self.author_ids)
         self.lines += entry.len
+        self.end = entry.end
+        if self.budget is not None:
+            self.entry_bytes += len(entry.text)
+            self.budget.reserve(len(entry.text))
+            if self.budget.over() and self.entry_bytes >= SPILL_MIN_BYTES:
+                self.spill()
 
     def current_pos(self):
         """Return current length of the article."""
-        if len(self.entries) != 0:
-            return self.entries[-1].end
-        return 0
\ No newline at end of file
+        return self.end
+
+    def spill(self):
+        """Move the entries in memory to the spill file."""
+        if self.spill_path is None:
+            self.spill_path = self.budget.spill_file("article_")
+        with open(self.spill_path, "ab") as f:
+            for entry in self.entries:
+                cPickle.dump(entry, f, cPickle.HIGHEST_PROTOCOL)
+        self.entries = []
+        self.release()
+
+    def all_entries(self):
+        """Yield all entries (spilled ones first)."""
+        if self.spill_path is not None:
+            with open(self.spill_path, "rb") as f:
+                while True:
+                    try:
+                        yield cPickle.load(f)
+                    except EOFError:
+                        break
+        for entry in self.entries:
+            yield entry
+
+    def release(self):
+        """Release the bytes of the entries in memory from the budget."""
+        if self.budget is not None:
+            self.budget.release(self.entry_bytes)
+        self.entry_bytes = 0
+
+    def close(self):
+        """Release the budget and remove the spill file."""
+        self.release()
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spill_path = None
\ No newline at end of file
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - benchmark module
+-----------------------------------------------------------
+
+Use:
+    benchmark.py readers <dumpfile>
+        compare the legacy iterparse loop of wikidump.py with
+        the streaming dumpreader (events per second, revisions
+        per second and peak memory of each reader)
+    benchmark.py lexer <dumpfile> [max_revisions]
+        run the second parse pass with the regex and the lexer
+        engine on the (first pass) texts of the revisions of a
+        dump (golden corpus): differing texts and the time of
+        each engine
+    benchmark.py templates <dumpfile> [max_revisions]
+        compare the template removal of the first parse pass with
+        the legacy loop (which copied the rest of the text after
+        every template) on the revisions of a dump, the largest
+        revisions are listed with the time of both
+
+Note:
+    Every benchmark runs in its own process, so the peak
+    memory (maxrss) is measured per benchmark.
+-----------------------------------------------------------
+"""
+from lxml import etree
+from multiprocessing import Process
+from multiprocessing import Queue
+import bz2
+import dumpreader
+import os
+import parse
+import regex
+import resource
+import sys
+import time
+
+def open_dump(path):
+    """Open a bz2 or xml dump file."""
+    if os.path.splitext(path)[1] == ".bz2":
+        return bz2.BZ2File(path, "r", 2048)
+    return open(path, "rb")
+
+def bench_legacy_reader(path):
+    """Iterate like the legacy loop: start and end events, clear() only."""
+    events = 0
+    revisions = 0
+    ns = None
+    with open_dump(path) as f:
+        for event, elem in etree.iterparse(f, events=("start", "end")):
+            events += 1
+            if ns is None:
+                ns = "{" + etree.QName(elem).namespace + "}"
+            if event == "end" and etree.QName(elem).localname == "revision":
+                revisions += 1
+                for rev_elem in elem.iter():
+                    etree.QName(rev_elem).localname
+                    etree.QName(rev_elem.getparent()).localname
+                    rev_elem.text
+                elem.clear()
+            elif event == "end" and elem.tag == ns + "page":
+                elem.clear()
+    return events, revisions
+
+def bench_streaming_reader(path):
+    """Iterate with dumpreader.DumpReader."""
+    events = 0
+    revisions = 0
+    with open_dump(path) as f:
+        reader = dumpreader.DumpReader(f)
+        for kind, meta, elem in reader:
+            events += 1
+            if kind == dumpreader.REVISION:
+                revisions += 1
+                for rev_elem in elem:
+                    rev_elem.tag
+                    rev_elem.text
+    return events, revisions
+
+def run_measured(func, path, queue):
+    """Run a benchmark and put (events, revisions, seconds, maxrss) into queue."""
+    start = time.time()
+    events, revisions = func(path)
+    elapsed = time.time() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((events, revisions, elapsed, maxrss))
+
+def measure(func, path):
+    """Run a benchmark in a new process and return its results."""
+    queue = Queue()
+    p = Process(target=run_measured, args=(func, path, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def compare_readers(path):
+    """Print results of the legacy and the streaming reader."""
+    for name, func in (("legacy", bench_legacy_reader), ("streaming", bench_streaming_reader)):
+        events, revisions, elapsed, maxrss = measure(func, path)
+        print "{:<10} {:>12,} events {:>12,.0f} events/s {:>10,.0f} revisions/s {:>8,} KB maxrss".format(
+            name, events, events / max(elapsed, 1e-9), revisions / max(elapsed, 1e-9), maxrss)
+
+def revision_texts(path, max_revisions=0):
+    """Yield the texts of the revisions of a dump file."""
+    count = 0
+    with open_dump(path) as f:
+        for kind, meta, elem in dumpreader.DumpReader(f):
+            if kind != dumpreader.REVISION:
+                continue
+            for rev_elem in elem:
+                if etree.QName(rev_elem).localname == "text" and rev_elem.text:
+                    yield rev_elem.text
+            count += 1
+            if count == max_revisions:
+                return
+
+def compare_second_pass(path, max_revisions=0):
+    """Compare the regex and the lexer engine of the second parse pass."""
+    texts = 0
+    differing = 0
+    elapsed = {"regex": 0.0, "lexer": 0.0}
+    for text in revision_texts(path, max_revisions):
+        text, is_malformed = parse.first_pass(text)
+        if is_malformed:
+            continue
+        texts += 1
+        results = {}
+        for engine in ("regex", "lexer"):
+            parse.second_pass_engine = engine
+            start = time.time()
+            results[engine] = parse.second_pass(text)
+            elapsed[engine] += time.time() - start
+        if results["regex"] != results["lexer"]:
+            differing += 1
+            print "differing text:\n{}\n".format(text[:500].encode("UTF-8"))
+    print "{:,} texts, {:,} differing".format(texts, differing)
+    for engine in ("regex", "lexer"):
+        print "{:<6} {:>10.3f} s".format(engine, elapsed[engine])
+
+def legacy_first_pass(string):
+    """Remove templates like the legacy first pass: rescan and copy the rest after every template."""
+    temp = regex.html_entities.sub(parse.unescape, string)
+    is_malformed = False
+    found_pos = 0
+    while found_pos != -1:
+        found_pos = temp.find("{", found_pos)
+        if found_pos != -1:
+            rest = temp[found_pos:]
+            add_temp, end = parse.remove_bracket(rest)
+            if end is None:
+                is_malformed = True
+            else:
+                add_temp += rest[end:]
+            temp = temp[:found_pos] + add_temp
+    for r in parse.remove_strings:
+        temp = temp.replace(r, "")
+    return temp, is_malformed
+
+def compare_first_pass(path, max_revisions=0, largest=10):
+    """Compare the first parse pass with the legacy template removal."""
+    texts = 0
+    differing = 0
+    elapsed = {"legacy": 0.0, "first_pass": 0.0}
+    sizes = []
+    # same dummy results of date templates
+    parse.deterministic_dummies = True
+    for text in revision_texts(path, max_revisions):
+        texts += 1
+        results = {}
+        times = {}
+        for name, func in (("legacy", legacy_first_pass), ("first_pass", parse.first_pass)):
+            start = time.time()
+            results[name] = func(text)
+            times[name] = time.time() - start
+            elapsed[name] += times[name]
+        if results["legacy"] != results["first_pass"]:
+            differing += 1
+        sizes.append((len(text), text.count("{{"), times["legacy"], times["first_pass"]))
+    print "{:,} texts, {:,} differing".format(texts, differing)
+    for name in ("legacy", "first_pass"):
+        print "{:<10} {:>10.3f} s".format(name, elapsed[name])
+    for size, templates, legacy, first in sorted(sizes, reverse=True)[:largest]:
+        print "{:>10,} chars {:>6,} templates  legacy {:>8.4f} s  first_pass {:>8.4f} s".format(
+            size, templates, legacy, first)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == "readers":
+        compare_readers(sys.argv[2])
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "lexer":
+        compare_second_pass(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 0)
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "templates":
+        compare_first_pass(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 0)
+    else:
+        print __doc__
+        sys.exit(1)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - budget module
+-----------------------------------------------------------
+
+Note:
+    Memory budget of a process. The parts which hold texts of
+    unlimited size reserve their bytes and free memory when the
+    budget is exceeded:
+        the revision pipeline resolves revisions early
+        (backpressure on the reader),
+        the page pipeline writes revision texts which do not
+        fit into its ring to a spill file,
+        an article moves its entries to a spill file.
+
+    Only these texts are counted, not the memory of the process.
+-----------------------------------------------------------
+"""
+import os
+import tempfile
+
+
+class MemoryBudget(object):
+    def __init__(self, limit, spill_dir=None):
+        """Initializes a MemoryBudget object
+
+        Args:
+            limit: Number of bytes of texts a process may hold
+                    (0 for no limit).
+            spill_dir: Directory of spill files (None for the
+                    temp directory of the system).
+        """
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.used = 0
+        self.peak = 0
+        self.spills = 0
+
+    def reserve(self, size):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def release(self, size):
+        self.used -= size
+
+    def over(self):
+        """Return True if more than the limit is reserved."""
+        return self.limit > 0 and self.used > self.limit
+
+    def spill_file(self, prefix):
+        """Create a new spill file and return its path."""
+        self.spills += 1
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=".spill", dir=self.spill_dir)
+        os.close(fd)
+        return path
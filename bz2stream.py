@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - bz2stream module
+-----------------------------------------------------------
+
+Note:
+    Multi-core decompression of bz2 dump files. The compressed
+    file is cut at bz2 stream boundaries (multistream dumps,
+    files written by pbzip2/lbzip2), the segments are
+    decompressed in a process pool and handed to the xml parser
+    as one ordered byte stream.
+
+    Block boundaries inside a single stream are not byte aligned,
+    so single-stream files are read sequentially by a
+    BZ2RangeFile over the whole file (unlike the BZ2File of
+    Python 2 it does not stop after the first stream).
+-----------------------------------------------------------
+"""
+from collections import deque
+from multiprocessing import Pool
+import bz2
+import logging
+import re
+
+stream_header = re.compile(r"BZh[1-9]1AY&SY")
+header_len = 10
+
+SCAN_CHUNK_SIZE = 1024 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+PROBE_SIZE = 4 * SEGMENT_SIZE
+
+def open_dump(path, processes, segment_size=SEGMENT_SIZE):
+    """Return a file object for the bz2 file at path.
+
+    A ParallelBZ2File is returned if the file consists of more
+    than one bz2 stream, otherwise a BZ2RangeFile reading all
+    streams sequentially.
+    """
+    if processes > 0 and is_multistream(path):
+        logging.info("multistream bz2 file, decompressing with {} processes".format(processes))
+        return ParallelBZ2File(path, processes, segment_size)
+    return BZ2RangeFile(path, 0, None)
+
+def is_multistream(path, probe_size=PROBE_SIZE):
+    """Return true if a second bz2 stream starts within probe_size bytes."""
+    for offset in find_stream_offsets(path):
+        if offset > probe_size:
+            return False
+        if offset > 0:
+            return True
+    return False
+
+def find_stream_offsets(path, chunk_size=SCAN_CHUNK_SIZE):
+    """Yield the byte offsets of all bz2 stream headers in a file."""
+    with open(path, "rb") as f:
+        pos = 0
+        tail = ""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = tail + chunk
+            base = pos - len(tail)
+            for match in stream_header.finditer(data):
+                yield base + match.start()
+            pos += len(chunk)
+            # keep an overlap, a header may span two chunks
+            tail = data[-(header_len - 1):]
+
+def iter_segments(path, segment_size=SEGMENT_SIZE):
+    """Yield (start, end) ranges of whole streams, about segment_size bytes each.
+
+    The end of the last segment is None (read until end of file).
+    """
+    seg_start = None
+    for offset in find_stream_offsets(path):
+        if seg_start is None:
+            seg_start = offset
+        elif offset - seg_start >= segment_size:
+            yield seg_start, offset
+            seg_start = offset
+    if seg_start is not None:
+        yield seg_start, None
+
+def decompress_segment(path, start, end):
+    """Decompress all streams in a byte range of a bz2 file.
+
+    Returns a tuple (data, complete). complete is False if the
+    last stream of the range did not reach its end of stream
+    marker or the range did not start with a valid stream.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        if end is None:
+            compressed = f.read()
+        else:
+            compressed = f.read(end - start)
+
+    result = []
+    complete = False
+    try:
+        while compressed:
+            decompressor = bz2.BZ2Decompressor()
+            result.append(decompressor.decompress(compressed))
+            compressed = decompressor.unused_data
+            try:
+                decompressor.decompress("")
+                complete = False
+            except EOFError:
+                complete = True
+    except IOError:
+        complete = False
+    return "".join(result), complete
+
+
+class ParallelBZ2File(object):
+    """Read-only file object decompressing a multistream bz2 file in parallel."""
+
+    def __init__(self, path, processes=2, segment_size=SEGMENT_SIZE, window=None):
+        """Initializes a ParallelBZ2File object
+
+        Args:
+            path: A path to a multistream bz2 file.
+            processes: Number of decompressing processes.
+            segment_size: Approximate compressed size of the
+                    segments handed to a single process.
+            window: Maximum number of segments in flight,
+                    defaults to twice the number of processes.
+        """
+        self.path = path
+        self.pool = Pool(processes=processes)
+        self.window = window or 2 * processes
+        self.segments = iter_segments(path, segment_size)
+        self.pending = deque()
+        self.buffer = ""
+        self.buffer_pos = 0
+        self.closed = False
+        self.fill_window()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def fill_window(self):
+        """Submit segments until window is full."""
+        while len(self.pending) < self.window:
+            try:
+                start, end = next(self.segments)
+            except StopIteration:
+                break
+            result = self.pool.apply_async(decompress_segment, (self.path, start, end))
+            self.pending.append((start, end, result))
+
+    def next_block(self):
+        """Return the next decompressed block in file order (None at EOF)."""
+        if not self.pending:
+            return None
+        start, end, result = self.pending.popleft()
+        data, complete = result.get()
+
+        while not complete:
+            if end is None:
+                raise EOFError("compressed file ended before the logical end-of-stream was detected")
+            # the next segment did not start at a real stream header,
+            # decompress both ranges as one
+            logging.warning("bz2 segment {}-{} incomplete, merging with next segment".format(start, end))
+            if not self.pending:
+                self.fill_window()
+            if self.pending:
+                end = self.pending.popleft()[1]
+            else:
+                end = None
+            data, complete = decompress_segment(self.path, start, end)
+
+        self.fill_window()
+        return data
+
+    def read(self, size=-1):
+        """Read at most size decompressed bytes (all remaining if size < 0)."""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            parts = [self.buffer[self.buffer_pos:]]
+            block = self.next_block()
+            while block is not None:
+                parts.append(block)
+                block = self.next_block()
+            self.buffer, self.buffer_pos = "", 0
+            return "".join(parts)
+
+        while self.buffer_pos >= len(self.buffer):
+            block = self.next_block()
+            if block is None:
+                return ""
+            self.buffer, self.buffer_pos = block, 0
+
+        data = self.buffer[self.buffer_pos:self.buffer_pos + size]
+        self.buffer_pos += len(data)
+        return data
+
+    def close(self):
+        """Stop decompressing processes."""
+        if not self.closed:
+            self.closed = True
+            self.pool.terminate()
+            self.pool.join()
+            self.pending.clear()
+            self.buffer = ""
+
+
+def peek_stream(path, offset, size=512):
+    """Return the first size decompressed bytes of the stream starting at offset."""
+    reader = BZ2RangeFile(path, offset, None)
+    try:
+        return reader.read(size)
+    except (IOError, EOFError):
+        return ""
+    finally:
+        reader.close()
+
+
+class BZ2RangeFile(object):
+    """Read-only file object decompressing the streams in a byte range of a bz2 file."""
+
+    def __init__(self, path, start, end, chunk_size=SCAN_CHUNK_SIZE):
+        """Initializes a BZ2RangeFile object
+
+        Args:
+            path: A path to a bz2 file.
+            start: Offset of the first stream header.
+            end: Offset of the first stream not to read
+                    (None to read until end of file).
+            chunk_size: Size of compressed reads.
+        """
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.remaining = None if end is None else end - start
+        self.chunk_size = chunk_size
+        self.decompressor = bz2.BZ2Decompressor()
+        self.stream_done = False
+        self.buffer = ""
+        self.buffer_pos = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read_compressed(self):
+        """Return the next compressed chunk of the range."""
+        size = self.chunk_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+            self.remaining -= size
+        if size <= 0:
+            return ""
+        return self.file.read(size)
+
+    def next_block(self):
+        """Return the next decompressed block ("" at the end of the range)."""
+        data = ""
+        while not data:
+            compressed = self.read_compressed()
+            if not compressed:
+                if not self.stream_done:
+                    raise EOFError("compressed file ended before the logical end-of-stream was detected")
+                return ""
+            while compressed:
+                if self.stream_done:
+                    self.decompressor = bz2.BZ2Decompressor()
+                    self.stream_done = False
+                data += self.decompressor.decompress(compressed)
+                compressed = self.decompressor.unused_data
+                if compressed:
+                    self.stream_done = True
+                else:
+                    try:
+                        self.decompressor.decompress("")
+                    except EOFError:
+                        self.stream_done = True
+        return data
+
+    def read(self, size=-1):
+        """Read at most size decompressed bytes (all remaining if size < 0)."""
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if size is None or size < 0:
+            parts = [self.buffer[self.buffer_pos:]]
+            block = self.next_block()
+            while block:
+                parts.append(block)
+                block = self.next_block()
+            self.buffer, self.buffer_pos = "", 0
+            return "".join(parts)
+
+        while self.buffer_pos >= len(self.buffer):
+            block = self.next_block()
+            if not block:
+                return ""
+            self.buffer, self.buffer_pos = block, 0
+
+        data = self.buffer[self.buffer_pos:self.buffer_pos + size]
+        self.buffer_pos += len(data)
+        return data
+
+    def close(self):
+        """Close the underlying file."""
+        if not self.closed:
+            self.closed = True
+            self.file.close()
+            self.buffer = ""
+
+def read_stream(path, offset, chunk_size=SCAN_CHUNK_SIZE):
+    """Return the decompressed data of the single stream starting at offset."""
+    result = []
+    decompressor = bz2.BZ2Decompressor()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            compressed = f.read(chunk_size)
+            if not compressed:
+                raise EOFError("compressed file ended before the logical end-of-stream was detected")
+            result.append(decompressor.decompress(compressed))
+            if decompressor.unused_data:
+                break
+            try:
+                decompressor.decompress("")
+            except EOFError:
+                break
+    return "".join(result)
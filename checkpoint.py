@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - checkpoint module
+-----------------------------------------------------------
+
+Note:
+    Checkpoints of a running dump (or part of a dump). After a
+    page is completed, at most every interval seconds, the id of
+    the page and the counters are saved as json file next to the
+    logfile (<dumpfile>.checkpoint). The file is replaced
+    atomically and removed when the dump is finished.
+
+    A finished dump file gets a marker (<dumpfile>.finished in
+    the outdir) with its identity, with --resume marked files
+    are not processed again.
+
+    A checkpoint is only used for the same dump file (size and
+    modification time) and the same part of it.
+-----------------------------------------------------------
+"""
+import json
+import logging
+import os
+import time
+
+CHECKPOINT_VERSION = 1
+
+def dump_identity(dump_path, part=None):
+    """Return what identifies a dump file (and part) as dictionary."""
+    stat = os.stat(dump_path)
+    return {"path": os.path.abspath(dump_path), "size": stat.st_size,
+        "mtime": int(stat.st_mtime), "part": None if part is None else repr(part)}
+
+def write_checkpoint(path, state):
+    """Save a checkpoint atomically."""
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.rename(path + ".tmp", path)
+
+def read_checkpoint(path, identity):
+    """Return the checkpoint saved at path if it belongs to identity, else None."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if state.get("version") != CHECKPOINT_VERSION or state.get("dump") != identity:
+        logging.warning("checkpoint {} belongs to another dump, ignored".format(path))
+        return None
+    return state
+
+def mark_finished(path, identity):
+    """Save the marker of a finished dump file."""
+    write_checkpoint(path, {"version": CHECKPOINT_VERSION, "dump": identity,
+        "finished": True, "time": time.time()})
+
+def is_finished(path, identity):
+    """Return true if the marker at path belongs to identity."""
+    if not os.path.exists(path):
+        return False
+    state = read_checkpoint(path, identity)
+    return state is not None and state.get("finished", False)
+
+
+class Checkpointer(object):
+    def __init__(self, path, identity, interval):
+        """Initializes a Checkpointer object
+
+        Args:
+            path: Path of the checkpoint file.
+            identity: The dump_identity of the processed dump.
+            interval: Minimum number of seconds between two
+                    checkpoints (0 for no checkpoints).
+        """
+        self.path, self.identity, self.interval = path, identity, interval
+        self.last = time.time()
+
+    def page_done(self, page_id, counters):
+        """Save a checkpoint after page page_id if the interval is over."""
+        now = time.time()
+        if self.interval <= 0 or now - self.last < self.interval:
+            return
+        self.last = now
+        write_checkpoint(self.path, {"version": CHECKPOINT_VERSION, "dump": self.identity,
+            "page_id": page_id, "counters": counters, "time": now})
+        logging.info("checkpoint after page {}".format(page_id))
+
+    def finish(self):
+        """Remove the checkpoint (the dump is finished)."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
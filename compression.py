@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - compression module
+-----------------------------------------------------------
+
+Use:
+    compression.py <dumpfile> <outfile>
+        transcode a dump file once into a format which is faster
+        to decode (the format is chosen by the extension of
+        outfile: .xml, .gz, .xz or .zst)
+
+Note:
+    Registry of the codecs dump files can be read with, by file
+    extension. gzip and bz2 are part of the standard library, xz
+    needs the lzma module (backports.lzma on Python 2) and zstd
+    the zstandard package. Codecs whose library is missing are
+    not available, files with their extension are ignored.
+
+    bz2 files are read with bz2stream.BZ2RangeFile, the BZ2File
+    of Python 2 stops after the first stream of a multistream
+    dump.
+
+    Write transcoded files to another directory than
+    dump_file_path, otherwise both files get processed.
+-----------------------------------------------------------
+"""
+import bz2
+import bz2stream
+import dumpreader
+import gzip
+import logging
+import os
+import shutil
+import sys
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def write_xml(path):
+    """Open an uncompressed xml file for writing."""
+    return open(path, "wb")
+
+
+class Codec(object):
+    def __init__(self, name, extension, reader, writer, available=True):
+        """Initializes a Codec object
+
+        Args:
+            name: A short name of the codec (used in log messages).
+            extension: The file extension of the codec (e.g. ".gz").
+            reader: A function path -> file object for reading.
+            writer: A function path -> file object for writing.
+            available: False if the library of the codec is missing.
+        """
+        self.name, self.extension = name, extension
+        self.reader, self.writer = reader, writer
+        self.available = available
+
+    def __repr__(self):
+        return 'Codec("{}","{}",{})'.format(self.name, self.extension, self.available)
+
+
+class ZstdFile(object):
+    """Readable zstd file (file object with read and close).
+
+    All frames of the file are read (files of pzstd or concatenated
+    .zst files have several frames).
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.reader = zstandard.ZstdDecompressor().stream_reader(self.file,
+            read_size=COPY_BUFFER_SIZE, read_across_frames=True)
+        self.buf = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        parts = [self.buf]
+        length = len(self.buf)
+        while size is None or size < 0 or length < size:
+            data = self.reader.read(COPY_BUFFER_SIZE)
+            if not data:
+                break
+            parts.append(data)
+            length += len(data)
+        data = "".join(parts)
+        if size is None or size < 0:
+            self.buf = ""
+            return data
+        self.buf = data[size:]
+        return data[:size]
+
+    def close(self):
+        self.reader.close()
+        self.file.close()
+
+
+class ZstdWriter(object):
+    """Writable zstd file, the frame is finished on close."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.compressor = zstandard.ZstdCompressor(level=10).compressobj()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+
+CODECS = [
+    Codec("xml", ".xml", dumpreader.MappedFile, write_xml),
+    Codec("bz2", ".bz2", lambda path: bz2stream.BZ2RangeFile(path, 0, None),
+        lambda path: bz2.BZ2File(path, "w")),
+    Codec("gzip", ".gz", lambda path: gzip.open(path, "rb"),
+        lambda path: gzip.open(path, "wb", 6)),
+    Codec("xz", ".xz", lambda path: lzma.LZMAFile(path, "rb"),
+        lambda path: lzma.LZMAFile(path, "wb"), lzma is not None),
+    Codec("zstd", ".zst", ZstdFile, ZstdWriter, zstandard is not None),
+]
+
+def get_codec(path):
+    """Return the codec of a file by its extension (None if there is none)."""
+    ext = os.path.splitext(path)[1]
+    for codec in CODECS:
+        if codec.extension == ext:
+            return codec
+    return None
+
+def available_codecs():
+    """Return the codecs whose library is installed."""
+    return [codec for codec in CODECS if codec.available]
+
+def missing_codecs():
+    """Return the codecs whose library is missing."""
+    return [codec for codec in CODECS if not codec.available]
+
+def open_dump(path):
+    """Open a dump file with the codec of its extension."""
+    codec = get_codec(path)
+    if codec is None:
+        raise IOError("No codec for file: '{}'".format(path))
+    if not codec.available:
+        raise IOError("Library of codec {} is missing: '{}'".format(codec.name, path))
+    return codec.reader(path)
+
+def transcode(src_path, dst_path):
+    """Write the dump file src_path to dst_path in the format of its extension."""
+    codec = get_codec(dst_path)
+    if codec is None or not codec.available:
+        raise IOError("Can not write file (codec missing): '{}'".format(dst_path))
+
+    tmp_path = dst_path + ".tmp"
+    with open_dump(src_path) as src:
+        dst = codec.writer(tmp_path)
+        try:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        finally:
+            dst.close()
+    os.rename(tmp_path, dst_path)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print __doc__
+        print "Available codecs: {}".format(", ".join(
+            "{} ({})".format(codec.name, codec.extension) for codec in available_codecs()))
+        sys.exit(1)
+    logging.basicConfig(format='%(levelname)-7s: %(message)s', level=logging.INFO)
+    logging.info("transcoding {} to {}".format(sys.argv[1], sys.argv[2]))
+    transcode(sys.argv[1], sys.argv[2])
@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - dumpreader module
+-----------------------------------------------------------
+
+Note:
+    Streaming reader for wikidump xml files with constant
+    memory usage. Only end events of <revision> and <page>
+    elements are reported by the parser, all qualified tag
+    names are computed once per dump and processed elements
+    are removed from the tree (including their preceding
+    siblings), so the tree never grows beyond one revision.
+
+    PageFilter drops pages which get skipped anyway (namespace
+    other than 0, redirects), revisions beyond the maximum
+    number of revisions and revisions after the end of the
+    filter time window on the byte level, before they reach
+    the xml parser. It can record the byte offset of every
+    <page>, the offsets are saved as table next to uncompressed
+    dump files (<dumpfile>.pages) for sharding and resuming.
+
+    MappedFile reads uncompressed dump files through mmap
+    windows instead of small buffered reads.
+-----------------------------------------------------------
+"""
+from collections import deque
+from lxml import etree
+import logging
+import mmap
+import os
+import re
+import struct
+
+REVISION = 1
+PAGE_END = 2
+
+PAGE_START_TAG = "<page>"
+PAGE_END_TAG = "</page>"
+REVISION_TAG = "<revision>"
+CHUNK_SIZE = 1024 * 1024
+WINDOW_SIZE = 64 * 1024 * 1024
+OFFSETS_MAGIC = "WDPOFF1\0"
+offsets_header = struct.Struct("<8sQ")
+
+OUTSIDE, HEADER, KEEP, SKIP, TRUNCATE, RESUME = range(6)
+
+root_namespace = re.compile(r"""<mediawiki\b[^>]*?\sxmlns=["']([^"']*)["']""")
+header_id = re.compile(r"<id>([^<]*)</id>")
+header_ns = re.compile(r"<ns>([^<]*)</ns>")
+header_redirect = re.compile(r"<redirect[\s/>]")
+revision_timestamp = re.compile(r"<timestamp>([^<]*)</timestamp>")
+TIMESTAMP_END_TAG = "</timestamp>"
+
+def sniff_namespace(f, max_size=65536):
+    """Read the beginning of f and return (data_read, namespace)."""
+    data = ""
+    while len(data) < max_size:
+        chunk = f.read(4096)
+        if not chunk:
+            break
+        data += chunk
+        match = root_namespace.search(data)
+        if match:
+            return data, match.group(1)
+        if "<mediawiki" in data and ">" in data[data.find("<mediawiki"):]:
+            break
+    return data, ""
+
+
+def page_offsets_path(dump_path):
+    """Return path of the page offset table of a dump file."""
+    return dump_path + ".pages"
+
+def save_page_offsets(dump_path, offsets):
+    """Save the byte offsets of all pages of an uncompressed dump file."""
+    path = page_offsets_path(dump_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(offsets_header.pack(OFFSETS_MAGIC, len(offsets)))
+        for i in xrange(0, len(offsets), 65536):
+            part = offsets[i:i+65536]
+            f.write(struct.pack("<{}Q".format(len(part)), *part))
+    os.rename(path + ".tmp", path)
+
+def load_page_offsets(dump_path):
+    """Return the saved page offsets of a dump file (None if there is no up to date table)."""
+    path = page_offsets_path(dump_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(dump_path):
+        return None
+    with open(path, "rb") as f:
+        magic, count = offsets_header.unpack(f.read(offsets_header.size))
+        if magic != OFFSETS_MAGIC:
+            return None
+        data = f.read(count * 8)
+    return list(struct.unpack("<{}Q".format(count), data))
+
+
+class MappedFile(object):
+    """Read-only file object reading through mmap windows.
+
+    Windows are mapped one after another, so files larger than
+    the address space of 32 bit processes can be read too.
+    """
+
+    def __init__(self, path, window_size=WINDOW_SIZE):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.window_size = max(granularity, window_size - window_size % granularity)
+        self.window = None
+        self.window_start = 0
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def map_window(self, pos):
+        """Map the window containing pos."""
+        if self.window is not None:
+            self.window.close()
+        start = pos - pos % mmap.ALLOCATIONGRANULARITY
+        length = min(self.window_size, self.size - start)
+        self.window = mmap.mmap(self.file.fileno(), length, access=mmap.ACCESS_READ, offset=start)
+        self.window_start = start
+
+    def read(self, size=-1):
+        """Read at most size bytes (the rest of the current window at most)."""
+        if size is None or size < 0:
+            size = self.size - self.pos
+        size = min(size, self.size - self.pos)
+        if size <= 0:
+            return ""
+        if (self.window is None or self.pos < self.window_start or
+                self.pos >= self.window_start + len(self.window)):
+            self.map_window(self.pos)
+        start = self.pos - self.window_start
+        data = self.window[start:start + size]
+        self.pos += len(data)
+        return data
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, min(pos, self.size))
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+            self.window = None
+        self.file.close()
+
+
+class PageMeta(object):
+    """Metadata of a page (everything in front of the first revision)."""
+
+    def __init__(self, page_id=None, title=None, ns=None, redirect=False):
+        self.page_id, self.title = page_id, title
+        self.ns, self.redirect = ns, redirect
+
+    def __repr__(self):
+        return 'PageMeta({},"{}",{},{})'.format(self.page_id, self.title, self.ns, self.redirect)
+
+
+class PrefixedReader(object):
+    """File object returning prefix followed by the rest of f."""
+
+    def __init__(self, prefix, f):
+        self.prefix, self.f = prefix, f
+
+    def read(self, size=-1):
+        if self.prefix:
+            if size is None or size < 0:
+                data, self.prefix = self.prefix + self.f.read(), ""
+            else:
+                data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        return self.f.read(size)
+
+
+class DumpReader(object):
+    """Iterates over the revisions of a dump file.
+
+    Yields tuples (REVISION, page_meta, revision_element) for every
+    revision and (PAGE_END, page_meta, page_element) at the end of
+    every page. Elements are cleared as soon as the consumer asks
+    for the next tuple.
+    """
+
+    def __init__(self, f):
+        prefix, namespace = sniff_namespace(f)
+        self.source = PrefixedReader(prefix, f)
+        self.ns = "{" + namespace + "}" if namespace else ""
+
+        self.tag_page = self.ns + "page"
+        self.tag_revision = self.ns + "revision"
+        self.tag_title = self.ns + "title"
+        self.tag_id = self.ns + "id"
+        self.tag_ns = self.ns + "ns"
+        self.tag_redirect = self.ns + "redirect"
+
+    def __iter__(self):
+        meta = None
+        iter_tree = etree.iterparse(self.source, events=("end",),
+            tag=(self.tag_revision, self.tag_page))
+
+        for event, elem in iter_tree:
+            if elem.tag == self.tag_revision:
+                page = elem.getparent()
+                if meta is None:
+                    meta = self.page_meta(page)
+                yield REVISION, meta, elem
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del page[0]
+            else:
+                if meta is None:
+                    meta = self.page_meta(elem)
+                yield PAGE_END, meta, elem
+                meta = None
+                elem.clear()
+                parent = elem.getparent()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+    def page_meta(self, page):
+        """Return PageMeta of a page element (read before its first revision)."""
+        meta = PageMeta()
+        for child in page:
+            tag = child.tag
+            if tag == self.tag_revision:
+                break
+            elif tag == self.tag_title:
+                meta.title = child.text
+            elif tag == self.tag_id:
+                meta.page_id = child.text
+            elif tag == self.tag_ns:
+                meta.ns = child.text
+            elif tag == self.tag_redirect:
+                meta.redirect = True
+        return meta
+
+
+class PageFilter(object):
+    """File object passing only pages which get processed to the xml parser.
+
+    Pages in a namespace other than 0 and redirects are dropped
+    without being parsed, revisions beyond max_revisions are cut
+    off. The dropped pages and revisions are counted like the
+    WikiDump class counts skipped pages and revisions.
+    """
+
+    def __init__(self, f, max_revisions=-1, chunk_size=CHUNK_SIZE, page_ids=None,
+            record_offsets=False, rev_filter=None, resume_after=None, record_counters=False):
+        """Initializes a PageFilter object
+
+        Args:
+            f: File object of the xml dump.
+            max_revisions: Number of revisions per page passed to
+                    the parser (-1 for no limit).
+            chunk_size: Size of reads from f.
+            page_ids: An optional set of page ids (strings),
+                    all other pages are dropped.
+            record_offsets: If true, the offsets (in f) of all
+                    pages are collected in page_offsets.
+            rev_filter: An optional filters.RevisionFilter, pages
+                    of other namespaces and revisions after the
+                    end of its time window are dropped.
+            resume_after: An optional page id (string), all pages
+                    up to this one are dropped without being
+                    counted (resume after a checkpoint).
+            record_counters: If true, the counters at the end of
+                    every kept page are recorded for counters_at
+                    (checkpoints).
+        """
+        self.f = f
+        self.max_revisions = max_revisions
+        self.page_ids = page_ids
+        self.rev_filter = rev_filter
+        self.resume_after = resume_after
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.buf_start = 0
+        self.pending = ""
+        self.eof = False
+        self.state = OUTSIDE
+        self.page_id = None
+        self.revision_count = 0
+
+        self.skipped_pages = 0
+        self.total_revisions = 0
+        self.skipped_revisions = 0
+        self.page_offsets = [] if record_offsets else None
+        self.kept_counters = deque() if record_counters else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def read(self, size=-1):
+        """Read at most size filtered bytes (all remaining if size < 0)."""
+        if size is None or size < 0:
+            parts = []
+            data = self.read(self.chunk_size)
+            while data:
+                parts.append(data)
+                data = self.read(self.chunk_size)
+            return "".join(parts)
+
+        out = [self.pending]
+        out_len = len(self.pending)
+        while out_len < size:
+            data = self.step()
+            if data is None:
+                break
+            if data:
+                out.append(data)
+                out_len += len(data)
+        data = "".join(out)
+        self.pending = data[size:]
+        return data[:size]
+
+    def fill(self):
+        """Read next chunk into buffer, return False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.buf_start += self.pos
+        self.pos = 0
+        return True
+
+    def step(self):
+        """Process buffer, return output ("" if more input is needed, None at end)."""
+        buf, pos = self.buf, self.pos
+
+        if self.state == OUTSIDE:
+            found = buf.find(PAGE_START_TAG, pos)
+            if found == -1:
+                return self.pass_through(len(PAGE_START_TAG) - 1)
+            self.pos = found
+            self.state = HEADER
+            if self.page_offsets is not None:
+                self.page_offsets.append(self.buf_start + found)
+            return buf[pos:found]
+
+        elif self.state == HEADER:
+            found_rev = buf.find(REVISION_TAG, pos)
+            found_end = buf.find(PAGE_END_TAG, pos)
+            if found_rev == -1 and found_end == -1:
+                if not self.fill():
+                    return self.pass_through(0)
+                return ""
+            if found_rev == -1 or (found_end != -1 and found_end < found_rev):
+                found = found_end
+            else:
+                found = found_rev
+            header = buf[pos:found]
+            self.page_id = None
+            self.revision_count = 0
+            match = header_id.search(header)
+            if match:
+                self.page_id = match.group(1)
+            match = header_ns.search(header)
+            if self.rev_filter is not None:
+                skip = match is not None and not self.rev_filter.accept_page(match.group(1))
+            else:
+                skip = match is not None and match.group(1) != "0"
+            skip = skip or header_redirect.search(header) is not None
+            if self.page_ids is not None and self.page_id not in self.page_ids:
+                skip = True
+
+            self.pos = found
+            if self.resume_after is not None:
+                if self.page_id == self.resume_after:
+                    self.resume_after = None
+                self.state = RESUME
+                return ""
+            if skip:
+                self.state = SKIP
+                return ""
+            self.state = KEEP
+            return header
+
+        elif self.state == KEEP:
+            found_rev = buf.find(REVISION_TAG, pos)
+            found_end = buf.find(PAGE_END_TAG, pos)
+            if found_end != -1 and (found_rev == -1 or found_end < found_rev):
+                self.pos = found_end + len(PAGE_END_TAG)
+                self.state = OUTSIDE
+                self.record_counters()
+                return buf[pos:self.pos]
+            elif found_rev != -1:
+                if self.rev_filter is not None and self.rev_filter.end_time is not None:
+                    found_ts = buf.find(TIMESTAMP_END_TAG, found_rev)
+                    if found_ts == -1 and not self.eof:
+                        # wait for the timestamp of the revision
+                        self.pos = found_rev
+                        self.fill()
+                        return buf[pos:found_rev]
+                    match = revision_timestamp.search(buf, found_rev, found_ts + len(TIMESTAMP_END_TAG))
+                    if match and self.rev_filter.is_after_end(match.group(1)):
+                        self.pos = found_rev
+                        self.state = TRUNCATE
+                        return buf[pos:found_rev]
+
+                self.revision_count += 1
+                if self.max_revisions != -1 and self.revision_count > self.max_revisions:
+                    logging.info("maximum revisions ({}) reached. page-id {}".format(self.max_revisions, self.page_id))
+                    self.revision_count -= 1
+                    self.pos = found_rev
+                    self.state = TRUNCATE
+                    return buf[pos:found_rev]
+                self.pos = found_rev + len(REVISION_TAG)
+                return buf[pos:self.pos]
+            return self.pass_through(len(REVISION_TAG) - 1)
+
+        else:
+            # SKIP, TRUNCATE and RESUME: drop everything up to </page>, count revisions
+            found_end = buf.find(PAGE_END_TAG, pos)
+            end = found_end if found_end != -1 else len(buf)
+            found_rev = buf.find(REVISION_TAG, pos, end)
+            while found_rev != -1:
+                if self.state != RESUME:
+                    self.drop_revision()
+                pos = found_rev + len(REVISION_TAG)
+                found_rev = buf.find(REVISION_TAG, pos, end)
+
+            if found_end == -1:
+                self.pos = max(pos, len(buf) - (len(REVISION_TAG) - 1))
+                if not self.fill():
+                    return None
+                return ""
+
+            self.pos = found_end + len(PAGE_END_TAG)
+            state, self.state = self.state, OUTSIDE
+            if state == TRUNCATE:
+                self.record_counters()
+                return PAGE_END_TAG
+            if state == RESUME:
+                return ""
+            self.skipped_pages += 1
+            if self.revision_count > 0:
+                logging.info("skip page {}".format(self.page_id))
+            return ""
+
+    def counters(self):
+        """Return the current counters as dictionary."""
+        return {"skipped_pages": self.skipped_pages, "total_revisions": self.total_revisions,
+            "skipped_revisions": self.skipped_revisions}
+
+    def record_counters(self):
+        """Record the counters at the end of a kept page."""
+        if self.kept_counters is not None:
+            self.kept_counters.append((self.page_id, self.counters()))
+
+    def counters_at(self, page_id):
+        """Return the counters at the end of the kept page page_id.
+
+        The filter reads ahead of the xml parser, the current
+        counters may include pages after page_id already. Records
+        of earlier pages are dropped.
+        """
+        while self.kept_counters:
+            kept_id, counters = self.kept_counters.popleft()
+            if kept_id == page_id:
+                return counters
+        return self.counters()
+
+    def drop_revision(self):
+        """Count a revision which does not reach the xml parser."""
+        self.revision_count += 1
+        self.total_revisions += 1
+        if self.max_revisions != -1 and self.revision_count > self.max_revisions:
+            self.skipped_revisions += 1
+
+    def pass_through(self, keep):
+        """Return buffer except the last keep bytes and read more input."""
+        buf, pos = self.buf, self.pos
+        if self.eof:
+            self.pos = len(buf)
+            return buf[pos:] if pos < len(buf) else None
+        end = max(pos, len(buf) - keep)
+        self.pos = end
+        self.fill()
+        return buf[pos:end]
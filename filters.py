@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - filters module
+-----------------------------------------------------------
+
+Note:
+    Filters for pages and revisions which are checked on the
+    metadata (namespace, timestamp, contributor, minor flag)
+    before the wiki-text of a revision is read.
+
+    A rejected revision is never saved, but stays the
+    predecessor of the next revision (its text is only read
+    if the next revision gets compared with it). Revisions
+    after the end of the time window stop the page.
+
+Config file section [Filter]:
+    namespaces: comma separated namespaces of processed pages
+    start_time: revisions before this timestamp are not saved
+        (e.g. 2008-01-01 or 2008-01-01T12:00:00Z)
+    end_time: revisions from this timestamp on are dropped
+    allow_contributors: only save revisions of these users
+    deny_contributors: never save revisions of these users
+        (e.g. bots)
+    skip_minor: never save minor edits (1) or do (0)
+
+    Contributor lists are comma separated user names or ids,
+    or "@path" of a file with one name or id per line.
+-----------------------------------------------------------
+"""
+import os
+
+ACCEPT = 0
+REJECT = 1
+STOP = 2
+
+def read_list(value):
+    """Return set of comma separated values or of the lines of file @path."""
+    value = value.strip()
+    if not value:
+        return None
+    if value.startswith("@"):
+        with open(os.path.expanduser(value[1:]), "r") as f:
+            items = [line.strip().decode("UTF-8") for line in f]
+    else:
+        items = [item.strip().decode("UTF-8") for item in value.split(",")]
+    return set(item for item in items if item)
+
+def from_config(param):
+    """Return RevisionFilter of the [Filter] config section (a dictionary)."""
+    namespaces = param.get('namespaces', '0')
+    return RevisionFilter(
+        namespaces=read_list(namespaces) if namespaces.strip() != '*' else None,
+        start_time=param.get('start_time', '').strip() or None,
+        end_time=param.get('end_time', '').strip() or None,
+        allow=read_list(param.get('allow_contributors', '')),
+        deny=read_list(param.get('deny_contributors', '')),
+        skip_minor=bool(int(param.get('skip_minor', 1))))
+
+
+class RevisionFilter(object):
+    def __init__(self, namespaces=frozenset(['0']), start_time=None, end_time=None,
+            allow=None, deny=None, skip_minor=True):
+        """Initializes a RevisionFilter object
+
+        Args:
+            namespaces: Set of namespaces (strings) of processed
+                    pages, None for all namespaces.
+            start_time: Revisions before this timestamp are rejected.
+            end_time: Revisions from this timestamp on stop the page.
+            allow: An optional set of user names or ids, revisions
+                    of all other contributors are rejected.
+            deny: An optional set of user names or ids whose
+                    revisions are rejected.
+            skip_minor: Reject minor edits.
+
+        Timestamps are compared as strings (ISO 8601 as in the dumps).
+        """
+        self.namespaces = namespaces
+        self.start_time, self.end_time = start_time, end_time
+        self.allow, self.deny = allow, deny
+        self.skip_minor = skip_minor
+
+    def accept_page(self, ns):
+        """Return true if pages of namespace ns get processed (None if unknown)."""
+        return ns is None or self.namespaces is None or ns in self.namespaces
+
+    def is_after_end(self, timestamp):
+        """Return true if timestamp lies behind the time window."""
+        return self.end_time is not None and timestamp is not None and timestamp >= self.end_time
+
+    def check(self, values):
+        """Check revision metadata, return ACCEPT, REJECT or STOP."""
+        timestamp = values['timestamp']
+        if self.is_after_end(timestamp):
+            return STOP
+        if self.start_time is not None and timestamp is not None and timestamp < self.start_time:
+            return REJECT
+        if self.skip_minor and values['minor']:
+            return REJECT
+        if self.allow is not None and not self.matches(self.allow, values):
+            return REJECT
+        if self.deny is not None and self.matches(self.deny, values):
+            return REJECT
+        return ACCEPT
+
+    def matches(self, contributors, values):
+        """Return true if the contributor of a revision is in contributors."""
+        return values['username'] in contributors or values['contr_id'] in contributors
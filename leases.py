@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - leases module
+-----------------------------------------------------------
+
+Note:
+    Work queue of several processes or hosts sharing a directory
+    (e.g. over NFS). A unit of work (a dump file) is claimed by
+    creating its lease file exclusively (<unit>.lease). The owner
+    touches the lease while it works (heartbeat), a lease whose
+    last heartbeat is older than the ttl is taken over by the
+    next process which claims the unit. A finished unit gets a
+    done marker (<unit>.done), a failed one a failed marker, both
+    units are not claimed again.
+
+    Times are compared with the modification time of a probe file
+    in the lease directory, so the clocks of the hosts do not need
+    to agree. The ttl should be several heartbeat intervals.
+
+    Outputs are written to a staging directory of the owner and
+    moved into the output directory (publish) before the unit is
+    marked done, so no half written file shows up there.
+-----------------------------------------------------------
+"""
+import errno
+import json
+import logging
+import os
+import shutil
+import socket
+
+LEASE_SUFFIX = ".lease"
+# directory of the staging directories in the output directory
+STAGING = ".staging"
+DONE_SUFFIX = ".done"
+FAILED_SUFFIX = ".failed"
+
+
+def default_owner():
+    """Return an owner name unique for this process (host:pid)."""
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class LeaseQueue(object):
+    def __init__(self, lease_dir, owner=None, ttl=300):
+        """Initializes a LeaseQueue object
+
+        Args:
+            lease_dir: Directory of the lease files (shared by all
+                    processes working on the same units).
+            owner: Name of this process in the lease files (default
+                    host:pid).
+            ttl: Seconds after the last heartbeat when a lease
+                    expires.
+        """
+        self.lease_dir = lease_dir
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        if not os.path.exists(lease_dir):
+            try:
+                os.makedirs(lease_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def path(self, unit, suffix):
+        return os.path.join(self.lease_dir, unit + suffix)
+
+    def now(self):
+        """Return the current time of the file system of the lease directory."""
+        probe = self.path("." + self.owner.replace(os.sep, "_"), ".clock")
+        with open(probe, "w"):
+            pass
+        try:
+            os.utime(probe, None)
+            return os.path.getmtime(probe)
+        finally:
+            os.remove(probe)
+
+    def is_finished(self, unit):
+        """Return True if the unit is done or failed."""
+        return os.path.exists(self.path(unit, DONE_SUFFIX)) or os.path.exists(self.path(unit, FAILED_SUFFIX))
+
+    def is_leased(self, unit):
+        """Return True if the unit has a lease which is not expired."""
+        try:
+            return self.now() - os.path.getmtime(self.path(unit, LEASE_SUFFIX)) <= self.ttl
+        except OSError:
+            return False
+
+    def claim(self, unit):
+        """Try to take the lease of a unit, return True on success."""
+        if self.is_finished(unit):
+            return False
+        lease = self.path(unit, LEASE_SUFFIX)
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError, e:
+            if e.errno != errno.EEXIST or not self.reclaim(unit):
+                return False
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+        os.write(fd, self.owner)
+        os.close(fd)
+        if self.is_finished(unit):
+            # finished between the check and the lease
+            os.remove(lease)
+            return False
+        return True
+
+    def reclaim(self, unit):
+        """Remove the lease of a unit if it is expired, return True if it was removed.
+
+        The age is checked again after the lease is renamed away:
+        it may have been reclaimed and claimed anew by other
+        processes after the first check, such a lease is linked
+        back.
+        """
+        lease = self.path(unit, LEASE_SUFFIX)
+        # only one process can rename the lease away
+        stale = lease + ".stale." + self.owner.replace(os.sep, "_")
+        try:
+            if self.now() - os.path.getmtime(lease) <= self.ttl:
+                return False
+            os.rename(lease, stale)
+        except OSError:
+            return False
+        try:
+            expired = self.now() - os.path.getmtime(stale) > self.ttl
+        except (OSError, IOError):
+            expired = False
+        with open(stale) as f:
+            owner = f.read()
+        if expired:
+            logging.warning("lease of {} by {} expired, reclaimed".format(unit, owner))
+        else:
+            try:
+                os.link(stale, lease)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                # claimed by another process meanwhile, its owner stops at the next heartbeat
+                logging.warning("lease of {} by {} lost to a new claim".format(unit, owner))
+        os.remove(stale)
+        return expired
+
+    def owns(self, unit):
+        try:
+            with open(self.path(unit, LEASE_SUFFIX)) as f:
+                return f.read() == self.owner
+        except IOError:
+            return False
+
+    def heartbeat(self, unit):
+        """Renew the lease of a unit, return False if it is lost."""
+        if not self.owns(unit):
+            return False
+        try:
+            os.utime(self.path(unit, LEASE_SUFFIX), None)
+        except OSError:
+            return False
+        return True
+
+    def finish(self, unit, info=None, failed=False):
+        """Mark a unit done (or failed) with info (a json serializable object) and drop the lease."""
+        marker = self.path(unit, FAILED_SUFFIX if failed else DONE_SUFFIX)
+        with open(marker + ".tmp." + self.owner.replace(os.sep, "_"), "w") as f:
+            json.dump({"owner": self.owner, "info": info}, f)
+        os.rename(f.name, marker)
+        self.release(unit)
+
+    def release(self, unit):
+        """Drop the lease of a unit (it can be claimed again)."""
+        if self.owns(unit):
+            os.remove(self.path(unit, LEASE_SUFFIX))
+
+    def read_info(self, unit):
+        """Return the info saved with the done marker of a unit."""
+        with open(self.path(unit, DONE_SUFFIX)) as f:
+            return json.load(f)["info"]
+
+
+def staging_dir(outdir, unit, owner):
+    """Return the staging directory of a unit of an owner."""
+    return os.path.join(outdir, STAGING, "{}.{}".format(unit, owner.replace(os.sep, "_").replace(":", "_")))
+
+def publish(staging, outdir):
+    """Move all files of a staging directory into outdir and remove it.
+
+    Every file is renamed into place (atomically on the same file
+    system), existing files of an earlier attempt are replaced.
+    """
+    for dirname, subdirs, files in os.walk(staging):
+        target = os.path.join(outdir, os.path.relpath(dirname, staging))
+        if not os.path.exists(target):
+            os.makedirs(target)
+        for filename in files:
+            os.rename(os.path.join(dirname, filename), os.path.join(target, filename))
+    shutil.rmtree(staging)
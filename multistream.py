@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - multistream module
+-----------------------------------------------------------
+
+Note:
+    Random access to single pages of multistream bz2 dump
+    files (pages-articles-multistream.xml.bz2) by page id or
+    title, using the multistream index published along with
+    the dump (lines of "offset:page_id:title").
+
+    The text index is converted once into a binary table
+    (<index>.tbl), sorted by page id and by title hash, which
+    is searched through mmap without loading it. The table is
+    sorted in chunks of SORT_CHUNK lines which are merged, so
+    building it takes bounded memory.
+-----------------------------------------------------------
+"""
+from cStringIO import StringIO
+import bz2
+import bz2stream
+import dumpreader
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import sharding
+import struct
+import tempfile
+
+TABLE_MAGIC = "WDPIDX1\0"
+table_header = struct.Struct("<8sQQ")
+id_record = struct.Struct("<QQ")
+title_record = struct.Struct("<QQ")
+SORT_CHUNK = 500000
+RUN_BUFFER_SIZE = 64 * 1024
+
+def default_index_path(dump_path):
+    """Return path of the index belonging to a multistream dump file."""
+    head, tail = os.path.split(dump_path)
+    tail = tail.replace("multistream.xml.bz2", "multistream-index.txt.bz2")
+    return os.path.join(head, tail)
+
+def title_hash(title):
+    """Return 64 bit hash of a page title."""
+    if isinstance(title, unicode):
+        title = title.encode("UTF-8")
+    return struct.unpack("<Q", hashlib.md5(title).digest()[:8])[0]
+
+def read_index_lines(index_path):
+    """Yield (offset, page_id, title) of all lines of a (bz2) text index."""
+    if os.path.splitext(index_path)[1] == ".bz2":
+        f = bz2.BZ2File(index_path, "r")
+    else:
+        f = open(index_path, "rb")
+    with f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            offset, page_id, title = line.split(":", 2)
+            yield int(offset), int(page_id), title
+
+def write_run(records, record, tmp_dir):
+    """Sort records and write them to a temporary file (a sorted run)."""
+    records.sort()
+    run = tempfile.TemporaryFile(dir=tmp_dir)
+    for i in range(0, len(records), 4096):
+        run.write("".join(record.pack(*r) for r in records[i:i + 4096]))
+    del records[:]
+    return run
+
+def read_run(run, record):
+    """Yield the records of a sorted run."""
+    run.seek(0)
+    size = record.size * (RUN_BUFFER_SIZE // record.size)
+    while True:
+        data = run.read(size)
+        if not data:
+            break
+        for pos in range(0, len(data), record.size):
+            yield record.unpack_from(data, pos)
+
+def build_table(index_path, table_path):
+    """Convert a text index into a binary table (sorted in chunks of SORT_CHUNK lines)."""
+    tmp_dir = os.path.dirname(os.path.abspath(table_path))
+    ids, titles = [], []
+    id_runs, title_runs = [], []
+    count = 0
+    try:
+        for offset, page_id, title in read_index_lines(index_path):
+            ids.append((page_id, offset))
+            titles.append((title_hash(title), page_id))
+            count += 1
+            if len(ids) >= SORT_CHUNK:
+                id_runs.append(write_run(ids, id_record, tmp_dir))
+                title_runs.append(write_run(titles, title_record, tmp_dir))
+        if ids:
+            id_runs.append(write_run(ids, id_record, tmp_dir))
+            title_runs.append(write_run(titles, title_record, tmp_dir))
+
+        tmp_path = table_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(table_header.pack(TABLE_MAGIC, count, count))
+            for runs, record in ((id_runs, id_record), (title_runs, title_record)):
+                for r in heapq.merge(*[read_run(run, record) for run in runs]):
+                    f.write(record.pack(*r))
+        os.rename(tmp_path, table_path)
+    finally:
+        for run in id_runs + title_runs:
+            run.close()
+
+def open_table(index_path):
+    """Return PageIndex of index_path, build its table if missing or outdated."""
+    table_path = index_path + ".tbl"
+    if (not os.path.exists(table_path) or
+            os.path.getmtime(table_path) < os.path.getmtime(index_path)):
+        build_table(index_path, table_path)
+    return PageIndex(table_path)
+
+
+class PageIndex(object):
+    """Binary page index (page id -> stream offset, title -> page id)."""
+
+    def __init__(self, table_path):
+        with open(table_path, "rb") as f:
+            self.table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.id_count, self.title_count = table_header.unpack_from(self.table, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError("{} is not a page index table".format(table_path))
+        self.id_start = table_header.size
+        self.title_start = self.id_start + self.id_count * id_record.size
+
+    def close(self):
+        self.table.close()
+
+    def search(self, start, count, record, key):
+        """Return index of the first record with a key >= key."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record.unpack_from(self.table, start + mid * record.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def offset_of(self, page_id):
+        """Return stream offset of a page id (None if unknown)."""
+        page_id = int(page_id)
+        i = self.search(self.id_start, self.id_count, id_record, page_id)
+        if i < self.id_count:
+            found_id, offset = id_record.unpack_from(self.table, self.id_start + i * id_record.size)
+            if found_id == page_id:
+                return offset
+        return None
+
+    def ids_of_title(self, title):
+        """Return the page ids of a title (hash matches)."""
+        key = title_hash(title)
+        i = self.search(self.title_start, self.title_count, title_record, key)
+        result = []
+        while i < self.title_count:
+            found_hash, page_id = title_record.unpack_from(self.table, self.title_start + i * title_record.size)
+            if found_hash != key:
+                break
+            result.append(page_id)
+            i += 1
+        return result
+
+    def select(self, dump_path, page_ids=(), titles=()):
+        """Return a PageSelection of the given pages (pages missing in the index are logged)."""
+        page_ids = set(int(page_id) for page_id in page_ids)
+        for title in titles:
+            ids = self.ids_of_title(title)
+            if not ids:
+                logging.warning("title not in the index: {}".format(title))
+            page_ids.update(ids)
+        offsets = {}
+        for page_id in sorted(page_ids):
+            offset = self.offset_of(page_id)
+            if offset is None:
+                logging.warning("page id not in the index: {}".format(page_id))
+            else:
+                offsets.setdefault(offset, set()).add(str(page_id))
+        return PageSelection(dump_path, offsets)
+
+
+class PageSelection(object):
+    """Selected pages of a multistream dump, read as a complete xml document."""
+
+    def __init__(self, path, offsets):
+        """Initializes a PageSelection object
+
+        Args:
+            path: A path to the multistream bz2 dump file.
+            offsets: A dictionary stream offset -> set of the
+                    page ids (strings) to read from this stream.
+        """
+        self.path = path
+        self.offsets = offsets
+        self.page_ids = set()
+        for ids in offsets.itervalues():
+            self.page_ids.update(ids)
+
+    def __repr__(self):
+        return 'PageSelection("{}",{})'.format(self.path, sorted(self.page_ids))
+
+    def suffix(self):
+        """Return suffix for log-files of this selection."""
+        return ".pages"
+
+    def open(self):
+        """Return a file object with dump header, selected pages and footer."""
+        parts = [sharding.read_bz2_header(self.path)]
+        for offset in sorted(self.offsets):
+            data = bz2stream.read_stream(self.path, offset)
+            start = data.find(sharding.PAGE_TAG)
+            if start != -1:
+                parts.append(data[start:].replace(sharding.FOOTER, ""))
+        parts.append(sharding.FOOTER + "\n")
+        return dumpreader.PageFilter(StringIO("".join(parts)), page_ids=self.page_ids)
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - pagepipeline module
+-----------------------------------------------------------
+
+Note:
+    Processing of whole pages in three stages: the reader (the
+    main process) extracts the metadata and texts of the
+    revisions of a page, worker processes run the parse/diff
+    logic of WikiDump for a page, and a writer process saves
+    the articles in page order.
+
+    Revision texts are copied as UTF-8 bytes into a ring buffer
+    in shared memory (SpoolRing), only their positions are sent
+    to the workers. The space of a page is released by the
+    writer after the page is saved. Pages larger than the ring
+    send the rest of their texts with the job, or write them to
+    a spill file if the memory budget of the reader is exceeded.
+
+    The workers parse in-process, timeouts are signalled by
+    SIGALRM (no timeouts where it is missing). The processes are
+    forked with the WikiDump object, so this mode needs fork
+    (Unix).
+
+    Every worker has its own job queue, so the reader knows the
+    pages sent to a worker. It watches the workers and the writer
+    while it waits: the page a dead worker (killed, out of memory)
+    was processing is reported to the writer as failed, its other
+    pages are sent to a new worker. A dead writer stops the
+    processing of the dump file.
+-----------------------------------------------------------
+"""
+from collections import deque
+from multiprocessing import Array
+from multiprocessing import Process
+from multiprocessing import Queue
+from multiprocessing import Value
+from Queue import Empty
+from revision import read_text_elem
+from revision import text_elem_size
+from utils import call_with_timeout
+import ctypes
+import logging
+import mmap
+import os
+import time
+
+# where the text of a revision is passed to the worker
+RING, INLINE, SPILL = range(3)
+
+WORKER_COUNTERS = ("usable_pages", "usable_revisions", "actual_revisions", "known_revisions",
+    "cached_parses", "worker_restarts")
+WAIT_INTERVAL = 0.01
+POLL_INTERVAL = 1.0
+# pages sent to a worker which are not processed yet
+WORKER_JOBS = 2
+# page of a worker while it is not processing one
+IDLE = -1
+
+
+class InlineResult(object):
+    """Result of InlinePool.apply_async, the call runs on get()."""
+
+    def __init__(self, func, args):
+        self.func, self.args = func, args
+
+    def get(self, timeout=None):
+        return call_with_timeout(self.func, self.args, timeout)
+
+
+class InlinePool(object):
+    """Stand-in for multiprocessing.Pool which calls functions in-process."""
+
+    def apply_async(self, func, args=()):
+        return InlineResult(func, args)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class SpoolRing(object):
+    def __init__(self, size):
+        """Initializes a SpoolRing object
+
+        Args:
+            size: Size of the ring buffer in bytes. The buffer is
+                    shared with processes forked after its creation.
+        """
+        self.size = size
+        self.buf = mmap.mmap(-1, size)
+        self.head = 0
+        self.released = Value(ctypes.c_ulonglong, 0, lock=False)
+
+    def write(self, data, page_start, wait=None):
+        """Copy data into the ring and return its position.
+
+        Waits until released space is available (calling wait()
+        meanwhile). None is returned if the data of the page (from
+        page_start on) does not fit into the ring.
+        """
+        length = len(data)
+        start = self.head
+        if start % self.size + length > self.size:
+            start += self.size - start % self.size
+        end = start + length
+        if end - page_start > self.size:
+            return None
+        while end - self.released.value > self.size:
+            if wait is not None:
+                wait()
+            time.sleep(WAIT_INTERVAL)
+        offset = start % self.size
+        self.buf[offset:offset + length] = data
+        self.head = end
+        return start
+
+    def read(self, start, length):
+        """Return a copy of data written at position start."""
+        offset = start % self.size
+        return self.buf[offset:offset + length]
+
+    def release(self, end):
+        """Release the space of all data in front of position end."""
+        self.released.value = end
+
+
+class PagePipeline(object):
+    def __init__(self, dump, workers, spool_size):
+        """Initializes a PagePipeline object and starts its processes
+
+        Args:
+            dump: The WikiDump object (reader side), it is forked
+                    into the workers and the writer.
+            workers: Number of worker processes.
+            spool_size: Size of the shared ring buffer in bytes.
+        """
+        self.dump = dump
+        self.budget = dump.budget
+        self.ring = SpoolRing(spool_size)
+        self.results = Queue()
+        self.totals = Queue()
+        # page a worker processes and number of pages it finished
+        self.started = Array(ctypes.c_longlong, [IDLE] * workers, lock=False)
+        self.done = Array(ctypes.c_longlong, [0] * workers, lock=False)
+        # jobs sent to a worker and not known to be finished
+        self.assigned = [deque() for i in range(workers)]
+        self.confirmed = [0] * workers
+        self.queues = [None] * workers
+        self.workers = [None] * workers
+        for index in range(workers):
+            self.start_worker(index)
+        self.writer = Process(target=run_writer, args=(dump, self.results, self.ring, self.totals))
+        self.writer.start()
+        self.restarts = 0
+        self.finishing = False
+        self.seq = 0
+        self.page = None
+
+    def start_worker(self, index):
+        """Start the worker of index with a new job queue."""
+        self.started[index], self.done[index], self.confirmed[index] = IDLE, 0, 0
+        self.queues[index] = Queue()
+        self.workers[index] = Process(target=run_worker, args=(self.dump, self.queues[index], self.results,
+            self.ring, self.started, self.done, index))
+        self.workers[index].start()
+
+    def pending_jobs(self, index):
+        """Return the jobs of a worker which are not finished."""
+        jobs = self.assigned[index]
+        while self.confirmed[index] < self.done[index]:
+            jobs.popleft()
+            self.confirmed[index] += 1
+        return jobs
+
+    def check_processes(self):
+        """Replace dead workers (their current page failed), raise RuntimeError if the writer died."""
+        if not self.writer.is_alive():
+            self.terminate()
+            raise RuntimeError("page writer died with exit code {}".format(self.writer.exitcode))
+        for index, p in enumerate(self.workers):
+            if p.is_alive() or p.exitcode == 0:
+                continue
+            jobs = self.pending_jobs(index)
+            lost = None
+            if jobs and self.started[index] == jobs[0][0]:
+                lost = jobs.popleft()
+                self.report_failed(lost)
+            logging.error("page worker died with exit code {} (page {})".format(p.exitcode,
+                lost[1] if lost is not None else None))
+            self.restarts += 1
+            self.start_worker(index)
+            # pages it did not start, a page is never sent twice to a worker
+            for job in jobs:
+                self.queues[index].put(job)
+            if self.finishing:
+                self.queues[index].put(None)
+
+    def terminate(self):
+        """Stop all processes (the pages in flight are lost)."""
+        for p in self.workers + [self.writer]:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        for jobs in self.queues + [self.results]:
+            jobs.cancel_join_thread()
+
+    def report_failed(self, job):
+        """Send a page which was not processed to the writer as failed."""
+        seq, page_id, title, revisions, ring_end, spill_path = job
+        if spill_path is not None and os.path.exists(spill_path):
+            os.remove(spill_path)
+        self.results.put((seq, ring_end, None, {}, page_id))
+
+    def send_job(self, job):
+        """Send a job to the worker with the fewest pending jobs (waits while all are busy)."""
+        while True:
+            self.check_processes()
+            index = min(range(len(self.workers)), key=lambda i: len(self.pending_jobs(i)))
+            if len(self.assigned[index]) < WORKER_JOBS:
+                break
+            time.sleep(WAIT_INTERVAL)
+        self.assigned[index].append(job)
+        self.queues[index].put(job)
+
+    def begin_page(self, page_id, title):
+        """Start collecting the revisions of a page."""
+        self.page = (page_id, title, [])
+        self.page_start = self.ring.head
+        self.inline_bytes = 0
+        self.spill_path = None
+
+    def add_revision(self, rev_values):
+        """Add revision data of WikiDump.get_rev to the current page."""
+        text_elem = rev_values.pop('text_elem', None)
+        data, size = "", None
+        if text_elem is not None:
+            data, size = read_text_elem(text_elem), text_elem_size(text_elem)
+        rev_values['size'] = len(data) if size is None else size
+        start = self.ring.write(data, self.page_start, self.check_processes)
+        if start is not None:
+            self.page[2].append((rev_values, RING, start, len(data)))
+            return
+        self.budget.reserve(len(data))
+        if not self.budget.over():
+            self.inline_bytes += len(data)
+            rev_values['raw_text'] = data
+            self.page[2].append((rev_values, INLINE, 0, len(data)))
+            return
+        self.budget.release(len(data))
+        if self.spill_path is None:
+            self.spill_path = self.budget.spill_file("page_")
+        with open(self.spill_path, "ab") as f:
+            start = f.tell()
+            f.write(data)
+        self.page[2].append((rev_values, SPILL, start, len(data)))
+
+    def end_page(self):
+        """Send the current page to the workers."""
+        page_id, title, revisions = self.page
+        self.send_job((self.seq, page_id, title, revisions, self.ring.head, self.spill_path))
+        self.budget.release(self.inline_bytes)
+        self.seq += 1
+        self.page = None
+
+    def finish(self):
+        """Wait for all pages, return (counters of the workers, failed pages)."""
+        self.finishing = True
+        for jobs in self.queues:
+            jobs.put(None)
+        while True:
+            # dead workers are replaced until all pages are processed
+            self.check_processes()
+            if not any(p.is_alive() for p in self.workers):
+                break
+            time.sleep(WAIT_INTERVAL)
+        # results of all workers are queued before these
+        for index in range(len(self.workers)):
+            for job in self.pending_jobs(index):
+                self.report_failed(job)
+        self.results.put(None)
+        while True:
+            try:
+                counters, failed = self.totals.get(timeout=POLL_INTERVAL)
+                break
+            except Empty:
+                self.check_processes()
+        self.writer.join()
+        counters['worker_restarts'] += self.restarts
+        return counters, failed
+
+
+def read_spill(path, start, length):
+    """Return the data written to a spill file at start."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+def process_page(dump, ring, page_id, title, revisions, spill_path=None):
+    """Run the revision logic of dump for a page, return (article, counters)."""
+    for name in WORKER_COUNTERS:
+        setattr(dump, name, 0)
+    dump.reset_page()
+    dump.article_id, dump.article_title = page_id, title
+    dump.begin_page(page_id, False)
+    try:
+        for rev_values, source, start, length in revisions:
+            if source == RING:
+                rev_values['raw_text'] = ring.read(start, length)
+            elif source == SPILL:
+                rev_values['raw_text'] = read_spill(spill_path, start, length)
+            if dump.handle_values(rev_values):
+                break
+    finally:
+        if spill_path is not None:
+            os.remove(spill_path)
+    if not dump.save_page_state():
+        # unchanged since the article was written in an earlier run
+        dump.current_article.close()
+        dump.current_article = None
+    article = dump.current_article
+    if article is not None:
+        # the writer removes the spill file of the article
+        article.release()
+        dump.current_article = None
+    if article is None or article.authors == 0:
+        article = None
+    return article, dict((name, getattr(dump, name)) for name in WORKER_COUNTERS)
+
+def get_job(jobs, reader):
+    """Return the next item of a queue, None if the reader process is gone."""
+    while True:
+        try:
+            return jobs.get(timeout=POLL_INTERVAL)
+        except Empty:
+            if os.getppid() != reader:
+                return None
+
+def run_worker(dump, jobs, results, ring, started, done, index):
+    """Worker process: process pages until a None job arrives.
+
+    started[index] is the page it processes, done[index] the number
+    of pages it finished (see PagePipeline.check_processes).
+    """
+    dump.create_pool = InlinePool
+    dump.pool = InlinePool()
+    dump.pipeline = None
+    reader = os.getppid()
+    while True:
+        job = get_job(jobs, reader)
+        if job is None:
+            break
+        seq, page_id, title, revisions, ring_end, spill_path = job
+        started[index] = seq
+        try:
+            article, counters = process_page(dump, ring, page_id, title, revisions, spill_path)
+            results.put((seq, ring_end, article, counters, None))
+        except Exception:
+            logging.exception("Error while processing page {}.".format(page_id))
+            results.put((seq, ring_end, None, {}, page_id))
+        started[index] = IDLE
+        done[index] += 1
+
+def run_writer(dump, results, ring, totals):
+    """Writer process: save the articles in page order until None arrives, put the totals into totals."""
+    pending = {}
+    next_seq = 0
+    counters = dict((name, 0) for name in WORKER_COUNTERS)
+    failed = []
+    reader = os.getppid()
+    while True:
+        result = get_job(results, reader)
+        if result is None:
+            break
+        if result[0] < next_seq or result[0] in pending:
+            # a page reported as failed and its result
+            continue
+        pending[result[0]] = result
+        while next_seq in pending:
+            seq, ring_end, article, page_counters, error = pending.pop(next_seq)
+            if error is not None:
+                failed.append(error)
+            for name, value in page_counters.iteritems():
+                counters[name] += value
+            if article is not None:
+                try:
+                    dump.write_article(article)
+                except Exception:
+                    logging.exception("Error while saving page {}.".format(article.article_id))
+                    failed.append(article.article_id)
+                finally:
+                    article.close()
+            ring.release(ring_end)
+            next_seq += 1
+    totals.put((counters, failed))
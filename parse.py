@@ -22,13 +22,30 @@
 Note:
     Parser module for parsing wikipedia markup syntax into
     english sentences by multi pass regular expressions. 
+    The second pass can also run on the single pass lexer of
+    the wikilexer module (second_pass_engine).
+
+    With incremental_parse the passes are run per section (a
+    section starts at a heading line) and cached by the sha1 of
+    its wiki text, consecutive revisions of an article only
+    parse their changed sections. Sections are merged where
+    markup can cross the heading between them, the result is
+    the same as of a full parse.
+
+    With deterministic_dummies the random dates and numbers of
+    dummy templates are seeded by the text of the template.
 -----------------------------------------------------------
 """
 import HTMLParser
+import hashlib
+import htmlentitydefs
 import logging
+import os
+import re
 import regex
 import time
 import utils
+import wikilexer
 
 apostrophes = ["'''''", "''''", "'''", "''"]
 double_space = ['  ']
@@ -45,36 +62,189 @@ strip_punctuation = [' .', ' ,', ' ;', ' !', ' ?', ' :']
 remove_strings = apostrophes + horizontal + magicwords + signature
 to_space = newlines + double_space + html_delete
 remove_all = False
+
+def replacement_table(groups, new):
+    """Return [(trigger, [(old, new), ...]), ...] of groups of strings (trigger: common prefix of a group)."""
+    return [(os.path.commonprefix(group), [(old, new) for old in group]) for group in groups if group]
+
+# same replacements as remove_strings and to_space, a group is skipped
+# if its trigger is not in the text
+remove_table = replacement_table([apostrophes, horizontal, magicwords, signature], "")
+space_table = replacement_table([newlines, double_space, html_delete], " ")
+# strip_punctuation in one pass (a removed space can not form another pair)
+punctuation_space = re.compile(" ([{}])".format(re.escape("".join(s.lstrip(' ') for s in strip_punctuation))))
+
+# html entities by name, other entities are unescaped by htmlParser (and kept if short)
+entity_map = dict((u"&{};".format(name), unichr(code)) for name, code in htmlentitydefs.name2codepoint.iteritems())
+entity_map[u"&apos;"] = u"'"
+MAX_ENTITY_LENGTH = 12
+MAX_ENTITY_MAP = 20000
+
+# "regex" (regex.second_pass) or "lexer" (wikilexer module)
+second_pass_engine = "regex"
 htmlParser = HTMLParser.HTMLParser()
 
+# random values of dummy templates seeded by the template text, the same
+# wiki text always gives the same result (see parsecache module)
+deterministic_dummies = False
+
+# to be increased when a change of the parser changes its results, results
+# of another version in the parse cache are not used (see parser_config)
+PARSER_VERSION = 1
+
+# parse sections of the wiki text on their own and reuse the results of
+# unchanged sections (sha1 of the section -> Section)
+incremental_parse = False
+SECTION_CACHE_SIZE = 2000
+SENTENCE_CACHE_SIZE = 20000
+MAX_SECTION_MERGES = 8
+section_cache = utils.LRUCache(SECTION_CACHE_SIZE)
+sentence_cache = utils.LRUCache(SENTENCE_CACHE_SIZE)
+section_start = re.compile(r"\n(?==)")
+
+
+class Section(object):
+    """Results of both passes of a section and the checks of its boundaries."""
+    __slots__ = ["text", "malformed", "open_end", "entity_open", "stray_brace", "heading"]
+
+    def __init__(self, string):
+        """Initializes a Section object
+
+        Args:
+            string: Wiki text of the section.
+        """
+        # an entity of the next section could start in this one
+        self.entity_open = string.rfind("&") > string.rfind(";")
+        temp = regex.html_entities.sub(unescape, string)
+        # inv_clos_brackets after a template of the previous section could
+        # reach a closing bracket before the first opening one
+        closing, opening = temp.find("}"), temp.find("{")
+        self.stray_brace = closing != -1 and (opening == -1 or closing < opening)
+        temp, self.malformed = remove_templates(temp)
+        temp = normalize(temp, remove_table)
+        self.heading = temp.startswith("\n=") and wikilexer.match_heading(temp, 1) is not None
+        self.text, self.open_end = "", False
+        if not self.malformed:
+            self.text, self.open_end = wikilexer.substitute_section(temp, process_markup)
+
+    def continues(self, previous):
+        """Return True if no markup crosses the boundary between previous and this section."""
+        return (not previous.malformed and not previous.entity_open and not previous.open_end
+            and self.heading and not self.stray_brace)
+
+def parser_config():
+    """Return the version and the settings of the parser which change its results as string."""
+    return "v{} second_pass={} incremental={} deterministic_dummies={}".format(
+        PARSER_VERSION, second_pass_engine, int(incremental_parse), int(deterministic_dummies))
+
 def first_pass(string):
     """Filter html entities and check if wiki-markup is malformed."""
     temp = regex.html_entities.sub(unescape, string)
+    temp, is_malformed = remove_templates(temp)
+    temp = normalize(temp, remove_table)
+    return temp, is_malformed
+
+def remove_templates(temp):
+    """Remove the templates of a text and check if they are malformed."""
     is_malformed = False
-    malformed = False
+    result = []
+    last_pos = 0
 
-    found_pos = 0
+    found_pos = temp.find("{")
     while(found_pos != -1):
-        found_pos = temp.find("{", found_pos)
-        if found_pos != -1:
-            add_temp, malformed = remove_bracket(temp[found_pos:])
-            if malformed:
-                is_malformed = True
-            temp = temp[:found_pos] + add_temp
-
-    for r in remove_strings:
-        temp = temp.replace(r, "")
-    return temp, is_malformed
+        result.append(temp[last_pos:found_pos])
+        add_temp, last_pos = remove_bracket(temp, found_pos)
+        if last_pos is None:
+            # the rest of the text is replaced by the recovered text
+            is_malformed = True
+            temp, last_pos = add_temp, 0
+        else:
+            result.append(add_temp)
+        found_pos = temp.find("{", last_pos)
+    result.append(temp[last_pos:])
+    return "".join(result), is_malformed
 
 def second_pass(string):
     """Parse syntax and filter markup."""
-    temp = regex.second_pass.sub(process_reg, string)
-    temp = regex.emptylines.sub("\n\n", temp)
-    for t in to_space:
-        temp = temp.replace(t, " ")
-    for s in strip_punctuation:
-        temp = temp.replace(s, s.lstrip(' '))
-    return temp
+    return clean_spaces(substitute(string))
+
+def clean_spaces(temp):
+    """Remove empty lines, spaces and spaces before punctuation (end of the second pass)."""
+    if "\n\n\n" in temp:
+        temp = regex.emptylines.sub("\n\n", temp)
+    temp = normalize(temp, space_table)
+    return punctuation_space.sub(r"\1", temp)
+
+def normalize(string, table):
+    """Replace the strings of a replacement table in order."""
+    for trigger, replacements in table:
+        if trigger in string:
+            for old, new in replacements:
+                string = string.replace(old, new)
+    return string
+
+def substitute(string):
+    """Replace the markup of regex.second_pass with the selected engine."""
+    if second_pass_engine == "lexer":
+        return wikilexer.substitute(string, process_markup)
+    return regex.second_pass.sub(process_reg, string)
+
+def parse_text(string):
+    """Run both passes on wiki text, return (text, is_malformed)."""
+    if incremental_parse:
+        return parse_sections(string)
+    string, is_malformed = first_pass(string)
+    if is_malformed:
+        return "", True
+    return second_pass(string), False
+
+def parse_sections(string):
+    """Run both passes on the sections of wiki text, unchanged sections are taken from the cache."""
+    sections = []
+    last = 0
+    for found in section_start.finditer(string):
+        sections.append(string[last:found.start()])
+        last = found.start()
+    sections.append(string[last:])
+
+    # (wiki text, Section) of sections merged where their boundary is crossed
+    units = []
+    merges = 0
+    for text in sections:
+        units.append((text, get_section(text)))
+        while len(units) > 1 and not units[-1][1].continues(units[-2][1]):
+            merges += 1
+            if merges > MAX_SECTION_MERGES:
+                string, is_malformed = first_pass(string)
+                if is_malformed:
+                    return "", True
+                return second_pass(string), False
+            text = units[-2][0] + units.pop()[0]
+            units[-1] = (text, get_section(text))
+
+    if units[-1][1].malformed:
+        return "", True
+    return clean_spaces("".join(section.text for _, section in units)), False
+
+def get_section(string):
+    """Return the Section of wiki text (cached by its sha1)."""
+    key = hashlib.sha1(string.encode("utf-8")).digest()
+    section = section_cache.lookup(key)
+    if section is None:
+        section = Section(string)
+        section_cache.store(key, section)
+    return section
+
+def split_sentences(segment):
+    """Return the sentences of a paragraph, with incremental_parse they are cached."""
+    if not incremental_parse:
+        return utils.split_sentences(segment)
+    key = hashlib.sha1(segment.encode("utf-8")).digest()
+    sentences = sentence_cache.lookup(key)
+    if sentences is None:
+        sentences = utils.split_sentences(segment)
+        sentence_cache.store(key, sentences)
+    return sentences
 
 def parse_wiki_text(string, get_cropped=False):
     """Parse wiki text."""
@@ -82,12 +252,11 @@ def parse_wiki_text(string, get_cropped=False):
         return ""
     
     is_malformed = False
-    string, is_malformed = first_pass(string)
+    string, is_malformed = parse_text(string)
     
     if is_malformed:
         return "", True
     
-    string = second_pass(string)
     string = string.strip()
     result = []
 
@@ -95,7 +264,7 @@ def parse_wiki_text(string, get_cropped=False):
         if len(segment) > 10000:
             is_malformed = True
             break
-        result += utils.split_sentences(segment)
+        result += split_sentences(segment)
         result.append("")
     
     if len(result) > 0 and result[-1] == "":
@@ -109,12 +278,11 @@ def parse_wiki_text_cropped(string):
         return ""
   
     is_malformed = False
-    string, is_malformed = first_pass(string)
+    string, is_malformed = parse_text(string)
   
     if is_malformed:
         return "", "", True
     
-    string = second_pass(string)
     string = string.strip()
     result = []
     cropped = []
@@ -123,7 +291,7 @@ def parse_wiki_text_cropped(string):
         if len(segment) > 10000:
             is_malformed = True
             break
-        add_segment = utils.split_sentences(segment)
+        add_segment = split_sentences(segment)
         result += add_segment
         result.append("")
 
@@ -138,44 +306,53 @@ def parse_wiki_text_cropped(string):
 
     return result, cropped, is_malformed
 
-def remove_bracket(string):
-    """Remove curly brackets from text (templates)."""
-    open_brackets = 0
-    cur_pos = 0
-    job_done = False
-    dummy_result = ""
+def parse_batch(strings, timeout=None, cropped=False):
+    """Parse a list of wiki texts, return (status, result) of each (see utils.run_batch)."""
+    func = parse_wiki_text_cropped if cropped else parse_wiki_text
+    return utils.run_batch(func, [(string,) for string in strings], timeout)
 
-    while job_done is False:
-        match = regex.curly_brackets.search(string, cur_pos)
+def remove_bracket(string, start=0):
+    """Remove curly brackets from text (template at start).
 
-        if match is None:
-            return recover_malformed(string, open_brackets), True
+    Returns the dummy result of the template and the position after
+    it, or the recovered rest of the text and None if the brackets
+    are malformed.
+    """
+    open_brackets = 0
+    dummy_result = ""
+    dummy_name = None
 
+    for match in regex.curly_brackets.finditer(string, start):
         if match.group() == "{":
             open_brackets += 1
         elif match.group() == "}":
             open_brackets -= 1
 
-        cur_pos = match.start() + 1
+        cur_pos = match.end()
 
-        if cur_pos == 2 and open_brackets == 2:
+        if cur_pos == start + 2 and open_brackets == 2:
             # check if template is one of the following
-            temp_name = regex.template_name.match(string[cur_pos:])
+            temp_name = regex.template_name.match(string, cur_pos)
             if temp_name is not None:
                 if temp_name.lastgroup == "convert":
                     dummy_result = utils.dummy_conv_result((temp_name.group('arg1'), temp_name.group('arg2'),
                     temp_name.group('arg3'), temp_name.group('arg4')))
                 else:
-                    temp_name = temp_name.group().strip().lower().replace(" ", "_")
-                    dummy_result = utils.dummy_temp_result(temp_name)
+                    dummy_name = temp_name.group().strip().lower().replace(" ", "_")
 
         if open_brackets == 0:
+            if dummy_name is not None:
+                if deterministic_dummies:
+                    utils.seed_dummies(string[start:cur_pos])
+                dummy_result = utils.dummy_temp_result(dummy_name)
             invalid_post_string = regex.inv_clos_brackets.match(string, cur_pos)
   
             if invalid_post_string:
                 cur_pos = invalid_post_string.end()
   
-            return dummy_result + string[cur_pos:], False
+            return dummy_result, cur_pos
+
+    return recover_malformed(string[start:], open_brackets), None
 
 def recover_malformed(string, open_brackets):
     """Recover from malformed syntax."""
@@ -223,6 +400,17 @@ def recover_malformed(string, open_brackets):
 def process_reg(matched):
     """Delete or parse markup."""
     group = matched.lastgroup
+    keep = None
+    if group == "link":
+        keep = matched.group('link_keep')
+    elif group == "nowiki":
+        keep = matched.group('nowiki_keep')
+    elif group == "single_link":
+        keep = matched.group('slink_keep')
+    return process_markup(group, matched.group(group), keep)
+
+def process_markup(group, text, keep):
+    """Delete or parse markup of a second_pass group (text is the markup, keep its kept part)."""
     del_completely = ("comments", "headings", "lists", 
         "redirect", "regular_tags", "single_curbrac", "single_tags", "tags")
 
@@ -230,18 +418,18 @@ def process_reg(matched):
         return ""
 
     elif group == "html_entities":
-        return htmlParser.unescape(matched.group())
+        return unescape_entity(text)
 
     elif group == "link":
         start = ""
-        if matched.group('link').startswith(" "):
+        if text.startswith(" "):
             start = " "
 
         tail = ""
-        if matched.group('link').endswith(" "):
+        if text.endswith(" "):
             tail = " "
 
-        link_text = matched.group('link_keep')
+        link_text = keep
         if link_text.lower().startswith("wikt:"):
             link_text = link_text[5:]
 
@@ -250,27 +438,27 @@ def process_reg(matched):
 
         stripped_text = split_link(link_text, '|')
         stripped_text = start + stripped_text + tail
-        return regex.second_pass.sub(process_reg, stripped_text)
+        return substitute(stripped_text)
 
     elif group == 'nowiki':
-        return matched.group('nowiki_keep')
+        return keep
 
     elif group == "single_link":
         start = ""
-        if matched.group('single_link').startswith(" "):
+        if text.startswith(" "):
             start = " "
         tail = ""
-        if matched.group('single_link').endswith(" "):
+        if text.endswith(" "):
             tail = " "
 
-        link_text = matched.group('slink_keep')
+        link_text = keep
         stripped_text = split_link(link_text, ' ', False)
         if stripped_text != "":
             stripped_text = start + stripped_text + tail
-        return regex.second_pass.sub(process_reg, stripped_text)
+        return substitute(stripped_text)
 
     else:
-        logging.warning(u"----unknown group <{}>, content:\n{}".format(group, matched.group(group)).encode("UTF-8")) 
+        logging.warning(u"----unknown group <{}>, content:\n{}".format(group, text).encode("UTF-8")) 
         return ""
 
 def split_link(string, split_by, keep_if_not_splittable=True):
@@ -289,4 +477,13 @@ def split_link(string, split_by, keep_if_not_splittable=True):
 
 def unescape(matched):
     """Remove html tags."""
-    return htmlParser.unescape(matched.group())
+    return unescape_entity(matched.group())
+
+def unescape_entity(text):
+    """Return the unescaped text of an html entity match."""
+    result = entity_map.get(text)
+    if result is None:
+        result = htmlParser.unescape(text)
+        if len(text) <= MAX_ENTITY_LENGTH and len(entity_map) < MAX_ENTITY_MAP:
+            entity_map[text] = result
+    return result
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - parsecache module
+-----------------------------------------------------------
+
+Note:
+    Cache of parse results by the sha1 of the revision text.
+    Reverted revisions (edit wars) have the sha1 of an earlier
+    revision and are not parsed again. The cache is kept by the
+    process which submits the parses to the pool, so it serves
+    all workers of the pool.
+
+    The most recently used results are kept in memory, an
+    optional sqlite database keeps all results (zlib compressed
+    json), it can be shared by several processes and runs.
+
+    Results are kept per parser config (parse.parser_config, the
+    parser version and settings), results of another config in
+    the database are not used.
+
+    Only with parse.deterministic_dummies the results of a cached
+    text are the same as of a new parse.
+-----------------------------------------------------------
+"""
+import json
+import os
+import sqlite3
+import utils
+import zlib
+
+BUSY_TIMEOUT = 60
+
+
+class CachedResult(object):
+    """Cached parse result (AsyncResult interface)."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return True
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self, timeout=None):
+        return self.value
+
+
+class ParseCache(object):
+    def __init__(self, size, path=None, config=""):
+        """Initializes a ParseCache object
+
+        Args:
+            size: Number of parse results kept in memory.
+            path: Optional path of a sqlite database keeping all
+                    parse results (created if it does not exist).
+            config: The parser config the results belong to
+                    (see parse.parser_config).
+        """
+        self.memory = utils.LRUCache(size)
+        self.path = path
+        self.config = config
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        """Return the database connection of this process."""
+        if self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS results (config TEXT, sha1 TEXT, "
+                "cropped INTEGER, result BLOB, PRIMARY KEY (config, sha1, cropped))")
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
+
+    def get(self, sha1, cropped):
+        """Return the cached result of a parse (None if there is none).
+
+        Args:
+            sha1: sha1 of the revision text.
+            cropped: True for a result of parse.parse_wiki_text_cropped,
+                    False for one of parse.parse_wiki_text.
+        """
+        if sha1 is None:
+            return None
+        key = (sha1, cropped)
+        result = self.memory.lookup(key)
+        if result is None and self.path is not None:
+            row = self.connect().execute("SELECT result FROM results "
+                "WHERE config = ? AND sha1 = ? AND cropped = ?", (self.config, sha1, int(cropped))).fetchone()
+            if row is not None:
+                result = tuple(json.loads(zlib.decompress(str(row[0]))))
+                self.memory.store(key, result)
+        return result
+
+    def put(self, sha1, cropped, result):
+        """Cache the result of a parse (see get)."""
+        if sha1 is None:
+            return
+        key = (sha1, cropped)
+        if self.memory.lookup(key) is not None:
+            return
+        self.memory.store(key, result)
+        if self.path is not None:
+            conn = self.connect()
+            conn.execute("INSERT OR REPLACE INTO results (config, sha1, cropped, result) VALUES (?, ?, ?, ?)",
+                (self.config, sha1, int(cropped), buffer(zlib.compress(json.dumps(result), 6))))
+            conn.commit()
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn, self.pid = None, None
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - pipeline module
+-----------------------------------------------------------
+
+Note:
+    Pipelined parsing of the revisions of a page. Instead of
+    waiting for every parse in lockstep, the parses of a window
+    of upcoming revisions are submitted to the pool while the
+    dump is read on. Diffs are submitted as soon as both of
+    their revisions are parsed.
+
+    The results are resolved strictly in revision order with the
+    same decisions as the sequential code, parses which turn out
+    to be unnecessary (the previous revision was malformed) are
+    discarded. Entries are added to the article in order.
+
+    Without a window all revisions of a page are collected: at
+    the end of the page all parses run in parallel, then all
+    diffs, and the entries are assembled in a sequential pass
+    (for pages with thousands of revisions).
+
+    With a batch size > 1 parses and diffs are sent to the pool
+    in batches (see parse.parse_batch and utils.get_additions_batch),
+    every item of a batch has its own status and timeout.
+
+    With a parse cache (see parsecache module) cached revisions
+    are not submitted, revisions of the same text in flight share
+    one parse.
+
+    With a memory budget the oldest revisions are resolved early
+    while the texts in flight exceed it (the reader waits).
+
+    A timeout restarts the pool, the lost tasks of the window are
+    submitted again (not needed for timeouts of single items of a
+    batch or of a WorkerPool task).
+-----------------------------------------------------------
+"""
+from collections import deque
+from entry import entry
+from multiprocessing import TimeoutError
+import logging
+import parse
+import utils
+import workerpool
+
+PARSE_TIMEOUT = 10
+DIFF_TIMEOUT = 120
+
+
+class ItemTimeout(workerpool.TaskTimeout):
+    """Timeout of a single item of a batch (the pool worker is not stuck)."""
+
+
+class ItemError(Exception):
+    """Error of a single item of a batch."""
+
+
+class BatchItem(object):
+    """Result of a single call in a batch (AsyncResult interface)."""
+
+    def __init__(self, batcher, func, args):
+        self.batcher, self.func, self.args = batcher, func, args
+        self.batch, self.index, self.size = None, None, None
+
+    def send(self):
+        if self.batch is None:
+            self.batcher.send(self.func)
+
+    def ready(self):
+        return self.batch is not None and self.batch.ready()
+
+    def successful(self):
+        return self.batch.successful() and self.batch.get()[self.index][0] == utils.BATCH_OK
+
+    def wait(self, timeout=None):
+        self.send()
+        self.batch.wait(None if timeout is None else timeout * self.size)
+
+    def get(self, timeout=None):
+        """Return the result of the call, raise ItemTimeout or ItemError of the item."""
+        self.send()
+        status, result = self.batch.get(None if timeout is None else timeout * self.size)[self.index]
+        if status == utils.BATCH_TIMEOUT:
+            raise ItemTimeout(result)
+        elif status == utils.BATCH_ERROR:
+            raise ItemError(result)
+        return result
+
+
+class Batcher(object):
+    """Collects calls of parse and diff functions and sends them as batches."""
+
+    def __init__(self, dump, size):
+        self.dump = dump
+        self.size = size
+        self.pending = {}
+
+    def apply(self, func, args):
+        """Return a BatchItem for func(*args), the batch is sent when it is full."""
+        item = BatchItem(self, func, args)
+        self.pending.setdefault(func, []).append(item)
+        if len(self.pending[func]) >= self.size:
+            self.send(func)
+        return item
+
+    def send(self, func):
+        """Send the collected calls of func to the pool."""
+        items = self.pending.pop(func, [])
+        if not items:
+            return
+        if func is utils.get_additions:
+            batch = self.dump.pool.apply_async(utils.get_additions_batch,
+                ([item.args for item in items], DIFF_TIMEOUT))
+        else:
+            batch = self.dump.pool.apply_async(parse.parse_batch,
+                ([item.args[0] for item in items], PARSE_TIMEOUT, func is parse.parse_wiki_text_cropped))
+        for index, item in enumerate(items):
+            item.batch, item.index, item.size = batch, index, len(items)
+
+    def clear(self):
+        """Drop all collected calls (after a restart of the pool)."""
+        self.pending = {}
+
+
+class Step(object):
+    """A revision which gets parsed (and diffed against its predecessor)."""
+
+    def __init__(self, rev_old, rev_new):
+        self.rev_old, self.rev_new = rev_old, rev_new
+        self.diff_task = None
+        self.size = rev_new.size
+
+
+class RevisionPipeline(object):
+    def __init__(self, dump, window, batch_size=1, budget=None):
+        """Initializes a RevisionPipeline object
+
+        Args:
+            dump: The WikiDump object whose pool, current article
+                    and counters are used.
+            window: Maximum number of revisions in flight, None
+                    to collect all revisions of a page.
+            batch_size: Number of parses or diffs sent to the pool
+                    at once (1 for single calls).
+            budget: An optional budget.MemoryBudget for the texts
+                    in flight.
+        """
+        self.dump = dump
+        self.window = window
+        self.budget = budget
+        self.batcher = Batcher(dump, batch_size) if batch_size > 1 else None
+        self.steps = deque()
+        self.current = None
+        # (sha1, func) -> parse task in flight, shared by revisions of the same text
+        self.parsing = {}
+
+    def add(self, rev_old, rev_new):
+        """Add a revision to parse (rev_old is None for the first revision of a page)."""
+        step = Step(rev_old, rev_new)
+        self.steps.append(step)
+        if self.budget is not None:
+            self.budget.reserve(step.size)
+        self.submit_parses(step)
+        self.poll()
+        while self.window is not None and len(self.steps) > self.window:
+            self.resolve(self.steps.popleft())
+        while self.steps and self.budget is not None and self.budget.over():
+            # backpressure: do not read on before texts are freed
+            self.resolve(self.steps.popleft())
+        self.current = None
+
+    def flush(self):
+        """Resolve all revisions in flight (at the end of a page)."""
+        if self.window is None:
+            self.submit_diffs()
+        while self.steps:
+            self.resolve(self.steps.popleft())
+        self.current = None
+        self.parsing = {}
+
+    def submit_parses(self, step):
+        """Submit the parses a step may need."""
+        if step.rev_old is None:
+            self.submit_parse(step.rev_new, parse.parse_wiki_text_cropped)
+        else:
+            self.submit_parse(step.rev_new, parse.parse_wiki_text)
+            if step.rev_old.parsed_text is None:
+                self.submit_parse(step.rev_old, parse.parse_wiki_text)
+
+    def submit_parse(self, rev, func):
+        if rev.parse_task is not None:
+            return
+        rev.parse_task = self.dump.cached_parse(func, rev)
+        if rev.parse_task is not None:
+            return
+        key = (rev.md5, func)
+        if key in self.parsing:
+            # a revision of the same text is parsed already
+            self.dump.cached_parses += 1
+            rev.parse_task = self.parsing[key]
+            return
+        rev.parse_task = self.apply(func, (rev.wiki_text,))
+        if self.dump.parse_cache is not None and rev.md5 is not None:
+            self.parsing[key] = rev.parse_task
+
+    def apply(self, func, args):
+        """Submit func(*args) to the pool (through the batcher if there is one)."""
+        if self.batcher is not None:
+            return self.batcher.apply(func, args)
+        return self.dump.pool.apply_async(func, args)
+
+    def poll(self):
+        """Submit the diffs of all steps whose revisions are parsed."""
+        for step in self.steps:
+            if step.rev_old is None or step.diff_task is not None:
+                continue
+            old_task, new_task = step.rev_old.parse_task, step.rev_new.parse_task
+            if step.rev_old.parsed_text is not None:
+                old_text, old_malformed = step.rev_old.parsed_text, step.rev_old.is_malformed
+            elif old_task is not None and old_task.ready() and old_task.successful():
+                old_text, old_malformed = old_task.get()[0], old_task.get()[-1]
+            else:
+                continue
+            if old_malformed:
+                # never diffed against a malformed revision
+                continue
+            if new_task is not None and new_task.ready() and new_task.successful():
+                step.diff_task = self.apply(utils.get_additions, (old_text, new_task.get()[0]))
+
+    def submit_diffs(self):
+        """Wait for all parses in flight and submit the diffs of all steps at once."""
+        for step in self.steps:
+            for rev in (step.rev_old, step.rev_new):
+                if rev is not None and rev.parse_task is not None:
+                    rev.parse_task.wait(PARSE_TIMEOUT)
+                    if not rev.parse_task.ready():
+                        # resolve() handles the timeout
+                        self.poll()
+                        return
+        self.poll()
+
+    def get_parse(self, rev, func):
+        """Wait for the parse of rev and return its result (None on timeout)."""
+        self.submit_parse(rev, func)
+        try:
+            result = rev.parse_task.get(timeout=PARSE_TIMEOUT)
+            self.dump.cache_parse(func, rev, result)
+            self.parsing.pop((rev.md5, func), None)
+            return result
+        except TimeoutError, e:
+            logging.warning("----revision {} parsing timed out".format(rev.rev_id))
+            if not isinstance(e, workerpool.TaskTimeout):
+                self.restart()
+            return None
+        finally:
+            rev.parse_task = None
+
+    def restart(self):
+        """Restart the pool and submit the lost tasks again."""
+        self.dump.restart_pool()
+        if self.batcher is not None:
+            self.batcher.clear()
+        self.parsing = {}
+        for step in [self.current] + list(self.steps):
+            if step is None:
+                continue
+            step.diff_task = None
+            for rev in (step.rev_old, step.rev_new):
+                if rev is not None:
+                    rev.parse_task = None
+        for step in self.steps:
+            self.submit_parses(step)
+
+    def resolve(self, step):
+        """Apply the results of a step like the sequential code."""
+        dump = self.dump
+        rev_old, rev_new = step.rev_old, step.rev_new
+        self.current = step
+        if self.budget is not None:
+            self.budget.release(step.size)
+        self.poll()
+
+        if rev_old is None:
+            # first revision of the article: parse wiki-text and save entry
+            dump.usable_revisions += 1
+            result = self.get_parse(rev_new, parse.parse_wiki_text_cropped)
+            if result is None:
+                rev_new.parsed_text, cropped_text, rev_new.is_malformed = "", "", True
+            else:
+                rev_new.parsed_text, cropped_text, rev_new.is_malformed = result
+
+            if not rev_new.is_malformed and len(cropped_text) >= 12:
+                self.save_entry(rev_new, cropped_text)
+            return
+
+        if rev_old.is_malformed:
+            return
+
+        dump.usable_revisions += 1
+        if rev_new.parsed_text is None:
+            result = self.get_parse(rev_new, parse.parse_wiki_text)
+            if result is None:
+                rev_new.parsed_text, rev_new.is_malformed = "", True
+            else:
+                rev_new.parsed_text, rev_new.is_malformed = result
+
+        if rev_old.parsed_text is None:
+            result = self.get_parse(rev_old, parse.parse_wiki_text)
+            if result is None:
+                rev_old.parsed_text, rev_old.is_malformed = "", True
+            else:
+                rev_old.parsed_text, rev_old.is_malformed = result
+            if rev_old.is_malformed:
+                dump.usable_revisions -= 1
+
+        if not rev_old.is_malformed:
+            diff_additions = []
+            if step.diff_task is None:
+                step.diff_task = self.apply(utils.get_additions, (rev_old.parsed_text, rev_new.parsed_text))
+            try:
+                diff_additions = step.diff_task.get(timeout=DIFF_TIMEOUT)
+            except TimeoutError, e:
+                logging.warning("----revision {} diff calculation timed out".format(rev_new.rev_id))
+                if not isinstance(e, workerpool.TaskTimeout):
+                    self.restart()
+
+            if not rev_new.is_malformed and len(diff_additions) >= 12:
+                self.save_entry(rev_new, diff_additions)
+
+    def save_entry(self, rev, text):
+        dump = self.dump
+        new_entry = entry(rev.contributor.con_id, text, dump.current_article.current_pos())
+        dump.current_article.append(new_entry)
+        logging.info("----revision {} by user {} saved".format(rev.rev_id, rev.contributor.con_id))
+        dump.actual_revisions += 1
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - prescan module
+-----------------------------------------------------------
+
+Note:
+    Fast pre-scan of a dump file without xml parsing. Only the
+    tags are searched (the wiki-text is xml escaped, so it can
+    not contain tags), the text size is taken from the bytes
+    attribute of the text elements.
+
+    For every page the id, namespace, redirect flag, number of
+    revisions, total text bytes and the byte offset of <page>
+    (in the decompressed data) are saved as binary table next
+    to the dump file (<dumpfile>.scan).
+
+    The table is used to estimate the runtime of a dump and to
+    give the most expensive pages of uncompressed dumps to the
+    shards first. The cost figures are rough values, measured
+    on a single core.
+-----------------------------------------------------------
+"""
+from collections import namedtuple
+import bz2stream
+import compression
+import logging
+import os
+import re
+import struct
+
+SCAN_MAGIC = "WDPSCN1\0"
+scan_header = struct.Struct("<8sQ")
+page_record = struct.Struct("<QQiBIQ")
+
+CHUNK_SIZE = 1024 * 1024
+KEEP_SIZE = 1024
+
+# rough cost of a processed revision (read, hash, compare) and of
+# a byte of processed wiki-text (parse, diff) in seconds
+REVISION_SECONDS = 0.0002
+TEXT_BYTE_SECONDS = 0.00000005
+# cost of a revision of a skipped page
+SKIPPED_REVISION_SECONDS = 0.000002
+
+PageInfo = namedtuple("PageInfo", "page_id offset ns redirect revisions text_bytes")
+
+tokens = re.compile(r"<page>|</page>|<revision>|<text\b[^>]*>|<ns>[^<]*</ns>|<id>[^<]*</id>|<redirect\b")
+text_bytes = re.compile(r"""\sbytes=["'](\d+)["']""")
+
+def scan_path(dump_path):
+    """Return path of the scan table of a dump file."""
+    return dump_path + ".scan"
+
+def scan_pages(f, chunk_size=CHUNK_SIZE):
+    """Yield a PageInfo of every page of an (uncompressed) file object."""
+    buf = ""
+    buf_start = 0
+    eof = False
+    page = None
+    in_header = False
+
+    while not eof:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf += chunk
+        limit = len(buf) if eof else len(buf) - KEEP_SIZE
+        rest = max(0, limit)
+
+        for match in tokens.finditer(buf):
+            if match.end() > limit:
+                # the tag may be incomplete, search again with the next chunk
+                rest = match.start()
+                break
+            rest = max(match.end(), limit)
+            tag = match.group(0)
+
+            if tag == "<page>":
+                page = [0, buf_start + match.start(), 0, False, 0, 0]
+                in_header = True
+            elif page is None:
+                continue
+            elif tag == "<revision>":
+                page[4] += 1
+                in_header = False
+            elif tag == "</page>":
+                yield PageInfo(*page)
+                page = None
+            elif tag.startswith("<text"):
+                size = text_bytes.search(tag)
+                if size:
+                    page[5] += int(size.group(1))
+            elif not in_header:
+                continue
+            elif tag.startswith("<ns>"):
+                page[2] = int(tag[4:-5])
+            elif tag.startswith("<id>"):
+                if page[0] == 0:
+                    page[0] = int(tag[4:-5])
+            else:
+                page[3] = True
+
+        buf_start += rest
+        buf = buf[rest:]
+
+def build_scan(dump_path, processes=0):
+    """Scan a dump file and save its scan table, return the number of pages."""
+    logging.info("pre-scanning {}".format(dump_path))
+    if os.path.splitext(dump_path)[1] == ".bz2" and processes > 0:
+        f = bz2stream.open_dump(dump_path, processes)
+    else:
+        f = compression.open_dump(dump_path)
+
+    path = scan_path(dump_path)
+    count = 0
+    with f, open(path + ".tmp", "wb") as out:
+        out.write(scan_header.pack(SCAN_MAGIC, 0))
+        for page in scan_pages(f):
+            out.write(page_record.pack(*page))
+            count += 1
+        out.seek(0)
+        out.write(scan_header.pack(SCAN_MAGIC, count))
+    os.rename(path + ".tmp", path)
+    return count
+
+def read_scan(dump_path):
+    """Yield the PageInfo records of the scan table of a dump file."""
+    with open(scan_path(dump_path), "rb") as f:
+        magic, count = scan_header.unpack(f.read(scan_header.size))
+        if magic != SCAN_MAGIC:
+            raise ValueError("{} is not a scan table".format(scan_path(dump_path)))
+        for i in xrange(count):
+            page_id, offset, ns, redirect, revisions, size = page_record.unpack(f.read(page_record.size))
+            yield PageInfo(page_id, offset, ns, bool(redirect), revisions, size)
+
+def load_scan(dump_path, processes=0):
+    """Return the PageInfo records of a dump file, scan it if the table is missing or outdated."""
+    path = scan_path(dump_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(dump_path):
+        build_scan(dump_path, processes)
+    return read_scan(dump_path)
+
+def page_cost(page, max_revisions, rev_filter):
+    """Return the estimated processing time of a page in seconds."""
+    if page.redirect or not rev_filter.accept_page(str(page.ns)):
+        return page.revisions * SKIPPED_REVISION_SECONDS
+    revisions = page.revisions
+    if max_revisions != -1 and revisions > max_revisions:
+        revisions = max_revisions
+    size = page.text_bytes * revisions // max(page.revisions, 1)
+    return revisions * REVISION_SECONDS + size * TEXT_BYTE_SECONDS
+
+def estimate(pages, max_revisions, rev_filter):
+    """Return the totals and the estimated processing time of a dump as dictionary."""
+    result = dict(pages=0, usable_pages=0, revisions=0, text_bytes=0, seconds=0.0, max_seconds=0.0)
+    for page in pages:
+        cost = page_cost(page, max_revisions, rev_filter)
+        result['pages'] += 1
+        result['revisions'] += page.revisions
+        result['text_bytes'] += page.text_bytes
+        result['seconds'] += cost
+        result['max_seconds'] = max(result['max_seconds'], cost)
+        if not page.redirect and rev_filter.accept_page(str(page.ns)):
+            result['usable_pages'] += 1
+    return result
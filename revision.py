@@ -26,30 +26,73 @@ Note:
     a starting and ending line number and the corresponding
     text.
 
+    The wiki-text is kept as raw UTF-8 bytes of the text element
+    (read on first use) and only decoded when it gets parsed,
+    the size is taken from the bytes attribute of the element.
+
     Contributor class for saving the contributor of a revision.
     A valid contributor has an id and a name (an ip adress is
     not enough).
 -----------------------------------------------------------
 """
+from lxml import etree
 import re
 
+def read_text_elem(text_elem):
+    """Return the text of a text element as UTF-8 bytes."""
+    return etree.tostring(text_elem, method='text', encoding='UTF-8', with_tail=False)
+
+def text_elem_size(text_elem):
+    """Return the bytes attribute of a text element (None if it is missing)."""
+    size = text_elem.get('bytes')
+    if size is not None:
+        return int(size)
+    return None
+
+
 class Revision(object):
     def __init__(self, values, contributor):
         """init"""
-        if values['text'] is None:
-            values['text'] = u''
         self.rev_id, self.timestamp = values['id'], values['timestamp']
         self.contributor = contributor
         self.is_malformed = False
-        self.wiki_text, self.parsed_text, self.size = values['text'], None, len(values['text'].encode('UTF-8'))
+        self.text_elem = values.get('text_elem')
+        self._raw_text, self.parsed_text, self._size = values.get('raw_text'), None, values.get('size')
+        if values['text'] is not None:
+            self._raw_text = values['text'].encode('UTF-8')
+        if self.text_elem is not None:
+            self._size = text_elem_size(self.text_elem)
         self.md5, self.model, self.format = values['sha1'], values['model'], values['format']
+        self.parse_task = None
 
 
     def __repr__(self):
         return 'Revision({},"{}",{},"{}","{}","{}", "{}")'.format(self.rev_id, 
-            self.timestamp, self.contributor, self.wiki_text, 
+            self.timestamp, self.contributor, self.raw_text, 
             self.md5, self.model, self.format)
 
+    @property
+    def raw_text(self):
+        """Return wiki-text as UTF-8 bytes, the text element is read on first use."""
+        if self.text_elem is not None:
+            self._raw_text = read_text_elem(self.text_elem)
+            self.text_elem = None
+        if self._raw_text is None:
+            self._raw_text = ''
+        return self._raw_text
+
+    @property
+    def wiki_text(self):
+        """Return decoded wiki-text (decoded on every access, not kept)."""
+        return self.raw_text.decode('UTF-8')
+
+    @property
+    def size(self):
+        """Return size of the wiki-text in bytes."""
+        if self._size is None:
+            self._size = len(self.raw_text)
+        return self._size
+
     @property
     def model(self):
         return self._model
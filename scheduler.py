@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - scheduler module
+-----------------------------------------------------------
+
+Note:
+    Runs several dump files at once, every file in its own
+    process (with its own logfile and stats, see wikidump).
+    A file is started when its cores and memory fit into the
+    global budget, a file which is larger than the whole budget
+    is run alone. Files are started in the order they were found.
+
+    The input directory is watched for new files while files
+    are running, the scheduler ends when no file is running or
+    waiting.
+-----------------------------------------------------------
+"""
+from collections import deque
+from multiprocessing import Process
+import logging
+import time
+
+POLL_INTERVAL = 1.0
+
+
+class FileJob(object):
+    """A dump file with the resources its processing takes."""
+
+    def __init__(self, path, cores, memory):
+        self.path, self.cores, self.memory = path, cores, memory
+        self.process = None
+
+    def __repr__(self):
+        return 'FileJob("{}",{},{})'.format(self.path, self.cores, self.memory)
+
+
+class FileScheduler(object):
+    def __init__(self, target, cores, memory=0, max_files=0):
+        """Initializes a FileScheduler object
+
+        Args:
+            target: A function path -> None processing a file (run
+                    in a child process, a failure is reported by
+                    its exit code).
+            cores: Number of cores all running files may take.
+            memory: Memory in bytes all running files may take
+                    (0 for no limit).
+            max_files: Maximum number of running files (0 for no
+                    limit).
+        """
+        self.target = target
+        self.cores, self.memory = cores, memory
+        self.max_files = max_files
+        self.waiting = deque()
+        self.running = []
+        self.seen = set()
+
+    def add_files(self, paths, cost):
+        """Queue the new files of paths, cost(path) returns (cores, memory) of a file."""
+        for path in paths:
+            if path not in self.seen:
+                self.seen.add(path)
+                cores, memory = cost(path)
+                self.waiting.append(FileJob(path, cores, memory))
+                logging.info("queued {}".format(path))
+
+    def fits(self, job):
+        if not self.running:
+            return True
+        if self.max_files > 0 and len(self.running) >= self.max_files:
+            return False
+        if sum(j.cores for j in self.running) + job.cores > self.cores:
+            return False
+        if self.memory > 0 and sum(j.memory for j in self.running) + job.memory > self.memory:
+            return False
+        return True
+
+    def start_jobs(self):
+        """Start waiting files in order while they fit into the budget."""
+        while self.waiting and self.fits(self.waiting[0]):
+            job = self.waiting.popleft()
+            job.process = Process(target=self.target, args=(job.path,))
+            job.process.start()
+            self.running.append(job)
+            logging.info("started {} ({} running)".format(job.path, len(self.running)))
+
+    def finished_jobs(self):
+        """Remove and return the files whose process ended."""
+        finished = [job for job in self.running if not job.process.is_alive()]
+        for job in finished:
+            job.process.join()
+            self.running.remove(job)
+        return finished
+
+    def run(self, list_files, cost, on_done, poll_interval=POLL_INTERVAL):
+        """Process all files of list_files() and the files added meanwhile.
+
+        on_done(path, exitcode) is called in the scheduling process
+        after a file ended.
+        """
+        self.add_files(list_files(), cost)
+        while self.waiting or self.running:
+            self.start_jobs()
+            time.sleep(poll_interval)
+            for job in self.finished_jobs():
+                on_done(job.path, job.process.exitcode)
+            self.add_files(list_files(), cost)
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - sharding module
+-----------------------------------------------------------
+
+Note:
+    Splitting of a single dump file into byte ranges (shards)
+    which can be processed independently. Uncompressed xml
+    files are cut at <page> tags (taken from the page offset
+    table of a previous run if there is one), multistream bz2
+    files at stream headers which start with a <page>.
+
+    With a pre-scan table (see prescan module) the pages of xml
+    files are scheduled by their estimated cost instead: the
+    most expensive pages are spread over the shards first and
+    every shard reads a list of page ranges.
+
+    Every shard is read as a complete xml document: the dump
+    header (<mediawiki> and <siteinfo>) is put in front of its
+    pages and a closing </mediawiki> tag is appended.
+-----------------------------------------------------------
+"""
+from __future__ import division
+from collections import deque
+import bisect
+import bz2stream
+import compression
+import dumpreader
+import heapq
+import json
+import logging
+import os
+
+PAGE_TAG = "<page>"
+FOOTER = "</mediawiki>"
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+def plan_shards(path, count, page_costs=None):
+    """Return a list of Shard objects covering the dump file at path.
+
+    Fewer shards than requested are returned if the file can not
+    be cut (single-stream bz2 files, few pages). If page_costs
+    (a list of (offset, cost) of all pages, see prescan module) are
+    given, the pages of xml files are scheduled by their cost.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == ".xml" and page_costs and count > 1:
+        return schedule_shards(path, count, page_costs)
+    size = os.path.getsize(path)
+    targets = [size * k // count for k in range(1, count)]
+
+    if ext == ".xml":
+        offsets = dumpreader.load_page_offsets(path)
+        if offsets:
+            cuts = [offsets[i] for i in (bisect.bisect_left(offsets, target) for target in targets)
+                if i < len(offsets)]
+        else:
+            cuts = [find_page_offset(path, target) for target in targets]
+        header = read_xml_header(path)
+    elif ext == ".bz2":
+        cuts = find_bz2_cuts(path, targets)
+        header = read_bz2_header(path)
+    else:
+        cuts = []
+        header = ""
+
+    cuts = sorted(set(cut for cut in cuts if cut is not None and cut > 0))
+    if count > 1 and len(cuts) == 0:
+        logging.warning("{} can not be split into shards".format(path))
+
+    bounds = [0] + cuts + [None]
+    return [Shard(path, i, bounds[i], bounds[i+1], header if i > 0 else "")
+        for i in range(len(bounds) - 1)]
+
+def schedule_shards(path, count, page_costs):
+    """Return shards of an xml file with about the same total cost of their pages.
+
+    The most expensive pages are given first to the shard with the
+    lowest total cost, the pages of a shard are read in file order.
+    """
+    size = os.path.getsize(path)
+    page_costs = sorted(page_costs)
+    ends = [offset for offset, cost in page_costs[1:]] + [size]
+    order = sorted(xrange(len(page_costs)), key=lambda i: page_costs[i][1], reverse=True)
+
+    heap = [(0.0, index) for index in range(count)]
+    assigned = [[] for index in range(count)]
+    for i in order:
+        load, index = heapq.heappop(heap)
+        assigned[index].append(i)
+        heapq.heappush(heap, (load + page_costs[i][1], index))
+
+    header = read_xml_header(path)
+    shards = []
+    for index, pages in enumerate(assigned):
+        ranges = []
+        for i in sorted(pages):
+            start = page_costs[i][0]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = ends[i]
+            else:
+                ranges.append([start, ends[i]])
+        if ranges:
+            shards.append(Shard(path, len(shards), ranges[0][0], ranges[-1][1], header,
+                [tuple(r) for r in ranges]))
+    loads = sorted(heap, key=lambda item: item[1])
+    logging.info("estimated cost of the shards: {}".format(", ".join(
+        "{:.0f}s".format(load) for load, index in loads)))
+    return shards
+
+def find_page_offset(path, pos, chunk_size=SCAN_CHUNK_SIZE):
+    """Return the offset of the first <page> tag at or after pos (None if there is none)."""
+    with open(path, "rb") as f:
+        f.seek(pos)
+        tail = ""
+        base = pos
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return None
+            data = tail + chunk
+            found = data.find(PAGE_TAG)
+            if found != -1:
+                return base - len(tail) + found
+            base += len(chunk)
+            tail = data[-(len(PAGE_TAG) - 1):]
+
+def read_xml_header(path):
+    """Return everything in front of the first <page> tag of an xml dump."""
+    offset = find_page_offset(path, 0)
+    if offset is None:
+        return ""
+    with open(path, "rb") as f:
+        return f.read(offset)
+
+def read_bz2_header(path, chunk_size=SCAN_CHUNK_SIZE):
+    """Return the decompressed data in front of the first <page> tag of a bz2 dump."""
+    with bz2stream.BZ2RangeFile(path, 0, None) as f:
+        data = ""
+        while PAGE_TAG not in data:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return ""
+            data += chunk
+    return data[:data.find(PAGE_TAG)]
+
+def find_bz2_cuts(path, targets, max_attempts=16):
+    """Return stream offsets near targets at which a new page starts.
+
+    Only max_attempts streams are checked per target, files whose
+    streams do not end at page boundaries are not cut.
+    """
+    cuts = []
+    targets = list(targets)
+    attempts = 0
+    for offset in bz2stream.find_stream_offsets(path):
+        if not targets:
+            break
+        if offset < targets[0]:
+            continue
+        if bz2stream.peek_stream(path, offset).lstrip().startswith(PAGE_TAG):
+            cuts.append(offset)
+            attempts = 0
+            while targets and targets[0] <= offset:
+                targets.pop(0)
+        else:
+            attempts += 1
+            if attempts >= max_attempts:
+                attempts = 0
+                targets.pop(0)
+    return cuts
+
+def merge_stats(stats_list):
+    """Return the sum of the stats of all shards."""
+    merged = {}
+    for stats in stats_list:
+        for key, value in stats.iteritems():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+def write_stats(filename, stats):
+    """Save stats of a shard as json file."""
+    with open(filename, "w") as f:
+        json.dump(stats, f)
+
+def read_stats(filename):
+    """Load stats of a shard."""
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+class Shard(object):
+    def __init__(self, path, index, start, end, header, ranges=None):
+        """Initializes a Shard object
+
+        Args:
+            path: A path to the dump file.
+            index: Number of the shard.
+            start: Offset of the first byte of the shard.
+            end: Offset of the first byte not belonging
+                    to the shard (None for end of file).
+            header: Dump header which is put in front of the
+                    shard ("" for the first shard).
+            ranges: An optional list of (start, end) byte ranges
+                    of an xml file, only these get read.
+        """
+        self.path, self.index = path, index
+        self.start, self.end = start, end
+        self.header = header
+        self.ranges = ranges
+
+    def __repr__(self):
+        return 'Shard("{}",{},{},{})'.format(self.path, self.index, self.start, self.end)
+
+    def suffix(self):
+        """Return suffix for log- and stats-files of this shard."""
+        return ".shard{}".format(self.index)
+
+    def open(self):
+        """Return a file object reading the shard as complete xml document."""
+        ext = os.path.splitext(self.path)[1]
+        if self.ranges is not None:
+            raw = RangeListFile(self.path, self.ranges)
+        elif ext == ".bz2":
+            raw = bz2stream.BZ2RangeFile(self.path, self.start, self.end)
+        elif ext == ".xml":
+            raw = RangeFile(self.path, self.start, self.end)
+        else:
+            # files of other codecs are not cut, the shard is the whole file
+            raw = compression.open_dump(self.path)
+        return ShardFile(raw, self.header)
+
+
+class RangeFile(object):
+    """Read-only file object for a byte range of a file."""
+
+    def __init__(self, path, start, end):
+        self.file = dumpreader.MappedFile(path)
+        self.file.seek(start)
+        self.remaining = None if end is None else end - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        """Read at most size bytes of the range."""
+        if self.remaining is None:
+            return self.file.read(size)
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class RangeListFile(object):
+    """Read-only file object for a list of byte ranges of a file."""
+
+    def __init__(self, path, ranges):
+        self.file = dumpreader.MappedFile(path)
+        self.ranges = deque(ranges)
+        self.remaining = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        """Read at most size bytes of the ranges (all remaining if size < 0)."""
+        parts = []
+        length = 0
+        while size is None or size < 0 or length < size:
+            if self.remaining == 0:
+                if not self.ranges:
+                    break
+                start, end = self.ranges.popleft()
+                self.file.seek(start)
+                self.remaining = end - start
+            n = self.remaining if size is None or size < 0 else min(size - length, self.remaining)
+            data = self.file.read(n)
+            if not data:
+                self.remaining = 0
+                continue
+            self.remaining -= len(data)
+            parts.append(data)
+            length += len(data)
+        return "".join(parts)
+
+    def close(self):
+        self.file.close()
+
+
+class ShardFile(object):
+    """File object returning header, shard data (without </mediawiki>) and footer."""
+
+    def __init__(self, raw, header):
+        self.raw = raw
+        self.header = header
+        self.held = ""
+        self.footer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        """Read at most size bytes (all remaining if size < 0)."""
+        if size is None or size < 0:
+            parts = []
+            data = self.read(SCAN_CHUNK_SIZE)
+            while data:
+                parts.append(data)
+                data = self.read(SCAN_CHUNK_SIZE)
+            return "".join(parts)
+
+        if self.header:
+            data, self.header = self.header[:size], self.header[size:]
+            return data
+
+        if self.footer is None:
+            data = self.held
+            while True:
+                chunk = self.raw.read(size)
+                if not chunk:
+                    self.footer = FOOTER + "\n"
+                    self.held = ""
+                    data = data.replace(FOOTER, "")
+                    if data:
+                        return data
+                    break
+                data = (data + chunk).replace(FOOTER, "")
+                if len(data) >= len(FOOTER):
+                    # hold back the end, the closing tag may be split between two reads
+                    keep = len(FOOTER) - 1
+                    self.held = data[-keep:]
+                    return data[:-keep]
+
+        data, self.footer = self.footer[:size], self.footer[size:]
+        return data
+
+    def close(self):
+        self.raw.close()
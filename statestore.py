@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - statestore module
+-----------------------------------------------------------
+
+Note:
+    Per-page state of processed dumps in a sqlite database, so
+    that a newer dump only needs to process the revisions added
+    since. The state of a page is saved after the page is
+    processed: the id of its last revision (with its parsed
+    text, or its wiki-text if it was not parsed), the sha1 hashes
+    of its revisions (revert detection) and the entries of its
+    article. It is kept as zlib compressed json.
+
+    Every page is committed on its own (write-ahead log), several
+    processes can use the same store. Connections are opened per
+    process, a store can be forked.
+-----------------------------------------------------------
+"""
+import json
+import os
+import sqlite3
+import zlib
+
+BUSY_TIMEOUT = 60
+
+def encode_state(state):
+    """Return a page state (dictionary) as compressed blob."""
+    return buffer(zlib.compress(json.dumps(state), 6))
+
+def decode_state(blob):
+    """Return the page state of a compressed blob."""
+    return json.loads(zlib.decompress(str(blob)))
+
+
+class StateStore(object):
+    def __init__(self, path):
+        """Initializes a StateStore object
+
+        Args:
+            path: Path of the sqlite database (created if it does
+                    not exist).
+        """
+        self.path = path
+        self.conn = None
+        self.pid = None
+
+    def connect(self):
+        """Return the connection of this process."""
+        if self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pages "
+                "(page_id INTEGER PRIMARY KEY, rev_id INTEGER, state BLOB)")
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
+
+    def load(self, page_id):
+        """Return the saved state of a page (None if there is none)."""
+        row = self.connect().execute("SELECT state FROM pages WHERE page_id = ?",
+            (int(page_id),)).fetchone()
+        if row is None:
+            return None
+        return decode_state(row[0])
+
+    def save(self, page_id, state):
+        """Save the state of a page (its last revision id is state['rev_id'])."""
+        conn = self.connect()
+        conn.execute("INSERT OR REPLACE INTO pages (page_id, rev_id, state) VALUES (?, ?, ?)",
+            (int(page_id), state['rev_id'], encode_state(state)))
+        conn.commit()
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn, self.pid = None, None
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - checkpoint module tests
+-----------------------------------------------------------
+
+Note:
+    A dump file is processed in a child process which is killed
+    in the middle of the file and continued with --resume, the
+    stats have to be the same as of a run without interruption.
+
+    python -m unittest test_checkpoint
+-----------------------------------------------------------
+"""
+from multiprocessing import Process
+from wikidump import WikiDump
+import os
+import sharding
+import shutil
+import tempfile
+import unittest
+
+PAGES = 240
+CRASH_PAGE = "152"
+MAX_REVISIONS = 3
+
+PAGE = u"""  <page>
+    <title>{title}</title>
+    <ns>{ns}</ns>
+    <id>{id}</id>{redirect}
+{revisions}
+  </page>
+"""
+REVISION = u"""    <revision>
+      <id>{id}</id>
+      <timestamp>2014-01-{day:02d}T10:00:00Z</timestamp>
+      <contributor>
+        <username>User{user}</username>
+        <id>{user}</id>
+      </contributor>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve">{text}</text>
+      <sha1>{sha1}</sha1>
+    </revision>"""
+
+
+def write_dump(path):
+    """Write a dump with skipped pages (other namespaces, redirects) and truncated pages."""
+    rev_id = 0
+    with open(path, "w") as f:
+        f.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.8/" xml:lang="en">\n')
+        for page_id in range(1, PAGES + 1):
+            revisions = []
+            text = u""
+            for i in range(1 + page_id % 5):
+                rev_id += 1
+                text += u"Sentence {} of page {} was added. ".format(i, page_id)
+                revisions.append(REVISION.format(id=rev_id, day=1 + i, user=i % 3, text=text * 20,
+                    sha1="s{}".format(rev_id)))
+            f.write(PAGE.format(title="Page {}".format(page_id), id=page_id,
+                ns=1 if page_id % 4 == 1 else 0, redirect="\n    <redirect />" if page_id % 7 == 3 else "",
+                revisions="\n".join(revisions)).encode("utf-8"))
+        f.write("</mediawiki>\n")
+
+def run_dump(dump_path, outdir, resume, crash_page=None):
+    """Process the dump (killed at crash_page) and save its stats."""
+    WikiDump._CHECKPOINT_INTERVAL = 1e-6
+    WikiDump._MAX_REVISIONS = MAX_REVISIONS
+    WikiDump._RESUME = resume
+    if crash_page is not None:
+        save_article = WikiDump.save_article
+
+        def crash(self):
+            if self.article_id == crash_page:
+                self.pool.terminate()
+                os._exit(1)
+            save_article(self)
+        WikiDump.save_article = crash
+
+    wikidump = WikiDump(dump_path, outdir)
+    wikidump.process_dump()
+    sharding.write_stats(os.path.join(outdir, "stats.json"), wikidump.get_stats())
+
+def run_process(*args):
+    p = Process(target=run_dump, args=args)
+    p.start()
+    p.join()
+    return p.exitcode
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.dump_path = os.path.join(self.tmp, "dump.xml")
+        write_dump(self.dump_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_resume_counts_like_clean_run(self):
+        clean = os.path.join(self.tmp, "clean")
+        self.assertEqual(run_process(self.dump_path, clean, False), 0)
+
+        resumed = os.path.join(self.tmp, "resumed")
+        self.assertEqual(run_process(self.dump_path, resumed, False, CRASH_PAGE), 1)
+        self.assertTrue(os.path.exists(os.path.join(resumed, "dump.checkpoint")))
+        self.assertEqual(run_process(self.dump_path, resumed, True), 0)
+
+        stats = sharding.read_stats(os.path.join(clean, "stats.json"))
+        self.assertEqual(stats["total_pages"], PAGES)
+        self.assertEqual(sharding.read_stats(os.path.join(resumed, "stats.json")), stats)
+        self.assertFalse(os.path.exists(os.path.join(resumed, "dump.checkpoint")))
+
+
+if __name__ == '__main__':
+    unittest.main()
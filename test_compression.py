@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - compression module tests
+-----------------------------------------------------------
+
+Note:
+    Dump files made of several compressed streams (multistream
+    bz2, concatenated zstd frames) are read completely.
+
+    python -m unittest test_compression
+-----------------------------------------------------------
+"""
+import bz2
+import compression
+import os
+import shutil
+import tempfile
+import unittest
+
+PARTS = ["<page>{}</page>\n".format(i) * 20000 for i in range(3)]
+
+
+class MultipleStreamsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_parts(self, filename, compress):
+        path = os.path.join(self.tmp, filename)
+        with open(path, "wb") as f:
+            for part in PARTS:
+                f.write(compress(part))
+        return path
+
+    def test_bz2_streams(self):
+        path = self.write_parts("dump.bz2", bz2.compress)
+        xml_path = os.path.join(self.tmp, "dump.xml")
+        compression.transcode(path, xml_path)
+        with open(xml_path) as f:
+            self.assertEqual(f.read(), "".join(PARTS))
+
+    @unittest.skipIf(compression.zstandard is None, "zstandard missing")
+    def test_zstd_frames(self):
+        compressor = compression.zstandard.ZstdCompressor()
+        path = self.write_parts("dump.zst", compressor.compress)
+        with compression.open_dump(path) as f:
+            self.assertEqual(f.read(100) + f.read(), "".join(PARTS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - leases module tests
+-----------------------------------------------------------
+
+Note:
+    Several local processes sharing a temp directory work
+    through the units of a lease queue, like coordinators on
+    different hosts sharing dump_file_path.
+
+    python -m unittest test_leases
+-----------------------------------------------------------
+"""
+from multiprocessing import Process
+import leases
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+UNITS = ["d{}.xml".format(i) for i in range(12)]
+
+
+def run_coordinator(lease_dir, outdir, units):
+    """Claim, process and publish units until all are finished (like process_files_coordinated)."""
+    queue = leases.LeaseQueue(lease_dir, ttl=5)
+    while not all(queue.is_finished(unit) for unit in units):
+        for unit in units:
+            if not queue.claim(unit):
+                continue
+            with open(os.path.join(lease_dir, unit + ".claims"), "a") as f:
+                f.write(queue.owner + "\n")
+            staging = leases.staging_dir(outdir, unit, queue.owner)
+            os.makedirs(os.path.join(staging, unit))
+            with open(os.path.join(staging, unit, "article.xml"), "w") as f:
+                f.write(queue.owner)
+            time.sleep(0.01)
+            leases.publish(staging, outdir)
+            queue.finish(unit, {"owner": queue.owner})
+        time.sleep(0.01)
+
+
+class LeaseQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.lease_dir = os.path.join(self.tmp, ".leases")
+        self.outdir = os.path.join(self.tmp, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_processes_share_units(self):
+        processes = [Process(target=run_coordinator, args=(self.lease_dir, self.outdir, UNITS))
+            for i in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(60)
+            self.assertEqual(p.exitcode, 0)
+
+        queue = leases.LeaseQueue(self.lease_dir)
+        for unit in UNITS:
+            with open(os.path.join(self.lease_dir, unit + ".claims")) as f:
+                owners = f.read().split()
+            # every unit is processed by exactly one process
+            self.assertEqual(len(owners), 1)
+            self.assertEqual(queue.read_info(unit), {"owner": owners[0]})
+            with open(os.path.join(self.outdir, unit, "article.xml")) as f:
+                self.assertEqual(f.read(), owners[0])
+            self.assertFalse(os.path.exists(queue.path(unit, leases.LEASE_SUFFIX)))
+        self.assertEqual(os.listdir(os.path.join(self.outdir, leases.STAGING)), [])
+        # only markers and claim logs, no clock probes or stale leases
+        self.assertEqual(sorted(os.listdir(self.lease_dir)),
+            sorted(unit + suffix for unit in UNITS for suffix in (leases.DONE_SUFFIX, ".claims")))
+
+    def test_expired_lease_is_reclaimed(self):
+        dead = leases.LeaseQueue(self.lease_dir, owner="host:1", ttl=5)
+        alive = leases.LeaseQueue(self.lease_dir, owner="host:2", ttl=5)
+        self.assertTrue(dead.claim(UNITS[0]))
+        self.assertFalse(alive.claim(UNITS[0]))
+        # no heartbeat for longer than the ttl
+        past = alive.now() - 10
+        os.utime(dead.path(UNITS[0], leases.LEASE_SUFFIX), (past, past))
+        self.assertTrue(alive.claim(UNITS[0]))
+        self.assertFalse(dead.heartbeat(UNITS[0]))
+        self.assertTrue(alive.heartbeat(UNITS[0]))
+
+    def test_reclaim_keeps_new_lease(self):
+        dead = leases.LeaseQueue(self.lease_dir, owner="host:1", ttl=5)
+        late = leases.LeaseQueue(self.lease_dir, owner="host:2", ttl=5)
+        fast = leases.LeaseQueue(self.lease_dir, owner="host:3", ttl=5)
+        new = leases.LeaseQueue(self.lease_dir, owner="host:4", ttl=5)
+        self.assertTrue(dead.claim(UNITS[0]))
+        past = late.now() - 10
+        os.utime(dead.path(UNITS[0], leases.LEASE_SUFFIX), (past, past))
+
+        # the expired lease is reclaimed by another process and claimed
+        # anew while late is between reading the lease age and removing it
+        getmtime = os.path.getmtime
+        interleaved = []
+
+        def getmtime_interleaved(path):
+            mtime = getmtime(path)
+            if not interleaved and os.path.basename(path).startswith(UNITS[0]):
+                interleaved.append(path)
+                fast.reclaim(UNITS[0])
+                self.assertTrue(new.claim(UNITS[0]))
+            return mtime
+        os.path.getmtime = getmtime_interleaved
+        try:
+            claimed = late.claim(UNITS[0])
+        finally:
+            os.path.getmtime = getmtime
+
+        self.assertTrue(interleaved)
+        self.assertFalse(claimed)
+        self.assertTrue(new.owns(UNITS[0]))
+        self.assertTrue(new.heartbeat(UNITS[0]))
+
+    def test_reclaim_keeps_live_lease(self):
+        alive = leases.LeaseQueue(self.lease_dir, owner="host:1", ttl=5)
+        other = leases.LeaseQueue(self.lease_dir, owner="host:2", ttl=5)
+        self.assertTrue(alive.claim(UNITS[0]))
+        self.assertFalse(other.reclaim(UNITS[0]))
+        self.assertTrue(alive.heartbeat(UNITS[0]))
+        self.assertEqual(os.listdir(self.lease_dir), [UNITS[0] + leases.LEASE_SUFFIX])
+
+    def test_finished_unit_is_not_claimed(self):
+        queue = leases.LeaseQueue(self.lease_dir, owner="host:1")
+        self.assertTrue(queue.claim(UNITS[0]))
+        queue.finish(UNITS[0], failed=True)
+        self.assertTrue(queue.is_finished(UNITS[0]))
+        self.assertFalse(leases.LeaseQueue(self.lease_dir, owner="host:2").claim(UNITS[0]))
+
+    def test_publish_replaces_earlier_outputs(self):
+        for owner in ("host:1", "host:2"):
+            staging = leases.staging_dir(self.outdir, UNITS[0], owner)
+            os.makedirs(staging)
+            with open(os.path.join(staging, "a.xml"), "w") as f:
+                f.write(owner)
+            leases.publish(staging, self.outdir)
+            self.assertFalse(os.path.exists(staging))
+        with open(os.path.join(self.outdir, "a.xml")) as f:
+            self.assertEqual(f.read(), "host:2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,12 +28,19 @@ from collections import deque
 from collections import OrderedDict
 from datetime import timedelta
 from lxml import etree
-from random import randint
+from multiprocessing import TimeoutError
+from random import Random
 import codecs
 import datetime
 import difflib
+import hashlib
 import nltk
 import os
+import signal
+
+BATCH_OK = 0
+BATCH_ERROR = 1
+BATCH_TIMEOUT = 2
 
 differ = difflib.Differ()
 seq_matcher = difflib.SequenceMatcher()
@@ -186,6 +193,25 @@ class MyDeque(deque):
             self.popleft()
         super(MyDeque, self).append(item)
 
+class LRUCache(OrderedDict):
+    """Dictionary keeping the limit most recently used items."""
+    def __init__(self, limit):
+        self.limit = limit
+        super(LRUCache, self).__init__()
+
+    def lookup(self, key):
+        """Return the value of key (None if missing) and mark it as recently used."""
+        value = self.pop(key, None)
+        if value is not None:
+            self[key] = value
+        return value
+
+    def store(self, key, value):
+        self.pop(key, None)
+        self[key] = value
+        if len(self) > self.limit:
+            self.popitem(last=False)
+
 def check_tag(tag, tag_name, tag_text=None):
     """Check if tag corresponds to given arguments."""
     if tag_text is None and tag.tag != tag_name:
@@ -213,8 +239,51 @@ def isWritable(directory):
     except Exception:
         return False
 
+def call_with_timeout(func, args, timeout):
+    """Call func(*args), raise TimeoutError if it runs longer than timeout seconds.
+
+    The timeout is signalled by SIGALRM (ignored where it is missing),
+    so it only works in the main thread of a process.
+    """
+    if timeout is None or not hasattr(signal, "SIGALRM"):
+        return func(*args)
+
+    def on_alarm(signum, frame):
+        raise TimeoutError()
+
+    handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+
+def run_batch(func, args_list, timeout=None):
+    """Call func for every argument tuple, return a list of (status, result).
+
+    status is BATCH_OK (result is the return value), BATCH_TIMEOUT or
+    BATCH_ERROR (result is the error message).
+    """
+    results = []
+    for args in args_list:
+        try:
+            results.append((BATCH_OK, call_with_timeout(func, args, timeout)))
+        except TimeoutError:
+            results.append((BATCH_TIMEOUT, "timed out after {}s".format(timeout)))
+        except Exception, e:
+            results.append((BATCH_ERROR, "{}: {}".format(type(e).__name__, e)))
+    return results
+
 
 """Parser utils"""
+# random values of dummy templates (see seed_dummies)
+dummy_random = Random()
+
+def seed_dummies(text):
+    """Seed the random values of dummy templates with the sha1 of a text."""
+    dummy_random.seed(long(hashlib.sha1(text.encode("utf-8")).hexdigest(), 16))
+
 def dummy_temp_result(string):
     """Return dummy for temporal template."""
     date_templates = ("bda", "birth_date", "birth_date_and_age", "date", 
@@ -224,12 +293,12 @@ def dummy_temp_result(string):
         return random_date(datetime.date(1900, 01, 01), 
             datetime.date(2013, 01, 19)).strftime("%d %B %Y") + " "
     elif string == "age":
-        return str(randint(1, 250)) + " "
+        return str(dummy_random.randint(1, 250)) + " "
     elif string == "currentyear":
         return random_date(datetime.date(1900, 01, 01), 
             datetime.date(2013, 01, 19)).strftime("%Y") + " "
     elif string == "time_ago":
-        return str(randint(2, 500))+" years ago "
+        return str(dummy_random.randint(2, 500))+" years ago "
     elif string == "as_of":
         return "As of " + random_date(datetime.date(1900, 01, 01), 
             datetime.date(2013, 01, 19)).strftime("%B %Y") + " "
@@ -269,7 +338,7 @@ def format_conv_result(value, unitcode):
 def random_date(start, end):
     """Return a random date between start- and end-date."""
     return start + timedelta(
-        seconds=randint(0, int((end - start).total_seconds())))
+        seconds=dummy_random.randint(0, int((end - start).total_seconds())))
 
 def split_sentences(string):
     """Returned list of sentences."""
@@ -341,6 +410,10 @@ def get_additions(string1, string2):
     additions_only = filter_additions(delta)
     return additions_only
 
+def get_additions_batch(pairs, timeout=None):
+    """Return (status, additions) of a list of string pairs (see run_batch)."""
+    return run_batch(get_additions, pairs, timeout)
+
 
 """XML utils"""
 def create_xml_tree(article_id, title, authors=0, lines=0):
@@ -27,14 +27,41 @@ Use:
     'All pages with complete page edit history (.bz2)'
     http://dumps.wikimedia.org/enwiki/
 
+    Print the estimated processing time of the dump files
+    (they get pre-scanned once, see prescan module):
+    wikidump.py --estimate
+
+    Continue interrupted dump files after their last checkpoint
+    (see checkpoint_interval), files finished before (marked by
+    <dumpfile>.finished in outdir_path) are skipped:
+    wikidump.py --resume
+
+    Single pages of a multistream dump can be processed by
+    page id or title (the multistream index is needed):
+    wikidump.py --lookup DUMPFILE --page-id ID --title TITLE
+
 Note:
     You can add new dump files during the runtime of the script
     (there is a checking for newly added files after the
     processing of one file ends).
 
+    With concurrent_files > 1 several files are processed at
+    once, each in its own process with its own logfile and
+    stats file (see scheduler module). The scheduler logs to
+    scheduler.log in outdir_path. A running file writes to its
+    staging directory in outdir_path/.staging, its outputs are
+    moved into outdir_path and backed up when it is finished.
+
+    With coordinator on, several processes or hosts sharing
+    dump_file_path (and outdir_path) claim the dump files through
+    lease files (see leases module). Files of dead processes are
+    taken over after lease_ttl, the outputs of a file are moved
+    into outdir_path when it is finished.
+
 Config file ".\\config.cfg":
-    dump_file_path: path to the dumpfiles (every bz2-file in
-            this directory is getting processed)
+    dump_file_path: path to the dumpfiles (every xml, bz2, gz,
+            xz and zst file in this directory is getting
+            processed, see compression module)
     outdir_path: path where to store parsed articles
     backup_path: path where backup zip-files get stored
         (backups are made after each dump-file)
@@ -43,6 +70,80 @@ Config file ".\\config.cfg":
     revsize_threshold: minimum bytes added by a revision to
         consider it
     del_files: turn deleting of wikidump files on (1) and off (0)
+    decompress_processes: number of processes decompressing
+        multistream bz2 files (0 to decompress with one core)
+    shards: number of processes a single dump file is split
+        into (xml and multistream bz2 files only)
+    reader: xml reader, "streaming" (constant memory) or
+        "legacy" (start and end events of all elements)
+    fast_skip: drop skipped pages and revisions before xml
+        parsing (streaming reader only), on (1) or off (0)
+    prescan: schedule the pages of xml files by their estimated
+        cost when sharding (1) or cut by size (0)
+    parse_processes: number of processes parsing revisions
+    worker_pool: 1 to use the managed worker pool, which replaces
+        only a stuck worker on a timeout (see workerpool module)
+    spare_workers: number of warm workers the managed pool keeps
+        in reserve
+    pipeline_window: number of revisions parsed ahead while the
+        dump is read on (0 to parse in lockstep)
+    parallel_pages: parse and diff all revisions of a page in
+        parallel, entries are assembled at the end of the page
+        (1) or not (0)
+    batch_size: number of parses or diffs sent to the pool at
+        once (pipeline_window or parallel_pages only)
+    page_workers: number of processes processing whole pages
+        (streaming reader only, 0 to process the pages in the
+        reading process), see pagepipeline module
+    spool_size: size of the shared buffer passing revision
+        texts to the page workers in MB
+    concurrent_files: maximum number of dump files processed at
+        once (1 to process one file after the other)
+    core_budget: number of cores all concurrent files may take
+        (0 for all cores)
+    memory_budget: memory in MB all concurrent files may take
+        (0 for no limit)
+    file_memory: estimated memory in MB of a file (per shard),
+        the spool_size of page workers is added
+    coordinator: claim dump files through lease files shared with
+        other processes or hosts (1) or process all files (0)
+    lease_dir: directory of the lease files (default: .leases in
+        dump_file_path)
+    lease_ttl: seconds after which the lease of a process without
+        heartbeat expires
+    heartbeat: seconds between two heartbeats of a lease
+    checkpoint_interval: seconds between two checkpoints of a
+        dump file (0 for no checkpoints, see checkpoint module)
+    state_store: path of a database with the state of every
+        processed page, pages of newer dumps are continued
+        after their last processed revision (empty for none,
+        see statestore module)
+    memory_limit: memory budget in MB for the texts a process
+        holds (revisions in flight, article entries), 0 for no
+        limit (see budget module)
+    spill_dir: directory for texts which exceed memory_limit
+        (empty for the temp directory)
+    second_pass: engine of the second parse pass, regex (the
+        regex.second_pass alternation) or lexer (see wikilexer
+        module, same output)
+    incremental_parse: 1 to parse revisions section by section,
+        the sections of a revision which are unchanged since an
+        earlier revision are not parsed again (see parse module,
+        same output)
+    parse_cache: number of parse results kept in memory by their
+        revision sha1 (reverted revisions are not parsed again),
+        0 for no cache (see parsecache module)
+    parse_cache_path: path of a database keeping the parse
+        results of all processes and runs (empty for none), only
+        results of the same parser version and settings are used
+    deterministic_dummies: 1 to seed the random dates and
+        numbers of dummy templates by the template text, a
+        cached parse result is the same as a new parse
+
+    The optional section [Filter] selects the processed pages
+    and revisions by their metadata (see filters module):
+    namespaces, start_time, end_time, allow_contributors,
+    deny_contributors, skip_minor
 -----------------------------------------------------------
 """
 from article import article
@@ -50,23 +151,50 @@ from collections import deque
 from entry import entry
 from lxml import etree
 from multiprocessing import Pool
+from multiprocessing import Process
 from multiprocessing import TimeoutError
+from multiprocessing import cpu_count
 from revision import Contributor
 from revision import Revision
-import bz2
+import argparse
+import budget
+import bz2stream
+import checkpoint
 import codecs
+import compression
 import ConfigParser
 import datetime
+import dumpreader
+import errno
+import filters
 import glob
+import leases
 import logging
+import multistream
 import os
+import pagepipeline
 import parse
+import parsecache
+import pipeline
+import prescan
 import regex
+import scheduler
+import sharding
+import shutil
+import statestore
 import sys
 import time
 import utils
+import workerpool
 import zipfile
 
+REVISION_TAGS = ("id", "parentid", "timestamp", "comment", "sha1", "model",
+    "format")
+
+STAT_COUNTERS = ("usable_pages", "total_pages", "usable_revisions",
+    "total_revisions", "actual_revisions", "skipped_revisions", "worker_restarts",
+    "known_revisions", "cached_parses")
+
 class WikiDump(object):
     """WikiDump class - parses a wikidump.bz2 file"""
     # _NS = '{http://www.mediawiki.org/xml/export-0.8/}'
@@ -74,8 +202,37 @@ class WikiDump(object):
     _DEL_FILES = False
     _MAX_REVISIONS = 3000
     _REVSIZE_THRESHOLD = 1000
-
-    def __init__(self, dump_filepath, outputdir, logfiledir=None):
+    _DECOMPRESS_PROCESSES = 0
+    _SHARDS = 1
+    _READER = 'streaming'
+    _FAST_SKIP = True
+    _FILTER = filters.RevisionFilter()
+    _PRESCAN = False
+    _PARSE_PROCESSES = 2
+    _WORKER_POOL = False
+    _SPARE_WORKERS = 1
+    _PIPELINE_WINDOW = 0
+    _PARALLEL_PAGES = False
+    _BATCH_SIZE = 1
+    _PAGE_WORKERS = 0
+    _SPOOL_SIZE = 256 * 1024 * 1024
+    _CONCURRENT_FILES = 1
+    _CORE_BUDGET = 0
+    _MEMORY_BUDGET = 0
+    _FILE_MEMORY = 1024 * 1024 * 1024
+    _COORDINATOR = False
+    _LEASE_DIR = None
+    _LEASE_TTL = 300
+    _HEARTBEAT = 30
+    _CHECKPOINT_INTERVAL = 0
+    _RESUME = False
+    _STATE_STORE = None
+    _MEMORY_LIMIT = 0
+    _SPILL_DIR = None
+    _PARSE_CACHE = 0
+    _PARSE_CACHE_PATH = None
+
+    def __init__(self, dump_filepath, outputdir, logfiledir=None, part=None):
         """Initializes a WikiDump object
 
         Args:
@@ -86,27 +243,47 @@ class WikiDump(object):
                     if it is not set, the logfile will 
                     get saved in the same directory 
                     as the outputdir.
+            part: An optional part of the dump file (a
+                    sharding.Shard or multistream.PageSelection),
+                    only this part gets processed.
         """
         self.dump_filepath, self.outputdir = dump_filepath, outputdir
+        self.part = part
         if logfiledir is None:
             self.logfiledir = outputdir
         self.dump_file, self.dump_filename, self.logfile = None, None, None
         self.check_files()
-        self.pool = Pool(processes=2)
+        self.pool = self.create_pool()
+        self.budget = budget.MemoryBudget(self._MEMORY_LIMIT, self._SPILL_DIR)
+        self.current_article = None
+        self.pipeline = None
+        if self._PARALLEL_PAGES:
+            self.pipeline = pipeline.RevisionPipeline(self, None, self._BATCH_SIZE, self.budget)
+        elif self._PIPELINE_WINDOW > 0:
+            self.pipeline = pipeline.RevisionPipeline(self, self._PIPELINE_WINDOW, self._BATCH_SIZE, self.budget)
+        self.state_store = statestore.StateStore(self._STATE_STORE) if self._STATE_STORE else None
+        self.parse_cache = None
+        if self._PARSE_CACHE > 0 or self._PARSE_CACHE_PATH:
+            self.parse_cache = parsecache.ParseCache(self._PARSE_CACHE, self._PARSE_CACHE_PATH,
+                parse.parser_config())
         self.templates = {}
 
-        init_logging(self.logfile)
+        init_logging(self.logfile, 'a' if self._RESUME else 'w')
         logging.info('Parser up and running.')
+        if self.parse_cache is not None and not parse.deterministic_dummies:
+            logging.warning("parse cache without deterministic_dummies, cached results differ from new parses")
 
     def check_files(self):
         """Checks if dump_file, outputdir & logfile are valid"""
         try:
             tail = os.path.split(self.dump_filepath)[1]
             ext = os.path.splitext(tail)[1]
-            if ext == '.bz2':
-                self.dump_file = bz2.BZ2File(self.dump_filepath, "r", 2048)
-            elif ext == '.xml':
-                self.dump_file = file(self.dump_filepath, "r", 1024)
+            if self.part is not None:
+                self.dump_file = self.part.open()
+            elif ext == '.bz2' and self._DECOMPRESS_PROCESSES > 0:
+                self.dump_file = bz2stream.open_dump(self.dump_filepath, self._DECOMPRESS_PROCESSES)
+            else:
+                self.dump_file = compression.open_dump(self.dump_filepath)
         except IOError, e:
             logging.error('Could not open dump file: {}'.format(e))
             sys.exit(1)
@@ -131,8 +308,10 @@ class WikiDump(object):
             else:
                 tail = os.path.split(self.dump_filepath)[1]
                 self.dump_filename = os.path.splitext(tail)[0]
+                if self.part is not None:
+                    self.dump_filename += self.part.suffix()
                 self.logfile = os.path.join(self.logfiledir, self.dump_filename+'.log')
-                open(self.logfile,"w").close()
+                open(self.logfile,"a" if self._RESUME else "w").close()
 
         except (OSError, IOError), e:
             logging.error('Logfile "{}" not created: {}'.format(self.logfile, e))
@@ -147,105 +326,386 @@ class WikiDump(object):
         self.total_revisions = 0
         self.actual_revisions = 0
         self.skipped_revisions = 0
-        stop = False
+        self.worker_restarts = 0
+        self.known_revisions = 0
+        self.cached_parses = 0
+
+        self.checkpointer, self.resume_after = None, None
+        if self._READER == 'streaming' and self._PAGE_WORKERS == 0:
+            self.init_checkpoints()
+        elif self._RESUME or self._CHECKPOINT_INTERVAL > 0:
+            logging.warning("checkpoints need the streaming reader without page workers")
 
         with self.dump_file as f:
-            ns_not_set = True
-            iter_tree = etree.iterparse(f, events=("start", "end"))
-            for event, elem in iter_tree:
-                if ns_not_set:
-                    WikiDump._NS = "{"+etree.QName(elem).namespace+"}"
-                    ns_not_set = False
-
-                # if self.usable_pages > 0:
-                #     break
-
-                if stop:
-                    break
-
-                if event == "start" and elem.tag == self._NS + "page":
-                    current_page = elem
-                    self.total_pages += 1
-                    page_id = None
-                    page_meta_processed = False
-                    skip_page = False
-
-                    self.rev_old = None
-                    self.rev_new = None
-                    self.revision_count = 0
-                    self.md5hash_list = utils.MyList()
-                    self.current_article = None
-
-                    for event, elem in iter_tree:
-                        if page_meta_processed == False:
-                            if event == "start" and elem.tag == self._NS + "title":
-                                self.article_title = elem.text
-                            elif event == "start" and elem.tag == self._NS + "id":
-                                self.article_id = elem.text
-
-                            if event == "start" and elem.tag == self._NS + "revision":
-                                page_meta_processed = True
-                                if skip_page:
-                                    logging.info("skip page {}".format(page_id))
-                                else:
-                                    logging.info("processing page {}".format(page_id))
-                                    self.usable_pages += 1
-                                    self.current_article = article(self.article_id, self.article_title)
-
-                            elif event == "end" and elem.tag == self._NS + "ns" and elem.text != "0":
-                                skip_page = True
-                            elif event == "end" and elem.tag == self._NS + "id":
-                                page_id = elem.text
-                            elif event == "end" and elem.tag == self._NS + "redirect":
-                                skip_page = True
+            if self._READER == 'legacy':
+                self.read_legacy(f)
+            elif self._PAGE_WORKERS > 0:
+                self.read_pages(f)
+            else:
+                self.read_streaming(f)
+
+        self.pool.close()
+        self.pool.join()
+        if isinstance(self.pool, workerpool.WorkerPool):
+            self.worker_restarts += self.pool.restarts
+        if self.checkpointer is not None:
+            self.checkpointer.finish()
+        if self.state_store is not None:
+            self.state_store.close()
+        if self.parse_cache is not None:
+            self.parse_cache.close()
+        if self.budget.limit > 0:
+            logging.info("memory budget: peak {:,} bytes, {} spill files".format(self.budget.peak, self.budget.spills))
+        log_stats(self.get_stats())
+
+    def init_checkpoints(self):
+        """Set up checkpoints, with --resume restore the counters of the last one."""
+        path = os.path.join(self.logfiledir, self.dump_filename+'.checkpoint')
+        identity = checkpoint.dump_identity(self.dump_filepath, self.part)
+        if self._RESUME:
+            state = checkpoint.read_checkpoint(path, identity)
+            if state is not None:
+                for name, value in state['counters'].iteritems():
+                    setattr(self, name, value)
+                self.resume_after = state['page_id']
+                logging.info("resuming after page {}".format(self.resume_after))
+        self.checkpointer = checkpoint.Checkpointer(path, identity, self._CHECKPOINT_INTERVAL)
+
+    def checkpoint_counters(self, page_filter, page_id):
+        """Return the counters for a checkpoint after page_id (including those of the PageFilter up to page_id)."""
+        counters = self.get_stats()
+        if page_filter is not None:
+            filter_counters = page_filter.counters_at(page_id)
+            counters['total_pages'] += filter_counters['skipped_pages']
+            counters['total_revisions'] += filter_counters['total_revisions']
+            counters['skipped_revisions'] += filter_counters['skipped_revisions']
+        return counters
+
+    def read_streaming(self, f):
+        """Read dump with the constant memory dumpreader."""
+        reader, page_filter = self.open_reader(f, self.resume_after)
+        # without PageFilter the pages before the checkpoint are skipped here
+        resume_after = self.resume_after if page_filter is None else None
+        current_meta = None
+        skip_page = False
+
+        for kind, meta, elem in reader:
+            if resume_after is not None:
+                if kind == dumpreader.PAGE_END and meta.page_id == resume_after:
+                    resume_after = None
+            elif kind == dumpreader.REVISION:
+                if meta is not current_meta:
+                    current_meta = meta
+                    self.reset_page()
+                    self.article_id, self.article_title = meta.page_id, meta.title
+                    skip_page = meta.redirect or not self._FILTER.accept_page(meta.ns)
+                    self.begin_page(meta.page_id, skip_page)
+
+                skip_page = self.next_revision(meta.page_id, skip_page)
+                skip_page = self.handle_rev(elem, skip_page)
+            else:
+                self.total_pages += 1
+                if meta is current_meta:
+                    self.save_article()
+                current_meta = None
+                if self.checkpointer is not None:
+                    self.checkpointer.page_done(meta.page_id, self.checkpoint_counters(page_filter, meta.page_id))
+
+        self.add_filter_counts(page_filter)
+
+    def read_pages(self, f):
+        """Read dump with the dumpreader and process its pages in worker processes."""
+        reader, page_filter = self.open_reader(f)
+        pages = pagepipeline.PagePipeline(self, self._PAGE_WORKERS, self._SPOOL_SIZE)
+        current_meta = None
+        skip_page = False
+
+        for kind, meta, elem in reader:
+            if kind == dumpreader.REVISION:
+                if meta is not current_meta:
+                    current_meta = meta
+                    self.reset_page()
+                    skip_page = meta.redirect or not self._FILTER.accept_page(meta.ns)
+                    if skip_page:
+                        logging.info("skip page {}".format(meta.page_id))
+                    else:
+                        pages.begin_page(meta.page_id, meta.title)
+
+                skip_page = self.next_revision(meta.page_id, skip_page)
+                if not skip_page:
+                    rev_values = self.get_rev(elem)
+                    if self._FILTER.check(rev_values) == filters.STOP:
+                        logging.info("end of time window reached. page-id {}".format(meta.page_id))
+                        skip_page = True
+                    else:
+                        pages.add_revision(rev_values)
+            else:
+                self.total_pages += 1
+                if meta is current_meta and pages.page is not None:
+                    pages.end_page()
+                current_meta = None
+
+        counters, failed = pages.finish()
+        for name, value in counters.iteritems():
+            setattr(self, name, getattr(self, name) + value)
+        if failed:
+            logging.error("{} pages failed: {}".format(len(failed), ", ".join(str(page_id) for page_id in failed)))
+        self.add_filter_counts(page_filter)
+
+    def open_reader(self, f, resume_after=None):
+        """Return the dumpreader of f and its PageFilter (None if fast_skip is off)."""
+        page_filter = None
+        if self._FAST_SKIP:
+            f = page_filter = dumpreader.PageFilter(f, self._MAX_REVISIONS,
+                record_offsets=isinstance(f, dumpreader.MappedFile), rev_filter=self._FILTER,
+                resume_after=resume_after, record_counters=self.checkpointer is not None)
+        reader = dumpreader.DumpReader(f)
+        self.set_namespace(reader.ns)
+        return reader, page_filter
+
+    def add_filter_counts(self, page_filter):
+        """Add the counters of a PageFilter and save the page offsets it recorded."""
+        if page_filter is not None:
+            self.total_pages += page_filter.skipped_pages
+            self.total_revisions += page_filter.total_revisions
+            self.skipped_revisions += page_filter.skipped_revisions
+            if page_filter.page_offsets is not None:
+                dumpreader.save_page_offsets(self.dump_filepath, page_filter.page_offsets)
+
+    def read_legacy(self, f):
+        """Read dump with start and end events of every element."""
+        stop = False
+        ns_not_set = True
+        iter_tree = etree.iterparse(f, events=("start", "end"))
+        for event, elem in iter_tree:
+            if ns_not_set:
+                self.set_namespace("{"+etree.QName(elem).namespace+"}")
+                ns_not_set = False
+
+            # if self.usable_pages > 0:
+            #     break
+
+            if stop:
+                break
+
+            if event == "start" and elem.tag == self._NS + "page":
+                current_page = elem
+                self.total_pages += 1
+                page_id = None
+                page_meta_processed = False
+                skip_page = False
+                self.reset_page()
+
+                for event, elem in iter_tree:
+                    if page_meta_processed == False:
+                        if event == "start" and elem.tag == self._NS + "title":
+                            self.article_title = elem.text
+                        elif event == "start" and elem.tag == self._NS + "id":
+                            self.article_id = elem.text
 
                         if event == "start" and elem.tag == self._NS + "revision":
-                            if self._MAX_REVISIONS != -1 and self.revision_count >= self._MAX_REVISIONS:
-                                if not skip_page:
-                                    logging.info("maximum revisions ({}) reached. page-id {}".format(self._MAX_REVISIONS, page_id))
-                                    skip_page = True
-                                self.skipped_revisions += 1
-                            self.process_rev(elem, iter_tree, skip_page)
-
-                        elif event == "end" and elem.tag == self._NS + "page":
-                            # print "PAGE ENDET"
-                            if self.current_article and self.current_article.authors > 0:
-                                xml_tree = utils.create_xml_tree(self.current_article.article_id, self.current_article.article_title, self.current_article.authors, self.current_article.lines)
-
-
-                                for e in self.current_article.entries:
-                                    attr = {"author_id":e.author_id,
-                                            "start":str(e.start),
-                                            "end":str(e.end)}
-                                    text = e.text
-                                    utils.add_entry(xml_tree.getroot(), attr, text)
-                                
-                                pathname = os.path.join(self.outputdir, self.current_article.article_id)
-                                if not os.path.exists(pathname):
-                                    # print "didnt exist - create"
-                                    os.makedirs(pathname)
-                                filename = os.path.join(pathname, self.current_article.article_id+'_'+self.current_article.article_title+'.xml')
-
-                                with codecs.open(filename, 'w') as newFile:
-                                    newFile.write(etree.tostring(xml_tree, encoding='UTF-8', pretty_print=True, xml_declaration=True))
-                                
-                                self.current_article = None
-                            current_page.clear()
-                            break
+                            page_meta_processed = True
+                            self.begin_page(page_id, skip_page)
+
+                        elif event == "end" and elem.tag == self._NS + "ns" and not self._FILTER.accept_page(elem.text):
+                            skip_page = True
+                        elif event == "end" and elem.tag == self._NS + "id":
+                            page_id = elem.text
+                        elif event == "end" and elem.tag == self._NS + "redirect":
+                            skip_page = True
+
+                    if event == "start" and elem.tag == self._NS + "revision":
+                        skip_page = self.next_revision(page_id, skip_page)
+                        skip_page = self.process_rev(elem, iter_tree, skip_page)
+
+                    elif event == "end" and elem.tag == self._NS + "page":
+                        # print "PAGE ENDET"
+                        self.save_article()
+                        current_page.clear()
+                        break
+
+    def set_namespace(self, ns):
+        """Set xml namespace of the dump and precompute qualified tag names."""
+        WikiDump._NS = ns
+        self.rev_tags = dict((ns + tag, tag) for tag in REVISION_TAGS)
+        self.contributor_tags = {ns + "id": "contr_id", ns + "username": "username", ns + "ip": "ip"}
+        self.tag_contributor = ns + "contributor"
+        self.tag_minor = ns + "minor"
+        self.tag_text = ns + "text"
+
+    def reset_page(self):
+        """Reset page state at the beginning of a new page."""
+        self.rev_old = None
+        self.rev_new = None
+        self.revision_count = 0
+        self.md5hash_list = utils.MyList()
+        if self.current_article is not None:
+            self.current_article.close()
+        self.current_article = None
+        self.page_state = None
+
+    def begin_page(self, page_id, skip_page):
+        """Start processing page (called at its first revision)."""
+        if skip_page:
+            logging.info("skip page {}".format(page_id))
+        else:
+            logging.info("processing page {}".format(page_id))
+            self.usable_pages += 1
+            self.current_article = article(self.article_id, self.article_title, self.budget)
+            if self.state_store is not None:
+                self.load_page_state(page_id)
+
+    def load_page_state(self, page_id):
+        """Restore entries and revert hashes of a page processed in an earlier run."""
+        state = self.state_store.load(page_id)
+        if state is None:
+            return
+        logging.info("continuing page {} after revision {}".format(page_id, state['rev_id']))
+        for author_id, start, end, text in state['entries']:
+            self.current_article.append(entry(author_id, text.split('\n'), start, end))
+        self.md5hash_list.extend(state['hashes'])
+        self.page_state = state
+
+    def restore_revision(self, state):
+        """Return the last revision of a page state (parsed text included)."""
+        values = state['revision']
+        raw_text = values['raw_text']
+        rev_values = {
+            "id": values['id'],
+            "timestamp": values['timestamp'],
+            "text": None,
+            "raw_text": None if raw_text is None else raw_text.encode('UTF-8'),
+            "size": values['size'],
+            "sha1": values['sha1'],
+            "model": values['model'],
+            "format": values['format']
+        }
+        contributor = None
+        if any(values['contributor']):
+            contributor = Contributor(*values['contributor'])
+        rev = Revision(rev_values, contributor)
+        rev.parsed_text, rev.is_malformed = values['parsed_text'], values['is_malformed']
+        return rev
+
+    def save_page_state(self):
+        """Save the state of the current page, return False if it had no new revisions."""
+        if self.state_store is None or self.current_article is None or self.rev_new is None:
+            return True
+        if self.page_state is not None:
+            # all revisions were processed in an earlier run
+            return False
+        rev = self.rev_new
+        contributor = rev.contributor
+        self.state_store.save(self.article_id, {
+            "rev_id": int(rev.rev_id),
+            "revision": {
+                "id": rev.rev_id,
+                "timestamp": rev.timestamp,
+                "contributor": [None, None, None] if contributor is None else
+                    [contributor.con_id, contributor.name, contributor.ip],
+                "size": rev.size,
+                "sha1": rev.md5,
+                "model": rev.model,
+                "format": rev.format,
+                "parsed_text": rev.parsed_text,
+                "is_malformed": rev.is_malformed,
+                # the wiki-text is only kept if it was not parsed
+                "raw_text": rev.wiki_text if rev.parsed_text is None else None
+            },
+            "hashes": list(self.md5hash_list),
+            "entries": [(e.author_id, e.start, e.end, e.text) for e in self.current_article.all_entries()]
+        })
+        return True
 
-        self.pool.close()
+    def next_revision(self, page_id, skip_page):
+        """Count a new revision of the current page and return if it gets skipped."""
+        if self._MAX_REVISIONS != -1 and self.revision_count >= self._MAX_REVISIONS:
+            if not skip_page:
+                logging.info("maximum revisions ({}) reached. page-id {}".format(self._MAX_REVISIONS, page_id))
+                skip_page = True
+            self.skipped_revisions += 1
+        self.revision_count += 1
+        self.total_revisions += 1
+        return skip_page
+
+    def save_article(self):
+        """Write current article as xml file (if it has entries)."""
+        if self.pipeline is not None:
+            self.pipeline.flush()
+        if not self.save_page_state():
+            # unchanged since the article was written in an earlier run
+            self.current_article.close()
+            self.current_article = None
+        if self.current_article and self.current_article.authors > 0:
+            self.write_article(self.current_article)
+            self.current_article.close()
+            self.current_article = None
+
+    def write_article(self, current_article):
+        """Write an article as xml file."""
+        xml_tree = utils.create_xml_tree(current_article.article_id, current_article.article_title, current_article.authors, current_article.lines)
+
+
+        for e in current_article.all_entries():
+            attr = {"author_id":e.author_id,
+                    "start":str(e.start),
+                    "end":str(e.end)}
+            text = e.text
+            utils.add_entry(xml_tree.getroot(), attr, text)
+        
+        pathname = os.path.join(self.outputdir, current_article.article_id)
+        if not os.path.exists(pathname):
+            # print "didnt exist - create"
+            os.makedirs(pathname)
+        filename = os.path.join(pathname, current_article.article_id+'_'+current_article.article_title+'.xml')
+
+        with codecs.open(filename, 'w') as newFile:
+            newFile.write(etree.tostring(xml_tree, encoding='UTF-8', pretty_print=True, xml_declaration=True))
+
+    def create_pool(self):
+        """Return a new pool for parsing and diffing."""
+        if self._WORKER_POOL:
+            return workerpool.WorkerPool(self._PARSE_PROCESSES, self._SPARE_WORKERS, pipeline.DIFF_TIMEOUT)
+        return Pool(processes=self._PARSE_PROCESSES)
+
+    def restart_pool(self):
+        """Terminate the pool (e.g. after a timeout) and start a new one."""
+        if isinstance(self.pool, workerpool.WorkerPool):
+            # the stuck worker is already replaced
+            return
+        self.worker_restarts += 1
+        self.pool.terminate()
         self.pool.join()
-        logging.info("-----------------------------------------")
-        logging.info("revision delta size threshold: {}".format(self._REVSIZE_THRESHOLD))
-        logging.info("maximum revision per page: {}".format(self._MAX_REVISIONS))
-        logging.info("#########################################")
-        logging.info("usable pages: {:,} total pages: {:,}".format(self.usable_pages, self.total_pages))
-        logging.info("usable revisions: {:,};  total revisions (of usable pages): {:,} ({:,} of those skipped)".format(self.usable_revisions, self.total_revisions, self.skipped_revisions))
-        logging.info("actual revisions saved: {:,}".format(self.actual_revisions))
-        logging.info("-----------------------------------------")
+        self.pool = self.create_pool()
+
+    def cached_parse(self, func, rev):
+        """Return a CachedResult of the parse of a revision if its sha1 is cached (else None)."""
+        if self.parse_cache is None:
+            return None
+        result = self.parse_cache.get(rev.md5, func is parse.parse_wiki_text_cropped)
+        if result is None:
+            return None
+        self.cached_parses += 1
+        return parsecache.CachedResult(result)
+
+    def parse_async(self, func, rev):
+        """Submit the parse of a revision to the pool (unless its result is cached)."""
+        cached = self.cached_parse(func, rev)
+        if cached is not None:
+            return cached
+        return self.pool.apply_async(func, (rev.wiki_text,))
+
+    def cache_parse(self, func, rev, result):
+        """Add the result of a parse of a revision to the parse cache."""
+        if self.parse_cache is not None:
+            self.parse_cache.put(rev.md5, func is parse.parse_wiki_text_cropped, result)
+
+    def get_stats(self):
+        """Return the counters of the processed dump as dictionary."""
+        return dict((name, getattr(self, name)) for name in STAT_COUNTERS)
 
     def get_rev(self, elem):
-        """Get and return revision data."""
+        """Get and return revision data (the text element unread)."""
         rev_values = {
             "id": None,
             "timestamp": None,
@@ -255,145 +715,185 @@ class WikiDump(object):
             "comment": None,
             "minor": False,
             "text": None,
+            "text_elem": None,
             "sha1": None,
             "model": None,
             "format": None
         }
 
-        for rev_elem in elem.iter():
-            tag = etree.QName(rev_elem).localname
-            if tag == "id":
-                if etree.QName(rev_elem.getparent()).localname == "revision":
-                    rev_values["id"] = rev_elem.text
-                elif etree.QName(rev_elem.getparent()).localname == "contributor":
-                    rev_values["contr_id"]= rev_elem.text
-            elif tag == "minor":
+        for rev_elem in elem:
+            tag = rev_elem.tag
+            if tag == self.tag_contributor:
+                for contr_elem in rev_elem:
+                    key = self.contributor_tags.get(contr_elem.tag)
+                    if key is not None:
+                        rev_values[key] = contr_elem.text
+            elif tag == self.tag_minor:
                 rev_values["minor"] = True
+            elif tag == self.tag_text:
+                rev_values["text_elem"] = rev_elem
             else:
-                rev_values[tag] = rev_elem.text
+                key = self.rev_tags.get(tag)
+                if key is not None:
+                    rev_values[key] = rev_elem.text
 
         return rev_values
 
-
-
     def process_rev(self, elem, context, skip_page):
-        """Process revision (parse/diff/save text)."""
+        """Read revision until its end tag, process it and return skip_page."""
         current_rev = elem
-        self.revision_count += 1
-        self.total_revisions += 1
 
         for event, elem in context:
             if event == "end" and etree.QName(elem).localname == "revision":
-                if skip_page is False:
-                    rev_values = self.get_rev(elem)
-                    # logging.info("------process revision {}".format(rev_values['id']))
-                    valid_revision = True
-                    contributor = None
+                skip_page = self.handle_rev(elem, skip_page)
+                current_rev.clear()
+                break
+        return skip_page
+
+    def handle_rev(self, elem, skip_page):
+        """Process revision (parse/diff/save text), return if the rest of the page gets skipped."""
+        if skip_page is False:
+            skip_page = self.handle_values(self.get_rev(elem))
+        return skip_page
+
+    def handle_values(self, rev_values):
+        """Process revision data (see get_rev), return if the rest of the page gets skipped."""
+        # logging.info("------process revision {}".format(rev_values['id']))
+        if self.page_state is not None:
+            if int(rev_values['id']) <= self.page_state['rev_id']:
+                # processed in an earlier run
+                self.known_revisions += 1
+                return False
+            self.rev_new = self.restore_revision(self.page_state)
+            self.page_state = None
+
+        verdict = self._FILTER.check(rev_values)
+        if verdict == filters.STOP:
+            logging.info("end of time window reached. page-id {}".format(self.article_id))
+            return True
+        valid_revision = verdict == filters.ACCEPT
+        contributor = None
 
+        try:
+            contributor = Contributor(rev_values['contr_id'], rev_values['username'], 
+            rev_values['ip'])
+        except ValueError:
+            valid_revision = False
+
+        self.md5hash_list.append(rev_values['sha1'])
+        distance = self.md5hash_list.distance_to_ident_value()
+        comment_match = None
+        
+        if rev_values['comment'] is not None:
+            comment_match = regex.revert_comment.match(rev_values['comment'].lower())
+        
+        if rev_values['contr_id'] is None or distance != -1 or comment_match:
+            valid_revision = False
+            
+        if self.rev_new is None:
+            # first revision of the article: parse wiki-text and save entry
+            self.rev_new = Revision(rev_values, contributor)
+
+            if valid_revision and self.pipeline is not None:
+                self.pipeline.add(None, self.rev_new)
+            elif valid_revision:
+                self.usable_revisions += 1
+                result = self.parse_async(parse.parse_wiki_text_cropped, self.rev_new)
+                try:
+                    parsed = result.get(timeout=10)
+                    self.cache_parse(parse.parse_wiki_text_cropped, self.rev_new, parsed)
+                    self.rev_new.parsed_text, cropped_text, self.rev_new.is_malformed = parsed
+                except TimeoutError:
+                    logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
+                    self.rev_new.parsed_text = ""
+                    cropped_text = ""
+                    self.rev_new.is_malformed = True
+
+                    self.restart_pool()
+
+                if not self.rev_new.is_malformed:
+                    if len(cropped_text) >= 12:
+
+                        new_entry = entry(self.rev_new.contributor.con_id, cropped_text, self.current_article.current_pos())
+                        self.current_article.append(new_entry)
+                        logging.info("----revision {} by user {} saved".format(self.rev_new.rev_id, self.rev_new.contributor.con_id))
+                        self.actual_revisions += 1              
+
+        else:
+            # not the first revision of the article: parse wiki-text of prev. rev. (if not already parsed)
+            # compare new with old rev, save resulting lines
+            self.rev_old = self.rev_new
+            self.rev_new = Revision(rev_values, contributor)
+            
+            parse_revision = valid_revision and self.rev_new.size - self.rev_old.size >= self._REVSIZE_THRESHOLD and not self.rev_old.is_malformed
+            if parse_revision and self.pipeline is not None:
+                self.pipeline.add(self.rev_old, self.rev_new)
+            elif parse_revision:
+                self.usable_revisions += 1
+                result = self.parse_async(parse.parse_wiki_text, self.rev_new)
+
+                try:
+                    parsed = result.get(timeout=10)
+                    self.cache_parse(parse.parse_wiki_text, self.rev_new, parsed)
+                    self.rev_new.parsed_text, self.rev_new.is_malformed = parsed
+                except TimeoutError:
+                    logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
+                    self.rev_new.parsed_text = ""
+                    self.rev_new.is_malformed = True
+
+                    self.restart_pool()
+
+
+                if self.rev_old.parsed_text is None:
+                    result = self.parse_async(parse.parse_wiki_text, self.rev_old)
                     try:
-                        contributor = Contributor(rev_values['contr_id'], rev_values['username'], 
-                        rev_values['ip'])
-                    except ValueError:
-                        valid_revision = False
-
-                    self.md5hash_list.append(rev_values['sha1'])
-                    distance = self.md5hash_list.distance_to_ident_value()
-                    comment_match = None
-                    
-                    if rev_values['comment'] is not None:
-                        comment_match = regex.revert_comment.match(rev_values['comment'].lower())
-                    
-                    if rev_values['minor'] or rev_values['contr_id'] is None or distance != -1 or comment_match:
-                        valid_revision = False
+                        parsed = result.get(timeout=10)
+                        self.cache_parse(parse.parse_wiki_text, self.rev_old, parsed)
+                        self.rev_old.parsed_text, self.rev_old.is_malformed = parsed
+                    except TimeoutError:
+                        logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
+                        self.rev_old.parsed_text = ""
+                        self.rev_old.is_malformed = True
+
+                        self.restart_pool()
+
+                    if self.rev_old.is_malformed:
+                        self.usable_revisions -= 1
                         
-                    if self.rev_new is None:
-                        # first revision of the article: parse wiki-text and save entry
-                        self.rev_new = Revision(rev_values, contributor)
-
-                        if valid_revision and self.rev_new.wiki_text is not None:
-                            self.usable_revisions += 1
-                            result = self.pool.apply_async(parse.parse_wiki_text_cropped, (self.rev_new.wiki_text,))
-                            try:
-                                self.rev_new.parsed_text, cropped_text, self.rev_new.is_malformed = result.get(timeout=10)
-                            except TimeoutError:
-                                logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
-                                self.rev_new.parsed_text = ""
-                                cropped_text = ""
-                                self.rev_new.is_malformed = True
-
-                                self.pool.terminate()
-                                self.pool.join()
-                                self.pool = Pool(processes=2)
-
-                            if not self.rev_new.is_malformed:
-                                if len(cropped_text) >= 12:
-
-                                    new_entry = entry(self.rev_new.contributor.con_id, cropped_text, self.current_article.current_pos())
-                                    self.current_article.append(new_entry)
-                                    logging.info("----revision {} by user {} saved".format(self.rev_new.rev_id, self.rev_new.contributor.con_id))
-                                    self.actual_revisions += 1              
+                if not self.rev_old.is_malformed:
+                    diff_additions = []
+                    result = self.pool.apply_async(utils.get_additions, (self.rev_old.parsed_text, self.rev_new.parsed_text,))
+
+                    try:
+                        diff_additions = result.get(timeout=120)
+                    except TimeoutError:
+                        logging.warning("----revision {} diff calculation timed out".format(self.rev_new.rev_id))
+                        self.restart_pool()
+                   
+                    if not self.rev_new.is_malformed:
+                        if len(diff_additions) >= 12:
+                            new_entry = entry(self.rev_new.contributor.con_id, diff_additions, self.current_article.current_pos())
+                            self.current_article.append(new_entry)
+                            logging.info("----revision {} by user {} saved".format(self.rev_new.rev_id, self.rev_new.contributor.con_id))
+                            self.actual_revisions += 1
+        return False
 
-                    else:
-                        # not the first revision of the article: parse wiki-text of prev. rev. (if not already parsed)
-                        # compare new with old rev, save resulting lines
-                        self.rev_old = self.rev_new
-                        self.rev_new = Revision(rev_values, contributor)
-                        
-                        if valid_revision and self.rev_new.wiki_text is not None and self.rev_new.size - self.rev_old.size >= self._REVSIZE_THRESHOLD and not self.rev_old.is_malformed:
-                            self.usable_revisions += 1
-                            result = self.pool.apply_async(parse.parse_wiki_text, (self.rev_new.wiki_text,))
-
-                            try:
-                                self.rev_new.parsed_text, self.rev_new.is_malformed = result.get(timeout=10)
-                            except TimeoutError:
-                                logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
-                                self.rev_new.parsed_text = ""
-                                self.rev_new.is_malformed = True
-
-                                self.pool.terminate()
-                                self.pool.join()
-                                self.pool = Pool(processes=2)
-
-
-                            if self.rev_old.parsed_text is None:
-                                result = self.pool.apply_async(parse.parse_wiki_text, (self.rev_old.wiki_text,))
-                                try:
-                                    self.rev_old.parsed_text, self.rev_old.is_malformed = result.get(timeout=10)
-                                except TimeoutError:
-                                    logging.warning("----revision {} parsing timed out".format(self.rev_new.rev_id))
-                                    self.rev_old.parsed_text = ""
-                                    self.rev_old.is_malformed = True
-
-                                    self.pool.terminate()
-                                    self.pool.join()
-                                    self.pool = Pool(processes=2)
-
-                                if self.rev_old.is_malformed:
-                                    self.usable_revisions -= 1
-                                    
-                            if not self.rev_old.is_malformed:
-                                diff_additions = []
-                                result = self.pool.apply_async(utils.get_additions, (self.rev_old.parsed_text, self.rev_new.parsed_text,))
-
-                                try:
-                                    diff_additions = result.get(timeout=120)
-                                except TimeoutError:
-                                    logging.warning("----revision {} diff calculation timed out".format(self.rev_new.rev_id))
-                                    self.pool.terminate()
-                                    self.pool.join()
-                                    self.pool = Pool(processes=2)
-                               
-                                if not self.rev_new.is_malformed:
-                                    if len(diff_additions) >= 12:
-                                        new_entry = entry(self.rev_new.contributor.con_id, diff_additions, self.current_article.current_pos())
-                                        self.current_article.append(new_entry)
-                                        logging.info("----revision {} by user {} saved".format(self.rev_new.rev_id, self.rev_new.contributor.con_id))
-                                        self.actual_revisions += 1
-                
-                current_rev.clear()
-                break
 
-def init_logging(logfile):
+def log_stats(stats):
+    """Log the counters of a processed dump."""
+    logging.info("-----------------------------------------")
+    logging.info("revision delta size threshold: {}".format(WikiDump._REVSIZE_THRESHOLD))
+    logging.info("maximum revision per page: {}".format(WikiDump._MAX_REVISIONS))
+    logging.info("#########################################")
+    logging.info("usable pages: {:,} total pages: {:,}".format(stats['usable_pages'], stats['total_pages']))
+    logging.info("usable revisions: {:,};  total revisions (of usable pages): {:,} ({:,} of those skipped)".format(stats['usable_revisions'], stats['total_revisions'], stats['skipped_revisions']))
+    logging.info("actual revisions saved: {:,}".format(stats['actual_revisions']))
+    logging.info("worker restarts: {:,}".format(stats.get('worker_restarts', 0)))
+    logging.info("revisions processed in earlier runs: {:,}".format(stats.get('known_revisions', 0)))
+    logging.info("parses taken from the parse cache: {:,}".format(stats.get('cached_parses', 0)))
+    logging.info("-----------------------------------------")
+
+def init_logging(logfile, filemode='w'):
     """Initialize logging."""
     root_logger = logging.getLogger()
     for hdlr in root_logger.handlers:
@@ -405,7 +905,7 @@ def init_logging(logfile):
         datefmt='%Y/%m/%d %H:%M:%S',
         level=logging.DEBUG,
         filename=logfile,
-        filemode='w')
+        filemode=filemode)
 
     console = logging.StreamHandler()
     console.setLevel(logging.DEBUG)
@@ -417,6 +917,14 @@ def init_logging(logfile):
     etree.use_global_python_log(lxmlErrorLog)
 
 
+def make_outdir(path):
+    """Create the output directory path unless it exists (also created by another process meanwhile)."""
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
 def zip_backup(path, backup_path, filename):
     """Backup files collected in outdir_path."""
     logging.info("zip_backup({}, {}, {})\n\n\n\n\n\n".format(path, backup_path, filename))
@@ -428,9 +936,16 @@ def zip_backup(path, backup_path, filename):
 
     zf = zipfile.ZipFile(zipfile_name, "w", zipfile.ZIP_DEFLATED)
     for dirname, subdirs, files in os.walk(path):
-        zf.write(dirname)
-        for filename in files:
-            zf.write(os.path.join(dirname, filename))
+        # outputs of other processes which are not published yet
+        if leases.STAGING in subdirs:
+            subdirs.remove(leases.STAGING)
+        for name in [None] + files:
+            try:
+                zf.write(dirname if name is None else os.path.join(dirname, name))
+            except (OSError, IOError), e:
+                # moved or removed by another process meanwhile
+                if e.errno != errno.ENOENT:
+                    raise
     zf.close()
 
 def is_new_file(element):
@@ -444,25 +959,281 @@ def get_parameters(section):
     """Return config-parameters as a dictionary."""
     return dict(config.items(section))
 
-def process_file(f):
-    """Process a wikidump file."""
+def process_file(f, outdir):
+    """Process a wikidump file and return its stats."""
     start = time.clock()
-    wikidump = WikiDump(f, outdir_path)
+    if WikiDump._SHARDS > 1:
+        stats = process_file_sharded(f, outdir)
+    else:
+        wikidump = WikiDump(f, outdir)
+
+        try:
+            wikidump.process_dump()
+        except Exception:
+            logging.exception("Error while processing dump.")
+            raise
+        
+        stats = wikidump.get_stats()
+        del wikidump
+    elapsed = (time.clock() - start)
+    logging.info("Time elapsed: {}".format(elapsed))
+    logging.info("END")
+    return stats
+
+def file_staging_dir(f):
+    """Return the staging directory of a wikidump file processed by the scheduler."""
+    return leases.staging_dir(outdir_path, os.path.split(f)[1], "scheduler")
+
+def process_file_job(f):
+    """Process a wikidump file in a scheduler process into its staging directory and save its stats there."""
+    staging = file_staging_dir(f)
+    if not WikiDump._RESUME:
+        # outputs of an earlier failed run
+        shutil.rmtree(staging, ignore_errors=True)
+    stats = process_file(f, staging)
+    sharding.write_stats(file_stats_filename(staging, f), stats)
+    mark_file_finished(staging, f)
+
+def file_cost(f):
+    """Return the cores and the memory (bytes) processing a wikidump file takes."""
+    if WikiDump._PAGE_WORKERS > 0:
+        # reader, writer and page workers
+        processes, memory = WikiDump._PAGE_WORKERS + 2, WikiDump._FILE_MEMORY + WikiDump._SPOOL_SIZE
+    else:
+        processes, memory = WikiDump._PARSE_PROCESSES + 1, WikiDump._FILE_MEMORY
+    shards = max(WikiDump._SHARDS, 1)
+    return shards * processes + WikiDump._DECOMPRESS_PROCESSES, shards * memory
+
+def file_done(f, exitcode):
+    """Publish the outputs of a file processed by the scheduler, log its stats, delete and backup.
+
+    Running files write to their staging directories only, which
+    zip_backup skips, so the backup does not see half-written files.
+    """
+    staging = file_staging_dir(f)
+    if exitcode != 0:
+        logging.error("{} failed with exit code {}, outputs kept in {}".format(f, exitcode, staging))
+        return
+
+    stats = sharding.read_stats(file_stats_filename(staging, f))
+    leases.publish(staging, outdir_path)
+    logging.info("{} processed".format(f))
+    log_stats(stats)
+    if WikiDump._DEL_FILES:
+        os.remove(f)
+
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+    zipfilename = now +"_"+ os.path.splitext(os.path.split(f)[1])[0]
+    zip_backup(outdir_path, backup_path, zipfilename)
+
+def process_files_concurrently(path):
+    """Process the wikidump files in path (and files added meanwhile) concurrently."""
+    make_outdir(outdir_path)
+    init_logging(os.path.join(outdir_path, 'scheduler.log'))
+    cores = WikiDump._CORE_BUDGET or cpu_count()
+    file_scheduler = scheduler.FileScheduler(process_file_job, cores, WikiDump._MEMORY_BUDGET,
+        WikiDump._CONCURRENT_FILES)
+    skipped = set(f for f in list_dump_files(path) if file_finished(f))
+    file_scheduler.seen.update(skipped)
+    file_scheduler.run(lambda: sorted(list_dump_files(path)), file_cost, file_done)
+    logging.info("{} files processed.".format(len(file_scheduler.seen - skipped)))
+
+def process_file_sharded(f, outdir):
+    """Split a wikidump file into shards, process them in parallel and return the merged stats."""
+    page_costs = None
+    if WikiDump._PRESCAN and os.path.splitext(f)[1] == ".xml":
+        page_costs = [(page.offset, prescan.page_cost(page, WikiDump._MAX_REVISIONS, WikiDump._FILTER))
+            for page in prescan.load_scan(f)]
+    shards = sharding.plan_shards(f, WikiDump._SHARDS, page_costs)
+    processes = [Process(target=process_shard, args=(f, outdir, s)) for s in shards]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    dump_filename = os.path.splitext(os.path.split(f)[1])[0]
+    init_logging(os.path.join(outdir, dump_filename+'.log'))
+    logging.info("{} shards of {} processed".format(len(shards), f))
+    stats = []
+    failed = []
+    for s, p in zip(shards, processes):
+        if p.exitcode != 0:
+            logging.error("{} failed with exit code {}".format(s, p.exitcode))
+            failed.append(s)
+        else:
+            stats.append(sharding.read_stats(stats_filename(outdir, f, s)))
+
+    stats = sharding.merge_stats(stats)
+    log_stats(stats)
+    if failed:
+        raise RuntimeError("{} of {} shards failed".format(len(failed), len(shards)))
+    return stats
+
+def process_shard(f, outdir, shard):
+    """Process a single shard of a wikidump file and save its stats."""
+    wikidump = WikiDump(f, outdir, part=shard)
 
     try:
         wikidump.process_dump()
     except Exception:
-        logging.exception("Error while processing dump.")
+        logging.exception("Error while processing {}.".format(shard))
         raise
-    
-    del wikidump
-    elapsed = (time.clock() - start)
-    logging.info("Time elapsed: {}".format(elapsed))
-    logging.info("END")
+
+    sharding.write_stats(stats_filename(outdir, f, shard), wikidump.get_stats())
+
+def process_pages(f, index_path, page_ids, titles, outdir):
+    """Process selected pages of a multistream wikidump file, return False if no page is in the index."""
+    make_outdir(outdir)
+    init_logging(os.path.join(outdir, 'lookup.log'))
+    if index_path is None:
+        index_path = multistream.default_index_path(f)
+    page_index = multistream.open_table(index_path)
+    selection = page_index.select(f, page_ids, titles)
+    page_index.close()
+    if not selection.page_ids:
+        logging.error("none of the pages is in the index {}".format(index_path))
+        return False
+
+    wikidump = WikiDump(f, outdir, part=selection)
+    logging.info("processing {}".format(selection))
+    try:
+        wikidump.process_dump()
+    except Exception:
+        logging.exception("Error while processing pages.")
+        raise
+    return True
+
+def print_estimate(f):
+    """Pre-scan a wikidump file and print its estimated processing time."""
+    pages = prescan.load_scan(f, WikiDump._DECOMPRESS_PROCESSES)
+    result = prescan.estimate(pages, WikiDump._MAX_REVISIONS, WikiDump._FILTER)
+    shards = max(WikiDump._SHARDS, 1)
+    print "{}: {:,} pages ({:,} usable), {:,} revisions, {:,} MB text".format(
+        f, result['pages'], result['usable_pages'], result['revisions'], result['text_bytes'] // (1024 * 1024))
+    print "    estimated time: {} with {} shard(s) (largest page {})".format(
+        datetime.timedelta(seconds=int(max(result['seconds'] / shards, result['max_seconds']))),
+        shards, datetime.timedelta(seconds=int(result['max_seconds'])))
+
+def process_files_coordinated(path):
+    """Process the wikidump files in path together with other processes sharing the lease directory."""
+    queue = leases.LeaseQueue(WikiDump._LEASE_DIR or os.path.join(path, ".leases"), ttl=WikiDump._LEASE_TTL)
+    make_outdir(outdir_path)
+    init_logging(os.path.join(outdir_path, "coordinator_{}.log".format(queue.owner.replace(":", "_"))))
+    count = 0
+    while True:
+        units = dict((os.path.split(f)[1], f) for f in list_dump_files(path))
+        claimed = None
+        for unit in sorted(units):
+            if queue.claim(unit):
+                claimed = unit
+                break
+
+        if claimed is None:
+            if all(queue.is_finished(unit) for unit in units):
+                break
+            # units leased by other processes, they may die
+            time.sleep(WikiDump._HEARTBEAT)
+            continue
+
+        logging.info("{} claimed {}".format(queue.owner, claimed))
+        if process_claimed(queue, claimed, units[claimed]):
+            count += 1
+    logging.info("{} files processed by {}.".format(count, queue.owner))
+
+def process_claimed(queue, unit, f):
+    """Process a claimed wikidump file, publish its outputs and mark it done."""
+    staging = leases.staging_dir(outdir_path, unit, queue.owner)
+    p = Process(target=process_unit, args=(f, staging))
+    p.start()
+    while p.is_alive():
+        p.join(WikiDump._HEARTBEAT)
+        if p.is_alive() and not queue.heartbeat(unit):
+            logging.error("lease of {} lost, processing stopped".format(unit))
+            p.terminate()
+            p.join()
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+
+    if p.exitcode != 0:
+        logging.error("{} failed with exit code {}".format(f, p.exitcode))
+        queue.finish(unit, failed=True)
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+
+    if not queue.heartbeat(unit):
+        logging.error("lease of {} lost, outputs dropped".format(unit))
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+
+    stats = sharding.read_stats(file_stats_filename(staging, f))
+    leases.publish(staging, outdir_path)
+    queue.finish(unit, stats)
+    logging.info("{} processed".format(f))
+    log_stats(stats)
+    if WikiDump._DEL_FILES:
+        os.remove(f)
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M")
+    zip_backup(outdir_path, backup_path, now +"_"+ os.path.splitext(unit)[0])
+    return True
+
+def process_unit(f, staging):
+    """Process a claimed wikidump file into its staging directory and save its stats there."""
+    stats = process_file(f, staging)
+    sharding.write_stats(file_stats_filename(staging, f), stats)
+    mark_file_finished(staging, f)
+
+def list_dump_files(path):
+    """Return the dump files in path which can be read."""
+    list_dir = []
+    for codec in compression.available_codecs():
+        list_dir += glob.glob(os.path.join(path, "*" + codec.extension))
+    return list_dir
+
+def stats_filename(outdir, f, shard):
+    """Return path of the stats file of a shard."""
+    dump_filename = os.path.splitext(os.path.split(f)[1])[0]
+    return os.path.join(outdir, dump_filename+shard.suffix()+'.stats')
+
+def file_stats_filename(outdir, f):
+    """Return path of the stats file of a wikidump file."""
+    dump_filename = os.path.splitext(os.path.split(f)[1])[0]
+    return os.path.join(outdir, dump_filename+'.stats')
+
+def finished_filename(outdir, f):
+    """Return path of the marker of a finished wikidump file."""
+    dump_filename = os.path.splitext(os.path.split(f)[1])[0]
+    return os.path.join(outdir, dump_filename+'.finished')
+
+def mark_file_finished(outdir, f):
+    """Save the marker of a finished wikidump file in outdir."""
+    checkpoint.mark_finished(finished_filename(outdir, f), checkpoint.dump_identity(f))
+
+def file_finished(f):
+    """Return true if f was finished by an earlier run and is skipped (only with --resume)."""
+    if not WikiDump._RESUME or not checkpoint.is_finished(finished_filename(outdir_path, f),
+            checkpoint.dump_identity(f)):
+        return False
+    logging.info("{} finished in an earlier run, skipped".format(f))
+    return True
 
 if __name__ == '__main__':
     start = time.clock()
 
+    arg_parser = argparse.ArgumentParser(description="Extract articles of wikidump files with authorship attribution.")
+    arg_parser.add_argument('--estimate', action='store_true',
+        help="pre-scan the dump files and print their estimated processing time")
+    arg_parser.add_argument('--resume', action='store_true',
+        help="continue interrupted dump files after their last checkpoint")
+    arg_parser.add_argument('--lookup', metavar='DUMPFILE',
+        help="process only the selected pages of a multistream bz2 dump file")
+    arg_parser.add_argument('--index', metavar='INDEXFILE',
+        help="multistream index of DUMPFILE (default: *-multistream-index.txt.bz2 next to it)")
+    arg_parser.add_argument('--page-id', action='append', default=[],
+        help="id of a page to process (can be repeated)")
+    arg_parser.add_argument('--title', action='append', default=[],
+        help="title of a page to process (can be repeated)")
+    args = arg_parser.parse_args()
+
     config = ConfigParser.ConfigParser()
     config.read("config.cfg")
 
@@ -475,6 +1246,58 @@ if __name__ == '__main__':
     WikiDump._MAX_REVISIONS = int(param['max_revisions'])
     WikiDump._REVSIZE_THRESHOLD = int(param['revsize_threshold'])
     WikiDump._DEL_FILES = bool(int(param['del_files']))
+    WikiDump._DECOMPRESS_PROCESSES = int(param.get('decompress_processes', 0))
+    WikiDump._SHARDS = int(param.get('shards', 1))
+    WikiDump._READER = param.get('reader', 'streaming')
+    WikiDump._FAST_SKIP = bool(int(param.get('fast_skip', 1)))
+    if config.has_section('Filter'):
+        WikiDump._FILTER = filters.from_config(get_parameters('Filter'))
+    WikiDump._PRESCAN = bool(int(param.get('prescan', 0)))
+    WikiDump._PARSE_PROCESSES = int(param.get('parse_processes', 2))
+    WikiDump._WORKER_POOL = bool(int(param.get('worker_pool', 0)))
+    WikiDump._SPARE_WORKERS = int(param.get('spare_workers', 1))
+    WikiDump._PIPELINE_WINDOW = int(param.get('pipeline_window', 0))
+    WikiDump._PARALLEL_PAGES = bool(int(param.get('parallel_pages', 0)))
+    WikiDump._BATCH_SIZE = int(param.get('batch_size', 1))
+    WikiDump._PAGE_WORKERS = int(param.get('page_workers', 0))
+    WikiDump._SPOOL_SIZE = int(param.get('spool_size', 256)) * 1024 * 1024
+    WikiDump._CONCURRENT_FILES = int(param.get('concurrent_files', 1))
+    WikiDump._CORE_BUDGET = int(param.get('core_budget', 0))
+    WikiDump._MEMORY_BUDGET = int(param.get('memory_budget', 0)) * 1024 * 1024
+    WikiDump._FILE_MEMORY = int(param.get('file_memory', 1024)) * 1024 * 1024
+    WikiDump._COORDINATOR = bool(int(param.get('coordinator', 0)))
+    WikiDump._LEASE_DIR = param.get('lease_dir') or None
+    WikiDump._LEASE_TTL = int(param.get('lease_ttl', 300))
+    WikiDump._HEARTBEAT = int(param.get('heartbeat', 30))
+    WikiDump._CHECKPOINT_INTERVAL = int(param.get('checkpoint_interval', 0))
+    WikiDump._STATE_STORE = param.get('state_store') or None
+    WikiDump._MEMORY_LIMIT = int(param.get('memory_limit', 0)) * 1024 * 1024
+    WikiDump._SPILL_DIR = param.get('spill_dir') or None
+    WikiDump._RESUME = args.resume
+    parse.second_pass_engine = param.get('second_pass', 'regex')
+    parse.incremental_parse = bool(int(param.get('incremental_parse', 0)))
+    parse.deterministic_dummies = bool(int(param.get('deterministic_dummies', 0)))
+    WikiDump._PARSE_CACHE = int(param.get('parse_cache', 0))
+    WikiDump._PARSE_CACHE_PATH = param.get('parse_cache_path') or None
+
+    if args.estimate:
+        for f in sorted(list_dump_files(input_path)):
+            print_estimate(f)
+        sys.exit(0)
+
+    if args.lookup:
+        sys.exit(0 if process_pages(args.lookup, args.index, args.page_id, args.title, outdir_path) else 1)
+
+    for codec in compression.missing_codecs():
+        logging.warning("{} library missing, *{} files are ignored".format(codec.name, codec.extension))
+
+    if WikiDump._COORDINATOR:
+        process_files_coordinated(input_path)
+        sys.exit(0)
+
+    if WikiDump._CONCURRENT_FILES > 1:
+        process_files_concurrently(input_path)
+        sys.exit(0)
 
     files_to_process = deque()
     files_processed = []
@@ -482,19 +1305,21 @@ if __name__ == '__main__':
     count_files = 0
 
     while(still_files):
-        bz2_files = glob.glob(os.path.join(input_path, "*.bz2"))
-        xml_files = glob.glob(os.path.join(input_path, "*.xml"))
-        list_dir = bz2_files + xml_files
+        list_dir = list_dump_files(input_path)
         
         for f in filter(is_new_file, list_dir):
-            files_to_process.append(f)
+            if file_finished(f):
+                files_processed.append(f)
+            else:
+                files_to_process.append(f)
 
         if len(files_to_process) == 0:
             still_files = False
             break
 
         valid_file = files_to_process.popleft()
-        process_file(valid_file)
+        process_file(valid_file, outdir_path)
+        mark_file_finished(outdir_path, valid_file)
         count_files += 1
         if WikiDump._DEL_FILES:
             os.remove(valid_file)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - wikilexer module
+-----------------------------------------------------------
+
+Note:
+    Single pass lexer for the markup of regex.second_pass
+    (headings, comments, nowiki, tags, links, redirects, html
+    entities and lists). It finds the same matches as
+    regex.second_pass.sub, the alternatives are tried in the
+    same order at every position, but the end of every construct
+    is searched with str.find instead of backtracking over
+    (.|\\n)*? groups.
+
+    Links inside links are matched like the link pattern does
+    (one level). A link containing the rare single bracket form
+    "[x]]" is matched by the regular expression at its position.
+
+    Only positions where markup can start are visited, the
+    replacement of a match is computed by a function
+    replace(group, text, keep) (see parse.process_markup).
+
+    substitute_section also reports if the end of a section was
+    reached by a failed search (a comment, tag, link or entity
+    might end in the following text), see parse.parse_sections.
+-----------------------------------------------------------
+"""
+import re
+import regex
+
+SPACE = frozenset(" \t\n\r\f\v")
+LIST_CHARS = frozenset("*#:;|!")
+
+candidates = re.compile(r"[{<\[&]|\n(?=[=<*#:;|!])|^[=*#:;|!]|\s(?=\#REDIRECT)|\#(?=REDIRECT)",
+    flags=re.MULTILINE)
+space_run = re.compile(r"\s*")
+word_run = re.compile(r"\w*")
+word_char = re.compile(r"\w")
+list_run = re.compile(r"[*#:;|!]+")
+list_rest = re.compile(r"[^{\n]*")
+equal_signs = re.compile(r"={1,6}")
+tag_end = re.compile(r"[<>/]")
+entity_end = re.compile(r"[; ]")
+nowiki_end = re.compile(r"</\s*nowiki>")
+closing_tag = re.compile(r"</[\w\s]+>")
+bracket = re.compile(r"\[|\]\]")
+
+KEEP_GROUPS = {"link": "link_keep", "nowiki": "nowiki_keep", "single_link": "slink_keep"}
+
+
+class Fallback(Exception):
+    """Raised where the lexer leaves a match to the regular expression."""
+
+
+# section checked by substitute_section and whether its end was reached
+section = [None, False]
+
+def open_end(s):
+    """Note that a search for the end of a construct failed at the end of s."""
+    if s is section[0]:
+        section[1] = True
+
+def substitute_section(string, replace):
+    """Return (substitute(string, replace), True if a failed search reached the end of string)."""
+    section[:] = [string, False]
+    try:
+        return substitute(string, replace), section[1]
+    finally:
+        section[:] = [None, False]
+
+def substitute(string, replace):
+    """Return string with every match of regex.second_pass replaced by replace(group, text, keep)."""
+    out = []
+    last = 0
+    pos = 0
+    while True:
+        found = candidates.search(string, pos)
+        if found is None:
+            break
+        pos = found.start()
+        try:
+            match = match_at(string, pos)
+        except Fallback:
+            open_end(string)
+            match = regex_match(string, pos)
+        if match is None:
+            pos += 1
+            continue
+        end, group, keep = match
+        out.append(string[last:pos])
+        out.append(replace(group, string[pos:end], keep))
+        pos = last = end
+    out.append(string[last:])
+    return "".join(out)
+
+def regex_match(string, pos):
+    """Match regex.second_pass at pos, return (end, group, keep) or None."""
+    matched = regex.second_pass.match(string, pos)
+    if matched is None:
+        return None
+    group = matched.lastgroup
+    keep = matched.group(KEEP_GROUPS[group]) if group in KEEP_GROUPS else None
+    return matched.end(), group, keep
+
+def match_at(s, p):
+    """Return (end, group, keep) of the first alternative of second_pass matching at p (or None)."""
+    c = s[p]
+    newline = c == "\n"
+    # start of the alternatives with a \n? prefix
+    q = p + 1 if newline else p
+    line_start = newline or p == 0 or s[p - 1] == "\n"
+
+    if c == "{":
+        return space_run.match(s, p + 1).end(), "single_curbrac", None
+
+    if line_start and s.startswith("=", q):
+        end = match_heading(s, q)
+        if end is not None:
+            return end, "headings", None
+
+    if c == "<" and s.startswith("<!--", p):
+        found = find(s, "-->", p + 4)
+        if found != -1:
+            return skip_space_newline(s, found + 3), "comments", None
+        open_end(s)
+
+    if s.startswith("<", q):
+        if s.startswith("<nowiki>", q):
+            found = search(nowiki_end, s, q + 8)
+            if found is not None:
+                return found.end(), "nowiki", s[q + 8:found.start()]
+            open_end(s)
+        for match, group in ((match_regular_tag, "regular_tags"), (match_tag, "tags"),
+                (match_single_tag, "single_tags")):
+            end = match(s, q)
+            if end is not None:
+                return end, group, None
+
+    if s.startswith("[[", p):
+        end = match_link(s, p)
+        if end is not None:
+            return end, "link", s[p + 2:end - 2]
+
+    if c in SPACE or c == "#":
+        end = None
+        if c in SPACE:
+            end = match_redirect(s, p + 1)
+        if end is None:
+            end = match_redirect(s, p)
+        if end is not None:
+            return end, "redirect", None
+
+    if c == "&":
+        found = search(entity_end, s, p + 1)
+        if found is None:
+            open_end(s)
+        elif found.start() > p + 1 and s[found.start()] == ";":
+            return found.end(), "html_entities", None
+
+    if c == "[":
+        found = find_in_line(s, "]", p + 2, p)
+        if found != -1:
+            return found + 1, "single_link", s[p + 1:found]
+
+    if line_start and q < len(s) and s[q] in LIST_CHARS:
+        end = list_run.match(s, q).end()
+        end = list_rest.match(s, end).end()
+        return skip_space_newline(s, end), "lists", None
+
+    return None
+
+# needle or pattern -> (string, start, result) of its last search
+last_search = {}
+
+def find(s, needle, pos):
+    """Return s.find(needle, pos), repeated searches of a string reuse the last result."""
+    last = last_search.get(needle)
+    if last is not None and last[0] is s and last[1] <= pos and (last[2] == -1 or pos <= last[2]):
+        return last[2]
+    found = s.find(needle, pos)
+    last_search[needle] = (s, pos, found)
+    return found
+
+def search(pattern, s, pos):
+    """Return pattern.search(s, pos), repeated searches of a string reuse the last result."""
+    last = last_search.get(pattern)
+    if last is not None and last[0] is s and last[1] <= pos and (last[2] is None or pos <= last[2].start()):
+        return last[2]
+    found = pattern.search(s, pos)
+    last_search[pattern] = (s, pos, found)
+    return found
+
+def find_in_line(s, needle, pos, line_pos):
+    """Return the position of needle from pos in the line of line_pos (or -1)."""
+    found = find(s, needle, pos)
+    if found == -1 or found + len(needle) > find_line_end(s, line_pos):
+        return -1
+    return found
+
+# string, start and end of the last line found by find_line_end
+last_line = [None, 0, -1]
+
+def find_line_end(s, pos):
+    """Return the position of the newline ending the line of pos (or len(s))."""
+    if last_line[0] is s and last_line[1] <= pos <= last_line[2]:
+        return last_line[2]
+    end = s.find("\n", pos)
+    if end == -1:
+        end = len(s)
+    last_line[:] = [s, pos, end]
+    return end
+
+def skip_space_newline(s, pos):
+    """Skip \\s?\\n? at pos."""
+    if pos < len(s) and s[pos] in SPACE:
+        pos += 1
+    if pos < len(s) and s[pos] == "\n":
+        pos += 1
+    return pos
+
+def match_heading(s, q):
+    """Match ={1,6}.+?={1,6}\\s?\\n? at q."""
+    count = len(equal_signs.match(s, q).group())
+    for k in range(count, 0, -1):
+        # .+? takes at least one char, the heading ends at the next =
+        found = find_in_line(s, "=", q + k + 1, q)
+        if found != -1:
+            return skip_space_newline(s, equal_signs.match(s, found).end())
+    return None
+
+def is_word(char):
+    return word_char.match(char) is not None
+
+def match_regular_tag(s, q):
+    """Match <(?P<tagname>\\w*)(\\b[^>])*>((.|\\n)*?)</(?P=tagname)> at q."""
+    name_end = word_run.match(s, q + 1).end()
+    tries = [(s[q + 1:name_end], name_end)]
+    if name_end == q + 2:
+        # a one letter name can also be taken by (\b[^>])*
+        tries.append(("", q + 1))
+    for tagname, pos in tries:
+        while pos < len(s) and s[pos] != ">" and is_word(s[pos - 1]) != is_word(s[pos]):
+            pos += 1
+        if pos == len(s):
+            open_end(s)
+        elif s[pos] == ">":
+            found = find(s, "</" + tagname + ">", pos + 1)
+            if found != -1:
+                return found + len(tagname) + 3
+            open_end(s)
+    return None
+
+def match_tag(s, q):
+    """Match (<[^<>/]+>((.|\\n)*?))?</[\\w\\s]+> at q."""
+    found = search(tag_end, s, q + 1)
+    if found is None:
+        open_end(s)
+    elif found.start() > q + 1 and s[found.start()] == ">":
+        closing = search(closing_tag, s, found.end())
+        if closing is not None:
+            return closing.end()
+        open_end(s)
+    closing = closing_tag.match(s, q)
+    if closing is not None:
+        return closing.end()
+    return None
+
+def match_single_tag(s, q):
+    """Match <.+?/> at q."""
+    found = find_in_line(s, "/>", q + 2, q)
+    if found != -1:
+        return found + 2
+    return None
+
+def match_redirect(s, q):
+    """Match \\#REDIRECT\\s\\[\\[.+?\\]\\]([^\\s]+)? at q."""
+    if not s.startswith("#REDIRECT", q):
+        return None
+    pos = q + 9
+    if pos >= len(s) or s[pos] not in SPACE or not s.startswith("[[", pos + 1):
+        return None
+    pos += 3
+    found = find_in_line(s, "]]", pos + 1, pos)
+    if found == -1:
+        return None
+    end = found + 2
+    while end < len(s) and s[end] not in SPACE:
+        end += 1
+    return end
+
+def match_link(s, p):
+    """Match the link alternative at p, return its end (or None)."""
+    if find(s, "]]", p + 2) == -1:
+        open_end(s)
+        return None
+    return match_link_tail(s, p + 2, False)
+
+def match_link_tail(s, pos, in_line):
+    """Find the end of a link from pos, like (B)*?(C)*?\\]\\] after a lazy prefix.
+
+    B is a nested link followed by .*?, C the single bracket form
+    (raises Fallback). With in_line the prefix can not cross a
+    newline (.*?), else it can ((.|\\n)*?).
+    """
+    limit = find_line_end(s, pos) if in_line else len(s)
+    while pos <= limit:
+        found = bracket.search(s, pos, limit)
+        if found is None:
+            if not in_line:
+                open_end(s)
+            return None
+        pos = found.start()
+        if s.startswith("]]", pos):
+            return pos + 2
+        if pos + 3 < len(s) and s[pos + 1] != "[" and s[pos + 2:pos + 4] == "]]":
+            raise Fallback()
+        if s.startswith("[[", pos):
+            end = match_nested_link(s, pos)
+            if end is not None:
+                return end
+        pos += 1
+    return None
+
+def match_nested_link(s, r):
+    """Match \\[\\[(.|\\n)+?\\]\\] at r followed by the rest of the link."""
+    found = find(s, "]]", r + 3)
+    while found != -1:
+        end = match_link_tail(s, found + 2, True)
+        if end is not None:
+            return end
+        found = find(s, "]]", found + 1)
+    open_end(s)
+    return None
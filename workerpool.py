@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# WikidumpParser, Copyright 2014 Daniel Schneider.
+# schneider.dnl(at)gmail.com
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""WikidumpParser - workerpool module
+-----------------------------------------------------------
+
+Note:
+    Managed worker pool for parsing and diffing, a replacement
+    of multiprocessing.Pool (same apply_async interface). Every
+    worker runs one task at a time, a watchdog kills a worker
+    whose task runs longer than its timeout and puts a warm spare
+    in its place. Other tasks in flight are not affected.
+
+    The timeout of a task is the timeout of its get() (or the
+    watchdog limit of the pool if nobody waits for it yet), it is
+    measured from the start of the task on a worker.
+
+    Spares are forked in advance from the main process, which
+    has utils (and the punkt tokenizer) already loaded, and run
+    a warm-up sentence split. Forking needs Unix.
+-----------------------------------------------------------
+"""
+from collections import deque
+from multiprocessing import Pipe
+from multiprocessing import Process
+from multiprocessing import TimeoutError
+import logging
+import select
+import time
+import utils
+
+POLL_INTERVAL = 0.05
+WARM_UP_TEXT = "Worker started. Tokenizer loaded."
+
+
+class TaskTimeout(TimeoutError):
+    """Timeout of a single task, its worker was replaced (no other task is lost)."""
+
+
+class Task(object):
+    """Result of WorkerPool.apply_async (AsyncResult interface)."""
+
+    def __init__(self, pool, func, args):
+        self.pool, self.func, self.args = pool, func, args
+        self.timeout = None
+        self.started = None
+        self.done = False
+        self.ok, self.value = None, None
+
+    def finish(self, ok, value):
+        self.done, self.ok, self.value = True, ok, value
+
+    def ready(self):
+        if not self.done:
+            self.pool.pump(0)
+        return self.done
+
+    def successful(self):
+        return self.done and self.ok
+
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.time() + timeout
+        while not self.done and (end is None or time.time() < end):
+            self.pool.pump(POLL_INTERVAL)
+
+    def get(self, timeout=None):
+        """Return the result, raise TaskTimeout if the task runs longer than timeout seconds."""
+        if timeout is not None:
+            self.timeout = timeout
+        while not self.done:
+            self.pool.pump(POLL_INTERVAL)
+        if not self.ok:
+            raise self.value
+        return self.value
+
+
+class Worker(object):
+    """A worker process and the parent end of its pipe."""
+
+    def __init__(self):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=run_worker, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.task = None
+
+    def start(self, task):
+        task.started = time.time()
+        self.task = task
+        self.conn.send((task.func, task.args))
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    def __init__(self, processes, spares=1, watchdog=None):
+        """Initializes a WorkerPool object and starts its workers
+
+        Args:
+            processes: Number of worker processes.
+            spares: Number of warm workers kept in reserve for
+                    replacing killed workers.
+            watchdog: Maximum runtime of a task in seconds whose
+                    result nobody waits for yet (None for no limit).
+        """
+        self.workers = [Worker() for i in range(processes)]
+        self.spares = deque(Worker() for i in range(spares))
+        self.spare_count = spares
+        self.watchdog = watchdog
+        self.queue = deque()
+        self.restarts = 0
+
+    def apply_async(self, func, args=()):
+        task = Task(self, func, args)
+        self.queue.append(task)
+        self.pump(0)
+        return task
+
+    def pump(self, timeout):
+        """Start queued tasks on idle workers, collect results and kill stuck workers."""
+        self.dispatch()
+        busy = [w for w in self.workers if w.task is not None]
+        if not busy:
+            return
+        readable = select.select([w.conn for w in busy], [], [], timeout)[0]
+        now = time.time()
+        for worker in busy:
+            task = worker.task
+            if worker.conn in readable:
+                try:
+                    ok, value = worker.conn.recv()
+                except EOFError:
+                    # the worker died (e.g. out of memory)
+                    self.replace(worker, False, RuntimeError("worker process died"))
+                    continue
+                worker.task = None
+                task.finish(ok, value)
+            else:
+                limit = task.timeout if task.timeout is not None else self.watchdog
+                if limit is not None and now - task.started > limit:
+                    self.replace(worker, False, TaskTimeout("task timed out after {}s".format(limit)))
+        self.dispatch()
+
+    def dispatch(self):
+        for worker in self.workers:
+            if not self.queue:
+                break
+            if worker.task is None:
+                try:
+                    worker.start(self.queue.popleft())
+                except (IOError, OSError):
+                    self.replace(worker, False, RuntimeError("worker process died"))
+
+    def replace(self, worker, ok, value):
+        """Kill a worker, finish its task with value and put a spare in its place."""
+        worker.task.finish(ok, value)
+        worker.kill()
+        self.restarts += 1
+        logging.warning("worker replaced ({} restarts)".format(self.restarts))
+        self.workers[self.workers.index(worker)] = self.spares.popleft() if self.spares else Worker()
+        while len(self.spares) < self.spare_count:
+            self.spares.append(Worker())
+
+    def close(self):
+        """Let the workers finish the queued tasks and exit."""
+        while self.queue or any(w.task is not None for w in self.workers):
+            self.pump(POLL_INTERVAL)
+        for worker in self.workers + list(self.spares):
+            worker.stop()
+
+    def terminate(self):
+        for worker in self.workers + list(self.spares):
+            if worker.task is not None:
+                worker.task.finish(False, TaskTimeout("pool terminated"))
+            worker.kill()
+        self.queue.clear()
+
+    def join(self):
+        for worker in self.workers + list(self.spares):
+            worker.process.join()
+
+
+def warm_up():
+    """Run the tokenizer once so that its first real task is not slower."""
+    utils.split_sentences(WARM_UP_TEXT)
+
+def run_worker(conn):
+    """Worker process: run tasks from conn until None arrives."""
+    warm_up()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        func, args = job
+        try:
+            result = (True, func(*args))
+        except Exception, e:
+            result = (False, e)
+        conn.send(result)